@@ -1,44 +1,236 @@
-from django.contrib import admin
+import csv
+import io
+from datetime import datetime
+
+from django.contrib import admin, messages
+from django.db.models import Q
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
+from django.utils import timezone
+
+from . import icd, imports, overlaps, search
+from .filters import DashboardFilters
+from .forms import AppointmentImportForm
+from .pagination import ApproximateCountPaginator
 from .models import Patient, Provider, Diagnosis, Appointment, Encounter, Vitals, Procedure, ProcedureCategory
-from .models import CarePlan, CareStep, PainAssessment
+from .models import CarePlan, CareStep, PainAssessment, ExportJob
+
+
+_SEARCH_PREFIXES = {"^": "istartswith", "=": "iexact", "@": "search"}
+OVERLAPS_SHOWN = 500  # conjuntos listados no relatório de sobreposições
+
+
+class NameSearchMixin:
+    """
+    `search_name` / `<fk>__search_name` em search_fields buscam pelo índice de
+    palavras de clinic.search (prefixo, sem acento nem caixa) em vez de
+    icontains; os demais campos seguem a regra normal do admin.
+    """
 
+    def get_search_results(self, request, queryset, search_term):
+        fields = self.get_search_fields(request)
+        if not search_term or not any(search.is_name_field(f) for f in fields):
+            return super().get_search_results(request, queryset, search_term)
+        cond = Q()
+        for field in fields:
+            if search.is_name_field(field):
+                cond |= search.name_condition(self.model, field, search_term)
+            elif field[0] in _SEARCH_PREFIXES:
+                cond |= Q(**{f"{field[1:]}__{_SEARCH_PREFIXES[field[0]]}": search_term})
+            else:
+                cond |= Q(**{f"{field}__icontains": search_term})
+        return queryset.filter(cond), False
 
-admin.site.register(CarePlan)
-admin.site.register(CareStep)
-admin.site.register(PainAssessment)
+
+class LargeTableMixin:
+    """
+    Admin de tabela que cresce com a clínica: contagem aproximada/em cache
+    acima do limite (clinic.pagination) e sem o "N no total" da busca, que
+    seria um segundo COUNT(*) da tabela inteira. As relações de
+    list_select_related valem também fora do changelist — o autocomplete
+    mostra str(obj) de cada resultado.
+    """
+    paginator = ApproximateCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        qs = super().get_queryset(request)
+        if isinstance(self.list_select_related, (list, tuple)) and self.list_select_related:
+            qs = qs.select_related(*self.list_select_related)
+        return qs
+
+
+# o __str__ destes modelos navega até o paciente/procedimento
+@admin.register(CarePlan)
+class CarePlanAdmin(NameSearchMixin, LargeTableMixin, admin.ModelAdmin):
+    list_display = ("patient", "protocol", "diagnosis", "start_date", "goal_pain_score")
+    list_filter = ("protocol",)
+    date_hierarchy = "start_date"
+    search_fields = ("patient__search_name",)
+    list_select_related = ("patient",)
+    autocomplete_fields = ("patient",)
+    ordering = ("-id",)
+
+@admin.register(CareStep)
+class CareStepAdmin(NameSearchMixin, LargeTableMixin, admin.ModelAdmin):
+    list_display = ("care_plan", "procedure", "scheduled_at", "done_at")
+    list_filter = ("care_plan__protocol", "procedure__category")
+    date_hierarchy = "scheduled_at"
+    search_fields = ("care_plan__patient__search_name",)
+    list_select_related = ("care_plan__patient", "procedure")
+    autocomplete_fields = ("care_plan", "procedure")
+
+@admin.register(PainAssessment)
+class PainAssessmentAdmin(NameSearchMixin, LargeTableMixin, admin.ModelAdmin):
+    list_display = ("patient", "recorded_at", "score", "notes")
+    list_filter = ("score",)
+    date_hierarchy = "recorded_at"
+    search_fields = ("patient__search_name",)
+    list_select_related = ("patient",)
+    autocomplete_fields = ("patient", "encounter")
 
 @admin.register(Patient)
-class PatientAdmin(admin.ModelAdmin):
+class PatientAdmin(NameSearchMixin, LargeTableMixin, admin.ModelAdmin):
     list_display = ("full_name", "sex", "birth_date", "created_at")
-    search_fields = ("full_name",)
+    search_fields = ("search_name",)
+    ordering = ("search_name", "id")
 
 @admin.register(Provider)
-class ProviderAdmin(admin.ModelAdmin):
+class ProviderAdmin(NameSearchMixin, admin.ModelAdmin):
     list_display = ("full_name", "crm", "specialty")
     list_filter = ("specialty",)
-    search_fields = ("full_name", "crm")
+    search_fields = ("search_name", "=crm")
+    ordering = ("search_name", "id")
 
 @admin.register(Diagnosis)
 class DiagnosisAdmin(admin.ModelAdmin):
     list_display = ("code", "description")
     search_fields = ("code", "description")
+    ordering = ("code",)
+
+    def get_search_results(self, request, queryset, search_term):
+        # prefixo de código ou de palavras da descrição, pelo índice em memória (clinic.icd)
+        if not search_term:
+            return super().get_search_results(request, queryset, search_term)
+        return queryset.filter(pk__in=icd.index().search(search_term, limit=icd.MATCH_MAX)), False
 
 @admin.register(Appointment)
-class AppointmentAdmin(admin.ModelAdmin):
+class AppointmentAdmin(NameSearchMixin, LargeTableMixin, admin.ModelAdmin):
     list_display = ("patient", "provider", "scheduled_at", "status")
     list_filter = ("status", "provider__specialty")
     date_hierarchy = "scheduled_at"
-    search_fields = ("patient__full_name", "provider__full_name")
+    search_fields = ("patient__search_name", "provider__search_name")
+    list_select_related = ("patient", "provider")
+    autocomplete_fields = ("patient", "provider")
+    ordering = ("-scheduled_at",)
+    actions = ("mark_completed", "mark_no_show", "mark_cancelled")
+
+    # fechamento do dia: um UPDATE por bloco (clinic.imports.transition)
+    def _transition(self, request, queryset, status):
+        changed, created = imports.transition(queryset, status)
+        label = dict(Appointment.STATUS)[status]
+        message = f"{changed} consultas marcadas como “{label}”."
+        if created:
+            message += (f" {created} atendimentos abertos criados (entrada no horário da consulta, "
+                        f"sem saída): ficam fora das durações até a saída ser registrada.")
+        self.message_user(request, message, messages.SUCCESS)
+
+    @admin.action(description="Marcar como concluídas", permissions=["change"])
+    def mark_completed(self, request, queryset):
+        self._transition(request, queryset, "completed")
+
+    @admin.action(description="Marcar como não compareceu", permissions=["change"])
+    def mark_no_show(self, request, queryset):
+        self._transition(request, queryset, "no_show")
+
+    @admin.action(description="Marcar como canceladas", permissions=["change"])
+    def mark_cancelled(self, request, queryset):
+        self._transition(request, queryset, "cancelled")
+
+    def get_urls(self):
+        return [
+            path("import/", self.admin_site.admin_view(self.import_view), name="clinic_appointment_import"),
+            path("overlaps/", self.admin_site.admin_view(self.overlaps_view), name="clinic_appointment_overlaps"),
+            *super().get_urls(),
+        ]
+
+    def import_view(self, request):
+        """Upload de CSV para clinic.imports (mesmo formato de `manage.py import_appointments`)."""
+        if not self.has_add_permission(request):
+            return redirect("admin:clinic_appointment_changelist")
+        form = AppointmentImportForm(request.POST or None, request.FILES or None)
+        result = None
+        if request.method == "POST" and form.is_valid():
+            fh = io.TextIOWrapper(form.cleaned_data["file"].file, encoding="utf-8-sig", newline="")
+            reader = csv.DictReader(fh)
+            try:  # o cabeçalho já decodifica o primeiro bloco do arquivo
+                missing = [c for c in imports.REQUIRED if c not in (reader.fieldnames or [])]
+                if missing:
+                    form.add_error("file", f"Colunas obrigatórias ausentes: {', '.join(missing)}")
+                else:
+                    result = imports.import_rows(reader, dry_run=form.cleaned_data["dry_run"])
+            except UnicodeDecodeError:
+                form.add_error("file", "O arquivo não está em UTF-8.")
+        context = {
+            **self.admin_site.each_context(request),
+            "opts": self.opts,
+            "title": "Importar consultas",
+            "form": form,
+            "result": result,
+            "dry_run": form.is_bound and form.is_valid() and form.cleaned_data["dry_run"],
+            "columns": imports.COLUMNS,
+        }
+        return TemplateResponse(request, "admin/clinic/appointment/import.html", context)
+
+    def overlaps_view(self, request):
+        """Relatório de sobreposições (clinic.overlaps) na janela dos filtros da dashboard."""
+        if not self.has_view_permission(request):
+            return redirect("admin:index")
+        try:
+            filters = DashboardFilters.from_params(request.GET)
+        except ValueError:
+            filters = DashboardFilters.from_params({})
+        found = overlaps.cached_audit(filters)
+        shown = found[:OVERLAPS_SHOWN]
+        names = dict(Provider.objects.filter(pk__in={c.provider_id for c in shown})
+                     .values_list("id", "full_name"))
+        tz = timezone.get_current_timezone()
+        rows = [{
+            "kind": c.kind,
+            "provider": names.get(c.provider_id, c.provider_id),
+            "start": datetime.fromtimestamp(c.start, tz),
+            "end": datetime.fromtimestamp(c.end, tz),
+            "ids": c.ids,
+            "url": reverse(f"admin:clinic_{'appointment' if c.kind == 'appointments' else 'encounter'}_changelist")
+                   + "?id__in=" + ",".join(map(str, c.ids)),
+        } for c in shown]
+        context = {
+            **self.admin_site.each_context(request),
+            "opts": self.opts,
+            "title": "Sobreposições na agenda",
+            "filters": filters,
+            "rows": rows,
+            "total": len(found),
+        }
+        return TemplateResponse(request, "admin/clinic/appointment/overlaps.html", context)
+
 
 @admin.register(Encounter)
-class EncounterAdmin(admin.ModelAdmin):
+class EncounterAdmin(NameSearchMixin, LargeTableMixin, admin.ModelAdmin):
     list_display = ("patient", "provider", "check_in", "check_out")
+    autocomplete_fields = ("appointment", "patient", "provider", "diagnoses", "procedures")
     date_hierarchy = "check_in"
     list_filter = ("provider__specialty",)
+    search_fields = ("patient__search_name", "provider__search_name")
+    list_select_related = ("patient", "provider")
+    ordering = ("-check_in",)
 
 @admin.register(Vitals)
-class VitalsAdmin(admin.ModelAdmin):
+class VitalsAdmin(LargeTableMixin, admin.ModelAdmin):
     list_display = ("encounter", "height_cm", "weight_kg", "systolic", "diastolic", "heart_rate")
+    list_select_related = ("encounter__patient", "encounter__provider")
+    autocomplete_fields = ("encounter",)
 
 @admin.register(ProcedureCategory)
 class ProcedureCategoryAdmin(admin.ModelAdmin):
@@ -50,3 +242,10 @@ class ProcedureAdmin(admin.ModelAdmin):
     list_display = ("code", "name", "category", "duration_estimate_min", "requires_image_guidance", "price_brl")
     list_filter = ("category", "requires_image_guidance")
     search_fields = ("code", "name")
+    ordering = ("code",)
+
+@admin.register(ExportJob)
+class ExportJobAdmin(admin.ModelAdmin):
+    list_display = ("id", "format", "status", "rows_written", "rows_total", "size_bytes", "requested_by", "created_at")
+    list_filter = ("status", "format")
+    list_select_related = ("requested_by",)
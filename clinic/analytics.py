@@ -0,0 +1,307 @@
+"""
+Agregações analíticas compartilhadas pelas dashboards.
+
+Tudo aqui roda em número constante de queries, independente de quantos
+pacientes/planos existam na base.
+"""
+from django.db.models import Avg, Count, F, Max, Min, Q, Sum, Window
+from django.db.models.functions import RowNumber, TruncDate
+
+from .models import Appointment, CarePlan, CareStep, PainAssessment, Provider
+
+CURVE_WEEKS = 12       # pontos da curva média (semanas 0..11)
+REDUCTION_WEEK = 8     # redução medida entre o baseline e a semana 8
+
+# agrupamentos da análise de duração: (campo da chave, campo do rótulo)
+DURATION_GROUPS = {
+    "provider": ("provider_id", "provider__full_name"),
+    "specialty": ("provider__specialty", "provider__specialty"),
+    "procedure": ("procedures__code", "procedures__name"),
+}
+DURATION_BIN = 5            # minutos por faixa do histograma
+DURATION_PERCENTILES = (50, 90)
+
+
+def appointment_kpis(*appts):
+    """
+    Contagens por status e duração média dos atendimentos concluídos de
+    querysets de consultas (quente e, se for o caso, arquivo), numa query
+    agregada por queryset.
+    """
+    totals = dict.fromkeys(("total", "completed", "no_show", "cancelled", "encounters", "minutes"), 0)
+    for qs in appts:
+        done = Q(encounter__check_out__isnull=False)
+        row = qs.aggregate(
+            total=Count("id"),
+            completed=Count("id", filter=Q(status="completed")),
+            no_show=Count("id", filter=Q(status="no_show")),
+            cancelled=Count("id", filter=Q(status="cancelled")),
+            # Encounter.appointment é 1:1, então o JOIN não duplica consultas
+            encounters=Count("encounter__duration_min", filter=done),
+            minutes=Sum("encounter__duration_min", filter=done),
+        )
+        for k in totals:
+            totals[k] += row[k] or 0
+    total = totals["total"]
+    encounters = totals["encounters"]
+    return {
+        "total": total,
+        "completed": totals["completed"],
+        "no_show": totals["no_show"],
+        "cancelled": totals["cancelled"],
+        "completion_rate": round((totals["completed"] / total * 100), 1) if total else 0,
+        "no_show_rate": round((totals["no_show"] / total * 100), 1) if total else 0,
+        "avg_minutes": round(totals["minutes"] / encounters, 1) if encounters else 0,
+    }
+
+
+def daily_counts(*appts):
+    per_day = {}
+    for qs in appts:
+        daily_qs = (qs.annotate(day=TruncDate("scheduled_at"))
+                    .values("day").annotate(cnt=Count("id")).order_by("day"))
+        for d in daily_qs:
+            per_day[d["day"]] = per_day.get(d["day"], 0) + d["cnt"]
+    return [{"day": day.strftime("%Y-%m-%d"), "cnt": cnt} for day, cnt in sorted(per_day.items())]
+
+
+def specialty_counts(*appts):
+    per_spec = {}
+    for qs in appts:
+        by_spec_qs = (qs.values("provider__specialty")
+                      .annotate(cnt=Count("id")).order_by("-cnt"))
+        for r in by_spec_qs:
+            per_spec[r["provider__specialty"]] = per_spec.get(r["provider__specialty"], 0) + r["cnt"]
+    ranked = sorted(per_spec.items(), key=lambda kv: -kv[1])
+    return [{"spec": spec, "cnt": cnt} for spec, cnt in ranked]
+
+
+def procedure_revenue(*appts):
+    """Receita estimada (MVP): soma do preço dos procedimentos dos atendimentos concluídos."""
+    total = 0
+    for qs in appts:
+        row = (qs.filter(encounter__check_out__isnull=False)
+               .aggregate(revenue=Sum("encounter__procedures__price_brl")))
+        total += row["revenue"] or 0
+    return float(total)
+
+
+def expected_no_shows(since, until, provider_id=""):
+    """
+    Por dia: consultas agendadas entre `since` e `until`, quantas têm nota de
+    risco (NoShowScore) e a soma das probabilidades (no-shows esperados).
+    """
+    qs = Appointment.objects.filter(status="scheduled", scheduled_at__range=(since, until))
+    if provider_id:
+        qs = qs.filter(provider_id=provider_id)
+    rows = (qs.annotate(day=TruncDate("scheduled_at")).values("day")
+            .annotate(cnt=Count("id"), scored=Count("no_show_score"),
+                      expected=Sum("no_show_score__probability"))
+            .order_by("day"))
+    return [{"day": r["day"].strftime("%Y-%m-%d"), "cnt": r["cnt"], "scored": r["scored"],
+             "expected": round(r["expected"] or 0, 2)} for r in rows]
+
+
+# --- mesmas métricas a partir dos buckets do rollup (clinic.rollups) ---------
+
+def bucket_kpis(buckets):
+    total = sum(b.appointments for b in buckets)
+    by_status = {}
+    for b in buckets:
+        by_status[b.status] = by_status.get(b.status, 0) + b.appointments
+    completed = by_status.get("completed", 0)
+    no_show = by_status.get("no_show", 0)
+    encounters = sum(b.encounters for b in buckets)
+    minutes = sum(b.encounter_minutes for b in buckets)
+    return {
+        "total": total,
+        "completed": completed,
+        "no_show": no_show,
+        "cancelled": by_status.get("cancelled", 0),
+        "completion_rate": round((completed / total * 100), 1) if total else 0,
+        "no_show_rate": round((no_show / total * 100), 1) if total else 0,
+        "avg_minutes": round(minutes / encounters, 1) if encounters else 0,
+    }
+
+
+def bucket_daily(buckets):
+    per_day = {}
+    for b in buckets:
+        per_day[b.day] = per_day.get(b.day, 0) + b.appointments
+    return [{"day": day.strftime("%Y-%m-%d"), "cnt": cnt} for day, cnt in sorted(per_day.items())]
+
+
+def bucket_specialties(buckets):
+    specialty_of = dict(Provider.objects.values_list("id", "specialty"))
+    per_spec = {}
+    for b in buckets:
+        spec = specialty_of.get(b.provider_id)
+        per_spec[spec] = per_spec.get(spec, 0) + b.appointments
+    ranked = sorted(per_spec.items(), key=lambda kv: -kv[1])
+    return [{"spec": spec, "cnt": cnt} for spec, cnt in ranked]
+
+
+def bucket_revenue(buckets):
+    return float(sum(b.revenue_brl for b in buckets))
+
+
+def duration_stats(encounters, by="provider"):
+    """
+    Duração dos atendimentos concluídos de `encounters` agrupada por
+    profissional, especialidade ou procedimento, toda calculada no banco a
+    partir de Encounter.duration_min (3 queries, qualquer volume):
+
+    - contagem, média, mínimo e máximo por grupo;
+    - percentis por posição: ROW_NUMBER por grupo e só as linhas de rank
+      ceil(p% · n) voltam do banco;
+    - histograma em faixas de DURATION_BIN minutos.
+
+    Retorna [{"key", "label", "count", "avg", "min", "max", "p50", "p90",
+    "histogram": [{"bin", "cnt"}]}] ordenado pelo rótulo.
+    """
+    key, label = DURATION_GROUPS[by]
+    qs = encounters.filter(duration_min__isnull=False, **{f"{key}__isnull": False}).order_by()
+
+    groups = {}
+    summary = (qs.values(key, label)
+               .annotate(cnt=Count("id"), avg=Avg("duration_min"),
+                         lo=Min("duration_min"), hi=Max("duration_min"))
+               .order_by(label, key))
+    for r in summary:
+        groups[r[key]] = {
+            "key": r[key], "label": r[label], "count": r["cnt"],
+            "avg": round(r["avg"], 1), "min": r["lo"], "max": r["hi"],
+            **{f"p{p}": None for p in DURATION_PERCENTILES},
+            "histogram": [],
+        }
+
+    # rank do percentil em aritmética inteira: ceil(n·p/100) = (n·p + 99) / 100
+    ranked = (qs.annotate(
+                  rn=Window(RowNumber(), partition_by=F(key),
+                            order_by=[F("duration_min").asc(), F("id").asc()]),
+                  n=Window(Count("id"), partition_by=F(key)),
+              )
+              .filter(Q(*[Q(rn=(F("n") * p + 99) / 100) for p in DURATION_PERCENTILES],
+                        _connector=Q.OR))
+              .values_list(key, "rn", "n", "duration_min"))
+    for group, rn, n, minutes in ranked:
+        for p in DURATION_PERCENTILES:
+            if rn == (n * p + 99) // 100:
+                groups[group][f"p{p}"] = minutes
+
+    bins = (qs.annotate(bin=F("duration_min") / DURATION_BIN * DURATION_BIN)
+            .values_list(key, "bin").annotate(cnt=Count("id")).order_by(key, "bin"))
+    for group, start, cnt in bins:
+        groups[group]["histogram"].append({"bin": start, "cnt": cnt})
+
+    return list(groups.values())
+
+
+def merged_duration_stats(encounter_sets, by="provider"):
+    """
+    Mesmo resultado de `duration_stats` somando vários querysets de
+    atendimentos (tabelas quentes + arquivo). Percentis não se combinam a
+    partir de resumos, então cada queryset devolve a distribuição por minuto
+    de cada grupo (uma query; poucas linhas, já que as durações são inteiras
+    e curtas) e as estatísticas saem da distribuição somada.
+    """
+    key, label = DURATION_GROUPS[by]
+    labels, dist = {}, {}
+    for qs in encounter_sets:
+        rows = (qs.filter(duration_min__isnull=False, **{f"{key}__isnull": False})
+                .values_list(key, label, "duration_min").annotate(cnt=Count("id")).order_by())
+        for group, name, minutes, cnt in rows:
+            labels[group] = name
+            per_minute = dist.setdefault(group, {})
+            per_minute[minutes] = per_minute.get(minutes, 0) + cnt
+
+    data = []
+    for group in sorted(dist, key=lambda g: (labels[g], g)):
+        per_minute = sorted(dist[group].items())
+        n = sum(cnt for _, cnt in per_minute)
+        stats = {
+            "key": group, "label": labels[group], "count": n,
+            "avg": round(sum(m * cnt for m, cnt in per_minute) / n, 1),
+            "min": per_minute[0][0], "max": per_minute[-1][0],
+        }
+        for p in DURATION_PERCENTILES:
+            rank, seen = (n * p + 99) // 100, 0
+            for minutes, cnt in per_minute:
+                seen += cnt
+                if seen >= rank:
+                    stats[f"p{p}"] = minutes
+                    break
+        bins = {}
+        for minutes, cnt in per_minute:
+            # divisão inteira do banco: trunca em direção a zero
+            start = int(minutes / DURATION_BIN) * DURATION_BIN
+            bins[start] = bins.get(start, 0) + cnt
+        stats["histogram"] = [{"bin": b, "cnt": cnt} for b, cnt in sorted(bins.items())]
+        data.append(stats)
+    return data
+
+
+def pain_protocol_stats():
+    """
+    Redução média (baseline → semana 8) e curva média de dor por protocolo.
+
+    Para cada plano, as avaliações do paciente a partir de `start_date` são
+    numeradas por janela (ROW_NUMBER por plano) e só voltam do banco os
+    pontos que interessam: os 12 primeiros e o último de cada plano.
+    Retorna uma lista de {"protocol", "delta", "curve"} na ordem de
+    `CarePlan.PROTOCOLS`, omitindo protocolos sem nenhum plano.
+    """
+    with_plans = set(CarePlan.objects.values_list("protocol", flat=True).distinct())
+
+    rows = (
+        PainAssessment.objects
+        .filter(patient__care_plans__isnull=False)
+        .annotate(
+            plan_id=F("patient__care_plans__id"),
+            protocol=F("patient__care_plans__protocol"),
+            plan_start=F("patient__care_plans__start_date"),
+        )
+        .filter(recorded_at__gte=F("plan_start"))
+        .annotate(
+            rn=Window(RowNumber(), partition_by=F("plan_id"),
+                      order_by=[F("recorded_at").asc(), F("id").asc()]),
+            n=Window(Count("id"), partition_by=F("plan_id")),
+        )
+        .filter(Q(rn__lte=CURVE_WEEKS) | Q(rn=F("n")))
+        .order_by()
+        .values_list("plan_id", "protocol", "rn", "n", "score")
+    )
+
+    weekly = {}      # protocolo -> {semana: [escores]}
+    reductions = {}  # protocolo -> [reduções por plano]
+    baseline = {}    # plano -> primeiro escore
+    for plan_id, protocol, rn, n, score in rows:
+        if rn == 1:
+            baseline[plan_id] = score
+        if rn <= CURVE_WEEKS:
+            weekly.setdefault(protocol, {}).setdefault(rn - 1, []).append(score)
+
+        # baseline - semana 8 (ou - último ponto, se o plano ainda não chegou lá)
+        target = REDUCTION_WEEK + 1 if n > REDUCTION_WEEK else n
+        if n > 1 and rn == target:
+            reductions.setdefault(protocol, []).append((plan_id, score))
+
+    data = []
+    for code, label in CarePlan.PROTOCOLS:
+        if code not in with_plans:
+            continue
+        deltas = [baseline[pid] - score for pid, score in reductions.get(code, [])]
+        curve = [
+            {"week": i, "score": round(sum(v) / len(v), 2)}
+            for i, v in sorted(weekly.get(code, {}).items())
+        ]
+        delta = round(sum(deltas) / len(deltas), 2) if deltas else 0.0
+        data.append({"protocol": label, "delta": delta, "curve": curve})
+    return data
+
+
+def top_procedures(limit=8):
+    """Procedimentos mais frequentes nas etapas dos planos de cuidado."""
+    procs = (CareStep.objects.values("procedure__name")
+             .annotate(cnt=Count("id")).order_by("-cnt")[:limit])
+    return [{"label": r["procedure__name"], "cnt": r["cnt"]} for r in procs]
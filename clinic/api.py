@@ -0,0 +1,279 @@
+"""
+API JSON somente leitura para integrações (consultas e atendimentos).
+
+A paginação é por keyset: o cursor carrega o último (data, id) devolvido e a
+página seguinte começa logo depois dele, então a página N custa o mesmo que a
+primeira (sem OFFSET). Pacientes/profissionais vêm no mesmo SELECT e as
+relações N:N em uma query por página.
+"""
+import base64
+import json
+from datetime import datetime, time, timedelta
+from functools import wraps
+
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db.models import Prefetch, Q
+from django.http import Http404, JsonResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.http import http_date
+
+from . import icd, search, slots, timeline
+from .filters import DashboardFilters
+from .models import Diagnosis, Encounter, Patient, Procedure, Provider
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def _encode_cursor(moment, pk):
+    raw = json.dumps([moment.isoformat(), pk]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        moment, pk = json.loads(raw)
+        moment = parse_datetime(moment)
+        if moment is None:
+            raise ValueError
+        return moment, int(pk)
+    except (ValueError, TypeError):
+        raise BadRequest("cursor inválido")
+
+
+def _limit(params):
+    try:
+        limit = int(params.get("limit") or DEFAULT_LIMIT)
+    except ValueError:
+        raise BadRequest("limit inválido")
+    return max(1, min(limit, MAX_LIMIT))
+
+
+def keyset_page(qs, field, params):
+    """
+    Uma página de `qs` ordenada por (field, id) a partir do cursor em
+    `params`. Retorna (objetos, próximo_cursor ou None).
+    """
+    limit = _limit(params)
+    qs = qs.order_by(field, "id")
+    if params.get("cursor"):
+        moment, pk = _decode_cursor(params["cursor"])
+        qs = qs.filter(Q(**{f"{field}__gt": moment}) | Q(**{field: moment, "id__gt": pk}))
+    rows = list(qs[:limit + 1])
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, _encode_cursor(getattr(last, field), last.pk)
+
+
+def _filters(request):
+    try:
+        return DashboardFilters.from_params(request.GET)
+    except ValueError:
+        raise BadRequest("filtros inválidos")
+
+
+def _patient(p):
+    return {"id": p.pk, "full_name": p.full_name, "sex": p.sex,
+            "birth_date": p.birth_date.isoformat() if p.birth_date else None}
+
+
+def _provider(p):
+    return {"id": p.pk, "full_name": p.full_name, "specialty": p.specialty}
+
+
+def _api_view(view):
+    """staff_member_required + BadRequest convertido em 400 JSON."""
+    @staff_member_required
+    @wraps(view)
+    def wrapped(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except BadRequest as exc:
+            return JsonResponse({"error": str(exc)}, status=400)
+    return wrapped
+
+
+@_api_view
+def appointments(request):
+    """GET /api/appointments/?days|start&end|status|provider&limit&cursor"""
+    filters = _filters(request)
+    qs = filters.appointments().select_related("patient", "provider")
+    page, next_cursor = keyset_page(qs, "scheduled_at", request.GET)
+
+    procs = {}
+    links = (Encounter.procedures.through.objects
+             .filter(encounter__appointment_id__in=[a.pk for a in page])
+             .order_by("id")
+             .values_list("encounter__appointment_id", "procedure__code"))
+    for appt_id, code in links:
+        procs.setdefault(appt_id, []).append(code)
+
+    results = [{
+        "id": a.pk,
+        "scheduled_at": a.scheduled_at.isoformat(),
+        "status": a.status,
+        "patient": _patient(a.patient),
+        "provider": _provider(a.provider),
+        "procedures": procs.get(a.pk, []),
+    } for a in page]
+    return JsonResponse({"results": results, "next_cursor": next_cursor})
+
+
+@_api_view
+def encounters(request):
+    """GET /api/encounters/ — mesmos filtros, janela aplicada em check_in."""
+    filters = _filters(request)
+    qs = (Encounter.objects
+          .filter(check_in__range=(filters.since, filters.until))
+          .select_related("patient", "provider", "appointment")
+          .prefetch_related(
+              Prefetch("diagnoses", queryset=Diagnosis.objects.only("code", "description")),
+              Prefetch("procedures", queryset=Procedure.objects.only("code", "name")),
+          ))
+    if filters.status:
+        qs = qs.filter(appointment__status=filters.status)
+    if filters.provider_id:
+        qs = qs.filter(provider_id=filters.provider_id)
+    page, next_cursor = keyset_page(qs, "check_in", request.GET)
+
+    results = [{
+        "id": e.pk,
+        "appointment_id": e.appointment_id,
+        "status": e.appointment.status if e.appointment_id else None,
+        "check_in": e.check_in.isoformat(),
+        "check_out": e.check_out.isoformat() if e.check_out else None,
+        "duration_minutes": e.duration_minutes,
+        "reason": e.reason,
+        "patient": _patient(e.patient),
+        "provider": _provider(e.provider),
+        "diagnoses": [{"code": d.code, "description": d.description} for d in e.diagnoses.all()],
+        "procedures": [{"code": p.code, "name": p.name} for p in e.procedures.all()],
+    } for e in page]
+    return JsonResponse({"results": results, "next_cursor": next_cursor})
+
+
+@_api_view
+def lookup(request):
+    """GET /api/lookup/?q=joao sil&kind=patient|provider&limit — busca por nome sem acento."""
+    models = {"patient": (Patient, _patient), "provider": (Provider, _provider)}
+    kind = request.GET.get("kind") or "patient"
+    if kind not in models:
+        raise BadRequest("kind inválido")
+    try:
+        limit = int(request.GET.get("limit") or search.LOOKUP_LIMIT)
+    except ValueError:
+        raise BadRequest("limit inválido")
+    model, serialize = models[kind]
+    found = search.lookup(model, request.GET.get("q", ""), max(1, min(limit, search.LOOKUP_MAX)))
+    return JsonResponse({"results": [serialize(obj) for obj in found]})
+
+
+@_api_view
+def diagnosis_autocomplete(request):
+    """GET /api/diagnoses/autocomplete/?q=M54&limit — servido do índice em memória (clinic.icd)."""
+    try:
+        limit = int(request.GET.get("limit") or icd.AUTOCOMPLETE_LIMIT)
+    except ValueError:
+        raise BadRequest("limit inválido")
+    limit = max(1, min(limit, search.LOOKUP_MAX))
+    return JsonResponse({"results": icd.index().results(request.GET.get("q", ""), limit)})
+
+
+@_api_view
+def patient_timeline(request, patient_id):
+    """
+    GET /api/patients/<id>/timeline/?points — séries de dor (reduzida a
+    `points`) e etapas. ETag/Last-Modified pela última avaliação/etapa;
+    GET condicional com a versão atual responde 304 sem ler as séries.
+    """
+    try:
+        points = int(request.GET.get("points") or timeline.DEFAULT_POINTS)
+    except ValueError:
+        raise BadRequest("points inválido")
+    points = max(timeline.MIN_POINTS, min(points, timeline.MAX_POINTS))
+    if not Patient.objects.filter(pk=patient_id).exists():
+        raise Http404("Paciente não encontrado")
+
+    current = timeline.version(patient_id, points)
+    last_modified = int(current.last_modified.timestamp()) if current.last_modified else None
+    response = get_conditional_response(request, etag=current.etag, last_modified=last_modified)
+    if response is None:
+        response = JsonResponse({"patient_id": patient_id, **timeline.payload(patient_id, points)})
+    response["ETag"] = current.etag
+    if last_modified is not None:
+        response["Last-Modified"] = http_date(last_modified)
+    patch_cache_control(response, private=True, no_cache=True)  # sempre revalida
+    return response
+
+
+def _moment(value, name, end=False):
+    """Data (início do dia, ou fim com `end`) ou data/hora ISO; sem fuso vale o local."""
+    try:
+        if (day := parse_date(value)) is not None:
+            moment = datetime.combine(day + timedelta(days=1) if end else day, time.min)
+        else:
+            moment = parse_datetime(value)
+    except ValueError:
+        moment = None
+    if moment is None:
+        raise BadRequest(f"{name} inválido")
+    return timezone.make_aware(moment) if timezone.is_naive(moment) else moment
+
+
+@_api_view
+def free_slots(request):
+    """
+    GET /api/slots/?provider=<id>|specialty=<nome>&minutes=<n>|procedure=<código>
+    &start&end&limit — próximos horários livres (clinic.slots). Sem `minutes`,
+    vale a duração estimada do procedimento; sem os dois, a de uma consulta.
+    """
+    params = request.GET
+    provider_id = specialty = None
+    if params.get("provider"):
+        try:
+            provider_id = int(params["provider"])
+        except ValueError:
+            raise BadRequest("provider inválido")
+    elif params.get("specialty"):
+        specialty = params["specialty"]
+    else:
+        raise BadRequest("informe provider ou specialty")
+
+    try:
+        limit = int(params.get("limit") or slots.DEFAULT_LIMIT)
+        minutes = int(params["minutes"]) if params.get("minutes") else None
+    except ValueError:
+        raise BadRequest("limit/minutes inválido")
+    if minutes is None and params.get("procedure"):
+        minutes = (Procedure.objects.filter(code=params["procedure"])
+                   .values_list("duration_estimate_min", flat=True).first())
+        if minutes is None:
+            raise BadRequest("procedure desconhecido")
+    if minutes is None:
+        minutes = slots.schedule()["APPOINTMENT_MIN"]
+    if not 1 <= minutes <= 24 * 60:
+        raise BadRequest("minutes inválido")
+
+    since = _moment(params["start"], "start") if params.get("start") else timezone.now()
+    until = (_moment(params["end"], "end", end=True) if params.get("end")
+             else since + timedelta(days=slots.DEFAULT_DAYS))
+    if until <= since or until - since > timedelta(days=slots.MAX_DAYS):
+        raise BadRequest(f"período inválido (até {slots.MAX_DAYS} dias)")
+
+    providers, found = slots.find(minutes, since, until, provider_id=provider_id, specialty=specialty,
+                                  limit=max(1, min(limit, slots.MAX_LIMIT)))
+    return JsonResponse({"minutes": minutes, "slots": [{
+        "start": slot.start.isoformat(),
+        "end": slot.end.isoformat(),
+        "provider": {"id": slot.provider_id, "full_name": providers[slot.provider_id][0],
+                     "specialty": providers[slot.provider_id][1]},
+    } for slot in found]})
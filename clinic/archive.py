@@ -0,0 +1,175 @@
+"""
+Arquivo histórico da agenda (armazenamento frio).
+
+`manage.py archive_history` move consultas, atendimentos, sinais vitais e os
+vínculos de diagnósticos/procedimentos mais antigos que o horizonte
+(settings.CLINIC_ARCHIVE_AFTER_DAYS) para as tabelas Archived*, em blocos,
+cada um na sua transação. As tabelas quentes (e seus índices) ficam só com o
+período que a dashboard de fato consulta.
+
+As tabelas frias repetem ids, campos e nomes de relações das quentes, então
+as mesmas queries rodam nas duas. `sources()` devolve os querysets de
+consultas a ler para uma janela de filtros: o arquivo só entra quando a
+janela começa antes da consulta arquivada mais recente. Esse limite fica no
+cache de resultados; em outros processos, um arquivamento novo aparece em
+no máximo um TTL.
+
+Não são arquivados atendimentos referenciados por avaliações de dor (nem a
+consulta deles): a linha do tempo do paciente continua lendo só as tabelas
+quentes. A API de integração também lê só as tabelas quentes.
+"""
+from collections import namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from .cache import results
+from .models import (
+    Appointment, ArchivedAppointment, ArchivedEncounter, ArchivedVitals, Encounter, NoShowScore, Vitals,
+)
+
+ARCHIVE_TAG = "archive"
+DEFAULT_AFTER_DAYS = 365
+CHUNK_SIZE = 1000
+
+# relation: o atendimento visto de Diagnosis/Procedure (encounter__...);
+# link: o atendimento visto das tabelas M2M (Encounter.procedures.through)
+Storage = namedtuple("Storage", "name appointment encounter vitals relation link")
+HOT = Storage("hot", Appointment, Encounter, Vitals, "encounter", "encounter")
+COLD = Storage("cold", ArchivedAppointment, ArchivedEncounter, ArchivedVitals,
+               "archived_encounter", "archivedencounter")
+
+_APPOINTMENT_FIELDS = ("id", "patient_id", "provider_id", "scheduled_at", "status", "created_at")
+_ENCOUNTER_FIELDS = ("id", "appointment_id", "patient_id", "provider_id", "check_in", "check_out",
+                     "reason", "duration_min")
+_VITALS_FIELDS = ("id", "encounter_id", "height_cm", "weight_kg", "systolic", "diastolic", "heart_rate")
+
+
+def horizon():
+    """Instante a partir do qual as consultas ficam nas tabelas quentes."""
+    days = getattr(settings, "CLINIC_ARCHIVE_AFTER_DAYS", DEFAULT_AFTER_DAYS)
+    return timezone.now() - timedelta(days=days)
+
+
+def bounds(cached=True):
+    """
+    (primeira, última) consulta arquivada, ou (None, None) com o arquivo
+    vazio. Com `cached=False` lê do banco, sem o cache de resultados: quem
+    grava a partir disso (o rollup) não pode usar um limite de outro processo
+    ainda dentro do TTL.
+    """
+    def compute():
+        row = ArchivedAppointment.objects.aggregate(first=Min("scheduled_at"), last=Max("scheduled_at"))
+        return row["first"], row["last"]
+    if not cached:
+        return compute()
+    return results().get_or_compute(("archive_bounds",), compute, tags=[ARCHIVE_TAG])
+
+
+def reaches(since, cached=True):
+    """A janela que começa em `since` alcança o arquivo?"""
+    last = bounds(cached)[1]
+    return last is not None and since <= last
+
+
+def storages(since, cached=True):
+    """Armazenamentos a ler para uma janela que começa em `since` (frio primeiro)."""
+    return [COLD, HOT] if reaches(since, cached) else [HOT]
+
+
+def sources(filters):
+    """[(storage, consultas filtradas)], em ordem cronológica (arquivo primeiro)."""
+    return [(s, filters.appointments(s.appointment.objects.all())) for s in storages(filters.since)]
+
+
+def storage_of(model):
+    return COLD if model in (ArchivedAppointment, ArchivedEncounter, ArchivedVitals) else HOT
+
+
+# ---------------------------------------------------------------------------
+# arquivamento
+# ---------------------------------------------------------------------------
+
+def _copy(model, rows):
+    return model.objects.bulk_create([model(**r) for r in rows], batch_size=CHUNK_SIZE)
+
+
+def _move(appointment_ids, encounter_ids):
+    """Copia um bloco para o arquivo e apaga das tabelas quentes (já dentro da transação)."""
+    appts = list(Appointment.objects.filter(pk__in=appointment_ids).values(*_APPOINTMENT_FIELDS))
+    encs = list(Encounter.objects.filter(pk__in=encounter_ids).values(*_ENCOUNTER_FIELDS))
+    vitals = list(Vitals.objects.filter(encounter_id__in=encounter_ids).values(*_VITALS_FIELDS))
+    links = {}
+    for field in ("diagnoses", "procedures"):
+        m2m = Encounter._meta.get_field(field)
+        links[field] = list(m2m.remote_field.through.objects
+                            .filter(**{f"{m2m.m2m_column_name()}__in": encounter_ids})
+                            .order_by("id")  # mantém a ordem dos vínculos (exportação)
+                            .values_list(m2m.m2m_column_name(), m2m.m2m_reverse_name()))
+
+    _copy(ArchivedAppointment, appts)
+    _copy(ArchivedEncounter, encs)
+    _copy(ArchivedVitals, vitals)
+    for field, pairs in links.items():
+        m2m = ArchivedEncounter._meta.get_field(field)
+        through = m2m.remote_field.through
+        through.objects.bulk_create([
+            through(**{m2m.m2m_column_name(): enc, m2m.m2m_reverse_name(): other})
+            for enc, other in pairs
+        ], batch_size=CHUNK_SIZE)
+        getattr(Encounter, field).through.objects.filter(encounter_id__in=encounter_ids).delete()
+
+    Vitals.objects.filter(encounter_id__in=encounter_ids).delete()
+    Encounter.objects.filter(pk__in=encounter_ids).delete()
+    NoShowScore.objects.filter(appointment_id__in=appointment_ids).delete()  # notas não vão para o arquivo
+    Appointment.objects.filter(pk__in=appointment_ids).delete()
+    return len(appts), len(encs)
+
+
+def candidates(cutoff):
+    """
+    (consultas, atendimentos sem consulta) anteriores a `cutoff` que podem ir
+    para o arquivo: ficam de fora os atendimentos com avaliação de dor.
+    """
+    kept = Encounter.objects.filter(pain_assessments__isnull=False)
+    appointments = (Appointment.objects.filter(scheduled_at__lt=cutoff)
+                    .exclude(encounter__in=kept).order_by("scheduled_at", "id"))
+    loose = (Encounter.objects.filter(appointment__isnull=True, check_in__lt=cutoff)
+             .exclude(pk__in=kept).order_by("check_in", "id"))
+    return appointments, loose
+
+
+def archive_before(cutoff, chunk_size=CHUNK_SIZE, stdout=None):
+    """
+    Move para o arquivo as consultas com scheduled_at < `cutoff` (com
+    atendimento, sinais vitais e vínculos) e os atendimentos sem consulta com
+    check_in < `cutoff`. Cada bloco de `chunk_size` consultas é uma transação;
+    os signals da agenda ficam desligados, porque os totais do rollup não
+    mudam — ele passa a ler os dias arquivados do arquivo. Retorna
+    (consultas, atendimentos) movidos.
+    """
+    from .signals import suspended
+
+    appointments, loose = candidates(cutoff)
+    moved = [0, 0]
+    while True:
+        with transaction.atomic(), suspended():
+            appointment_ids = list(appointments.values_list("id", flat=True)[:chunk_size])
+            if appointment_ids:
+                encounter_ids = list(Encounter.objects.filter(appointment_id__in=appointment_ids)
+                                     .values_list("id", flat=True))
+            else:
+                encounter_ids = list(loose.values_list("id", flat=True)[:chunk_size])
+            if not encounter_ids and not appointment_ids:
+                break
+            appts, encs = _move(appointment_ids, encounter_ids)
+        moved[0] += appts
+        moved[1] += encs
+        if stdout is not None:
+            stdout.write(f"  {moved[0]} consultas / {moved[1]} atendimentos arquivados")
+
+    results().invalidate_tag(ARCHIVE_TAG)
+    return tuple(moved)
@@ -0,0 +1,147 @@
+"""
+Cache de resultados da dashboard, por processo.
+
+Guarda os payloads já calculados (séries, rankings, curvas...) chaveados pelo
+nome do bloco + filtros normalizados, com TTL e despejo LRU. Cada entrada
+registra os dias locais que cobre (ou uma tag, para blocos que não dependem
+do período), e os signals em clinic.signals invalidam só as entradas
+afetadas quando os dados mudam. Um valor cujo período ou tag foi invalidado
+enquanto era calculado é devolvido a quem pediu, mas não é guardado.
+
+Por ser local ao processo, em deploys com vários workers uma alteração só
+invalida o cache do worker que a recebeu; nos demais a defasagem máxima é
+o TTL.
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+
+from django.conf import settings
+
+DEFAULTS = {"MAX_ENTRIES": 256, "TTL": 120}
+# invalidações por período lembradas para os cálculos em andamento; um
+# cálculo mais antigo que a lembrança mais antiga não é guardado
+DAY_LOG = 1024
+
+
+class _Entry:
+    __slots__ = ("value", "expires", "span", "tags")
+
+    def __init__(self, value, expires, span, tags):
+        self.value = value
+        self.expires = expires
+        self.span = span
+        self.tags = tags
+
+
+class ResultCache:
+    def __init__(self, max_entries=DEFAULTS["MAX_ENTRIES"], ttl=DEFAULTS["TTL"]):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        # gerações: um valor calculado enquanto seu período/tag foi invalidado
+        # não é guardado (senão o valor velho voltaria ao cache até o TTL)
+        self._cleared = 0
+        self._tag_gen = {}
+        self._day_seq = 0
+        self._day_log = deque(maxlen=DAY_LOG)  # (seq, primeiro dia, último dia)
+        self.hits = self.misses = self.evictions = self.invalidations = self.discarded = 0
+
+    def get_or_compute(self, key, compute, span=None, tags=()):
+        """
+        Devolve o valor em cache para `key` ou calcula com `compute()`.
+        `span` = (primeiro_dia, último_dia) coberto pelo resultado;
+        `tags` = nomes para invalidação em grupo (ex.: "protocols").
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry.expires > now:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry.value
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            snapshot = (self._cleared, self._day_seq, [self._tag_gen.get(t, 0) for t in tags])
+
+        # calcula fora do lock; dois pedidos simultâneos podem calcular o mesmo bloco
+        value = compute()
+        with self._lock:
+            if self._invalidated_since(snapshot, span, tags):
+                self.discarded += 1
+                return value
+            self._data[key] = _Entry(value, time.monotonic() + self.ttl, span, frozenset(tags))
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def _invalidated_since(self, snapshot, span, tags):
+        cleared, day_seq, tag_gens = snapshot
+        if cleared != self._cleared or tag_gens != [self._tag_gen.get(t, 0) for t in tags]:
+            return True
+        if span is None or day_seq == self._day_seq:
+            return False
+        if not self._day_log or self._day_log[0][0] > day_seq + 1:
+            return True  # a lembrança não cobre o cálculo inteiro
+        return any(seq > day_seq and first <= span[1] and span[0] <= last
+                   for seq, first, last in self._day_log)
+
+    def _drop(self, predicate):
+        with self._lock:
+            stale = [k for k, e in self._data.items() if predicate(e)]
+            for k in stale:
+                del self._data[k]
+            self.invalidations += len(stale)
+        return len(stale)
+
+    def invalidate_days(self, first, last=None):
+        """Remove as entradas cujo período cruza [first, last]."""
+        last = last or first
+        with self._lock:
+            self._day_seq += 1
+            self._day_log.append((self._day_seq, first, last))
+        return self._drop(lambda e: e.span is not None and e.span[0] <= last and first <= e.span[1])
+
+    def invalidate_tag(self, tag):
+        with self._lock:
+            self._tag_gen[tag] = self._tag_gen.get(tag, 0) + 1
+        return self._drop(lambda e: tag in e.tags)
+
+    def clear(self):
+        with self._lock:
+            self._cleared += 1
+        return self._drop(lambda e: True)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "discarded": self.discarded,
+            }
+
+
+_results = None
+_results_lock = threading.Lock()
+
+
+def results():
+    """Instância do processo, configurada por settings.CLINIC_RESULT_CACHE."""
+    global _results
+    if _results is None:
+        with _results_lock:
+            if _results is None:
+                conf = {**DEFAULTS, **getattr(settings, "CLINIC_RESULT_CACHE", {})}
+                _results = ResultCache(max_entries=conf["MAX_ENTRIES"], ttl=conf["TTL"])
+    return _results
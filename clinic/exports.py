@@ -0,0 +1,236 @@
+"""
+Exportação de consultas em streaming e em segundo plano.
+
+As linhas saem de uma varredura por keyset em (scheduled_at, id): cada bloco
+é uma query curta, e os procedimentos do bloco vêm numa query só. A memória
+fica constante independente do tamanho do período exportado.
+
+Janelas que alcançam o arquivo histórico percorrem as consultas arquivadas
+e as quentes (clinic.archive.sources) e intercalam as duas varreduras.
+
+`run_job()` grava a mesma varredura num arquivo gzip (CSV ou NDJSON) para os
+ExportJob processados por `manage.py run_export_jobs`.
+"""
+import csv
+import gzip
+import heapq
+import itertools
+import json
+import os
+from dataclasses import replace
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import archive
+from .filters import DashboardFilters
+from .models import Appointment, ExportJob, Patient
+
+# job "running" sem sinal de vida (heartbeat_at) há mais que isso: o worker
+# morreu, e o job volta a ser pego por outro
+STALE_AFTER = timedelta(minutes=10)
+
+HEADER = ["Data/Hora", "Paciente", "Sexo", "Nasc", "Médico", "Especialidade", "Status", "Procedimentos"]
+CHUNK_SIZE = 2000
+
+_FIELDS = (
+    "id", "scheduled_at", "patient__full_name", "patient__sex", "patient__birth_date",
+    "provider__full_name", "provider__specialty", "status",
+)
+_SEX = dict(Patient.SEX_CHOICES)
+_STATUS = dict(Appointment.STATUS)
+
+
+def appointment_chunks(qs, chunk_size=CHUNK_SIZE):
+    """
+    Percorre `qs` (consultas quentes ou arquivadas) em blocos ordenados por
+    (scheduled_at, id). Cada bloco é uma lista de dicts (valores de _FIELDS +
+    "procedures", lista de nomes).
+    """
+    storage = archive.storage_of(qs.model)
+    link, through = storage.link, storage.encounter.procedures.through
+    qs = qs.order_by("scheduled_at", "id").values(*_FIELDS)
+    after = None
+    while True:
+        page = qs
+        if after is not None:
+            page = qs.filter(Q(scheduled_at__gt=after[0]) | Q(scheduled_at=after[0], id__gt=after[1]))
+        rows = list(page[:chunk_size])
+        if not rows:
+            return
+
+        procs = {}
+        links = (through.objects
+                 .filter(**{f"{link}__appointment_id__in": [r["id"] for r in rows]})
+                 .order_by("id")
+                 .values_list(f"{link}__appointment_id", "procedure__name"))
+        for appt_id, name in links:
+            procs.setdefault(appt_id, []).append(name)
+        for r in rows:
+            r["procedures"] = procs.get(r["id"], [])
+
+        yield rows
+        if len(rows) < chunk_size:
+            return
+        after = (rows[-1]["scheduled_at"], rows[-1]["id"])
+
+
+def csv_row(r):
+    birth = r["patient__birth_date"]
+    return [
+        timezone.localtime(r["scheduled_at"]).strftime("%d/%m/%Y %H:%M"),
+        r["patient__full_name"],
+        _SEX.get(r["patient__sex"], r["patient__sex"]),
+        birth.strftime("%d/%m/%Y") if birth else "",
+        r["provider__full_name"],
+        r["provider__specialty"],
+        _STATUS.get(r["status"], r["status"]),
+        "; ".join(r["procedures"]),
+    ]
+
+
+class _Echo:
+    """Pseudo-arquivo: o csv.writer devolve a linha formatada em vez de gravar."""
+
+    def write(self, value):
+        return value
+
+
+def filter_chunks(filters, chunk_size=CHUNK_SIZE):
+    """
+    Blocos de todas as consultas da janela. Com arquivo, as duas varreduras
+    são intercaladas por (scheduled_at, id): consultas antigas que ficaram
+    nas tabelas quentes (com avaliação de dor) saem na posição certa.
+    """
+    sources = archive.sources(filters)
+    if len(sources) == 1:
+        yield from appointment_chunks(sources[0][1], chunk_size)
+        return
+    streams = [(r for rows in appointment_chunks(qs, chunk_size) for r in rows) for _, qs in sources]
+    merged = heapq.merge(*streams, key=lambda r: (r["scheduled_at"], r["id"]))
+    while rows := list(itertools.islice(merged, chunk_size)):
+        yield rows
+
+
+def csv_lines(filters, chunk_size=CHUNK_SIZE):
+    """Gera o CSV linha a linha (cabeçalho primeiro, antes de qualquer query)."""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(HEADER)
+    for rows in filter_chunks(filters, chunk_size):
+        for r in rows:
+            yield writer.writerow(csv_row(r))
+
+
+def ndjson_row(r):
+    birth = r["patient__birth_date"]
+    return {
+        "id": r["id"],
+        "scheduled_at": timezone.localtime(r["scheduled_at"]).isoformat(),
+        "patient": r["patient__full_name"],
+        "sex": r["patient__sex"],
+        "birth_date": birth.isoformat() if birth else None,
+        "provider": r["provider__full_name"],
+        "specialty": r["provider__specialty"],
+        "status": r["status"],
+        "procedures": r["procedures"],
+    }
+
+
+# ---------------------------------------------------------------------------
+# exportações em segundo plano
+# ---------------------------------------------------------------------------
+
+def exports_dir():
+    path = Path(getattr(settings, "CLINIC_EXPORTS_DIR", settings.BASE_DIR / "exports"))
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def job_path(job):
+    return exports_dir() / job.file_name if job.file_name else None
+
+
+def job_params(filters):
+    """
+    Parâmetros de um ExportJob para `filters`. A janela vai resolvida
+    (since/until absolutos): um job que espera na fila exporta o período que
+    o usuário viu, não "os últimos N dias" da hora em que roda.
+    """
+    return {
+        "days": filters.days,
+        "start": filters.start.isoformat() if filters.start else "",
+        "end": filters.end.isoformat() if filters.end else "",
+        "status": filters.status,
+        "provider": filters.provider_id,
+        "since": filters.since.isoformat(),
+        "until": filters.until.isoformat(),
+    }
+
+
+def job_filters(job):
+    filters = DashboardFilters.from_params(job.params)
+    if job.params.get("since"):
+        filters = replace(filters, since=parse_datetime(job.params["since"]),
+                          until=parse_datetime(job.params["until"]))
+    return filters
+
+
+def claim_next_job():
+    """
+    Pega o próximo job da fila — ou um "running" abandonado por um worker que
+    morreu (sem heartbeat há STALE_AFTER). O UPDATE condicional evita dois
+    workers no mesmo job.
+    """
+    now = timezone.now()
+    claimable = Q(status="pending") | Q(status="running", heartbeat_at__lt=now - STALE_AFTER)
+    for job in ExportJob.objects.filter(claimable).order_by("created_at", "id")[:10]:
+        claimed = (ExportJob.objects.filter(claimable, pk=job.pk)
+                   .update(status="running", started_at=now, heartbeat_at=now, rows_written=0, error=""))
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def run_job(job, chunk_size=CHUNK_SIZE):
+    """
+    Gera o arquivo do job em blocos, atualizando o progresso a cada bloco.
+    O arquivo é escrito como .part e renomeado no fim, então um download
+    nunca vê um gzip pela metade.
+    """
+    written = 0
+    try:
+        filters = job_filters(job)
+        job.file_name = job.download_name
+        job.rows_total = sum(qs.count() for _, qs in archive.sources(filters))
+        job.save(update_fields=["file_name", "rows_total"])
+
+        final = job_path(job)
+        partial = final.with_name(final.name + ".part")
+        with gzip.open(partial, "wt", encoding="utf-8", newline="") as fh:
+            writer = csv.writer(fh) if job.format == "csv" else None
+            if writer:
+                writer.writerow(HEADER)
+            for rows in filter_chunks(filters, chunk_size):
+                for r in rows:
+                    if writer:
+                        writer.writerow(csv_row(r))
+                    else:
+                        fh.write(json.dumps(ndjson_row(r), ensure_ascii=False) + "\n")
+                written += len(rows)
+                ExportJob.objects.filter(pk=job.pk).update(rows_written=written, heartbeat_at=timezone.now())
+        os.replace(partial, final)
+
+        job.size_bytes = final.stat().st_size
+        job.status = "done"
+    except Exception as exc:  # o job registra a falha; o worker segue para o próximo
+        job.status = "failed"
+        job.error = f"{type(exc).__name__}: {exc}"
+    job.rows_written = written
+    job.finished_at = timezone.now()
+    job.save(update_fields=["rows_written", "size_bytes", "status", "error", "finished_at"])
+    return job
@@ -0,0 +1,77 @@
+"""
+Filtros da dashboard (days/start/end/status/provider), compartilhados pela
+dashboard, pela exportação CSV e pelo cache de resultados.
+"""
+from dataclasses import dataclass, field
+from datetime import date, datetime, time, timedelta
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import Appointment
+
+DEFAULT_DAYS = 30
+MAX_DAYS = 3650  # "últimos N dias" até 10 anos
+STATUSES = {code for code, _ in Appointment.STATUS}
+
+
+@dataclass(frozen=True)
+class DashboardFilters:
+    days: int = DEFAULT_DAYS
+    start: date | None = None
+    end: date | None = None
+    status: str = ""
+    provider_id: str = ""
+    # janela efetiva, fixada no momento do parse (extremos inclusivos)
+    since: datetime | None = field(default=None, compare=False)
+    until: datetime | None = field(default=None, compare=False)
+
+    @classmethod
+    def from_params(cls, params):
+        """
+        Normaliza os parâmetros da querystring. Lança ValueError para valores
+        inválidos (dias/médico não numéricos, dias fora de 1..MAX_DAYS, status
+        desconhecido).
+        """
+        days = int(params.get("days") or DEFAULT_DAYS)  # fallback quando não há start/end
+        if not 1 <= days <= MAX_DAYS:
+            raise ValueError(f"days fora de 1..{MAX_DAYS}: {days}")
+        status = params.get("status") or ""
+        if status and status not in STATUSES:
+            raise ValueError(f"status inválido: {status}")
+        provider = params.get("provider") or ""
+        provider_id = str(int(provider)) if provider else ""
+
+        start = parse_date(params.get("start") or "")
+        end = parse_date(params.get("end") or "")
+        # período: se vier start/end válidos usa; senão usa "days"
+        if start and end:
+            since = timezone.make_aware(datetime.combine(start, time.min))
+            until = timezone.make_aware(datetime.combine(end, time.max))
+        else:
+            start = end = None
+            until = timezone.now()
+            since = until - timedelta(days=days)
+        return cls(days=days, start=start, end=end, status=status, provider_id=provider_id,
+                   since=since, until=until)
+
+    @property
+    def span(self):
+        """Primeiro e último dia local cobertos pela janela."""
+        return timezone.localdate(self.since), timezone.localdate(self.until)
+
+    @property
+    def key(self):
+        """Chave estável para cache: janelas relativas ('últimos N dias') não
+        incluem o instante atual, então expiram pelo TTL do cache."""
+        period = ("range", self.start, self.end) if self.start else ("days", self.days)
+        return (*period, self.status, self.provider_id)
+
+    def appointments(self, qs=None):
+        qs = Appointment.objects.all() if qs is None else qs
+        qs = qs.filter(scheduled_at__range=(self.since, self.until))
+        if self.status:
+            qs = qs.filter(status=self.status)
+        if self.provider_id:
+            qs = qs.filter(provider_id=self.provider_id)
+        return qs
@@ -25,4 +25,8 @@ class StaffSignupForm(UserCreationForm):
         user.is_active  = True         # já pode entrar (sem aprovação)
         if commit:
             user.save()
-        return user
\ No newline at end of file
+        return user
+
+class AppointmentImportForm(forms.Form):
+    file = forms.FileField(label="Arquivo CSV", help_text="UTF-8, separado por vírgulas, com cabeçalho.")
+    dry_run = forms.BooleanField(label="Só validar (não grava)", required=False)
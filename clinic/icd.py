@@ -0,0 +1,105 @@
+"""
+Autocomplete de diagnósticos (CID) em memória.
+
+O catálogo de diagnósticos é pequeno e quase estático, e o prefixo do código
+("M54") é digitado o tempo todo. Em vez de icontains no banco, cada processo
+mantém dois arrays ordenados: códigos normalizados (sem ponto, maiúsculos:
+"M54.5" → "M545") e palavras das descrições dobradas por clinic.search.fold.
+Um prefixo vira uma busca binária (bisect) seguida de uma leitura contígua.
+
+O índice é montado na primeira busca e descartado pelos signals de Diagnosis
+(clinic.signals) e, como o cache de resultados, expira pelo TTL
+(CLINIC_RESULT_CACHE) — alterações feitas em outro processo aparecem em no
+máximo esse tempo.
+"""
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+
+from .cache import DEFAULTS
+from .models import Diagnosis
+from .search import fold
+
+AUTOCOMPLETE_LIMIT = 20
+MATCH_MAX = 1000  # teto de ids devolvidos ao admin (vira um IN na query)
+
+_index = None
+_lock = threading.Lock()
+
+
+def normalize_code(code):
+    return "".join((code or "").split()).replace(".", "").upper()
+
+
+class PrefixIndex:
+    """Pares (chave, id) ordenados; `ids(prefix)` em O(log n + resultados)."""
+
+    def __init__(self, pairs):
+        pairs = sorted(pairs)
+        self.keys = [k for k, _ in pairs]
+        self.values = [v for _, v in pairs]
+
+    def ids(self, prefix):
+        found = []
+        i = bisect_left(self.keys, prefix)
+        while i < len(self.keys) and self.keys[i].startswith(prefix):
+            found.append(self.values[i])
+            i += 1
+        return found
+
+
+class DiagnosisIndex:
+    def __init__(self, rows):
+        # id -> (código, descrição, código normalizado, descrição dobrada)
+        self.rows = {pk: (code, description, normalize_code(code), fold(description))
+                     for pk, code, description in rows}
+        self.codes = PrefixIndex((row[2], pk) for pk, row in self.rows.items())
+        self.words = PrefixIndex((word, pk) for pk, row in self.rows.items()
+                                 for word in set(row[3].split()))
+        self.expires = time.monotonic() + _ttl()
+
+    def search(self, query, limit=AUTOCOMPLETE_LIMIT):
+        """
+        Ids dos diagnósticos cujo código começa por `query` (em ordem de
+        código) seguidos dos que têm, para cada palavra da busca, uma palavra
+        da descrição começando por ela (em ordem de descrição).
+        """
+        found = []
+        code = normalize_code(query)
+        if code:
+            found = sorted(self.codes.ids(code), key=lambda pk: (self.rows[pk][2], pk))
+        words = fold(query).split()
+        if words:
+            matching = set.intersection(*(set(self.words.ids(w)) for w in words))
+            seen = set(found)
+            found += sorted((pk for pk in matching if pk not in seen),
+                            key=lambda pk: (self.rows[pk][3], pk))
+        return found[:limit] if limit else found
+
+    def results(self, query, limit=AUTOCOMPLETE_LIMIT):
+        return [{"id": pk, "code": self.rows[pk][0], "description": self.rows[pk][1]}
+                for pk in self.search(query, limit)]
+
+
+def _ttl():
+    return {**DEFAULTS, **getattr(settings, "CLINIC_RESULT_CACHE", {})}["TTL"]
+
+
+def index():
+    """Índice do processo, montado (uma query) na primeira busca ou depois de expirar."""
+    global _index
+    current = _index
+    if current is None or current.expires <= time.monotonic():
+        with _lock:
+            if _index is None or _index.expires <= time.monotonic():
+                _index = DiagnosisIndex(Diagnosis.objects.values_list("id", "code", "description"))
+            current = _index
+    return current
+
+
+def invalidate():
+    global _index
+    with _lock:
+        _index = None
@@ -0,0 +1,42 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from clinic import archive, pagination
+
+
+class Command(BaseCommand):
+    help = ("Move consultas/atendimentos mais antigos que o horizonte para as tabelas de "
+            "arquivo (settings.CLINIC_ARCHIVE_AFTER_DAYS)")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int,
+                            help="horizonte em dias (padrão: settings.CLINIC_ARCHIVE_AFTER_DAYS)")
+        parser.add_argument("--chunk-size", type=int, default=archive.CHUNK_SIZE,
+                            help="consultas por transação")
+        parser.add_argument("--dry-run", action="store_true",
+                            help="só conta o que seria arquivado")
+
+    def handle(self, *args, **opts):
+        if opts["days"] is not None and opts["days"] < 0:
+            raise CommandError("--days não pode ser negativo.")
+        if opts["chunk_size"] < 1:
+            raise CommandError("--chunk-size deve ser positivo.")
+        cutoff = (archive.horizon() if opts["days"] is None
+                  else timezone.now() - timedelta(days=opts["days"]))
+        self.stdout.write(f"Arquivando consultas anteriores a {timezone.localtime(cutoff):%d/%m/%Y %H:%M}…")
+
+        if opts["dry_run"]:
+            appointments, loose = archive.candidates(cutoff)
+            self.stdout.write(f"{appointments.count()} consultas e {loose.count()} atendimentos "
+                              "sem consulta seriam arquivados (dry-run).")
+            return
+
+        appts, encs = archive.archive_before(cutoff, chunk_size=opts["chunk_size"],
+                                             stdout=self.stdout if opts["verbosity"] > 1 else None)
+        if appts or encs:
+            # as tabelas quentes mudaram de tamanho: estatísticas novas para o planner
+            pagination.analyze()
+        self.stdout.write(self.style.SUCCESS(
+            f"Arquivo OK: {appts} consultas e {encs} atendimentos movidos."))
@@ -0,0 +1,56 @@
+import csv
+import time
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from clinic import overlaps
+from clinic.filters import DashboardFilters
+
+
+class Command(BaseCommand):
+    help = ("Procura consultas e atendimentos sobrepostos do mesmo profissional numa janela "
+            "(padrão: últimos 30 dias) e lista os conjuntos de conflito")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, help="janela: últimos N dias (até agora)")
+        parser.add_argument("--start", help="primeiro dia (AAAA-MM-DD), com --end")
+        parser.add_argument("--end", help="último dia (AAAA-MM-DD), inclusive")
+        parser.add_argument("--provider", type=int, help="só este profissional")
+        parser.add_argument("--kind", choices=[*overlaps.KINDS, "all"], default="all")
+        parser.add_argument("--csv", action="store_true", help="um conflito por linha, em CSV")
+
+    def handle(self, *args, **opts):
+        if bool(opts["start"]) != bool(opts["end"]):
+            raise CommandError("Use --start e --end juntos.")
+        try:
+            filters = DashboardFilters.from_params({"days": opts["days"], "start": opts["start"],
+                                                    "end": opts["end"]})
+        except ValueError as exc:
+            raise CommandError(str(exc)) from exc
+        if opts["start"] and not filters.start:
+            raise CommandError("Datas inválidas.")
+        kinds = overlaps.KINDS if opts["kind"] == "all" else (opts["kind"],)
+
+        started = time.perf_counter()
+        found = overlaps.audit(filters.since, filters.until, provider_id=opts["provider"], kinds=kinds)
+        elapsed = time.perf_counter() - started
+
+        def local(epoch):
+            return datetime.fromtimestamp(epoch, timezone.get_current_timezone())
+
+        if opts["csv"]:
+            writer = csv.writer(self.stdout)
+            writer.writerow(["kind", "provider_id", "start", "end", "ids"])
+            for c in found:
+                writer.writerow([c.kind, c.provider_id, local(c.start).isoformat(), local(c.end).isoformat(),
+                                 " ".join(map(str, c.ids))])
+            return
+        for c in found:
+            self.stdout.write(f"{c.kind} • profissional {c.provider_id} • "
+                              f"{local(c.start):%d/%m/%Y %H:%M}–{local(c.end):%H:%M} • ids {', '.join(map(str, c.ids))}")
+        style = self.style.WARNING if found else self.style.SUCCESS
+        self.stdout.write(style(
+            f"{len(found)} conjuntos de conflito entre {timezone.localtime(filters.since):%d/%m/%Y} e "
+            f"{timezone.localtime(filters.until):%d/%m/%Y} ({elapsed:.2f}s)."))
@@ -0,0 +1,168 @@
+import json
+import math
+import platform
+import time
+import tracemalloc
+from io import StringIO
+
+import django
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from clinic.cache import results
+from clinic.models import Appointment
+from clinic.profiling import QueryProbe, view_targets
+
+# escala -> multiplicador do seed padrão (500 pacientes, 15 profissionais ≈ 10 mil consultas)
+SCALES = {"10k": 1, "100k": 10, "1m": 100}
+
+# métricas comparadas com o baseline; queries precisam bater exatamente
+TIMED_METRICS = ("p50_ms", "p95_ms", "peak_kb", "rows")
+
+
+def percentile(values, pct):
+    """Percentil por posição mais próxima (sem interpolação)."""
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class Command(BaseCommand):
+    help = ("Benchmark das views da dashboard em bases geradas (10k/100k/1M consultas): "
+            "latência p50/p95, queries, linhas lidas e pico de memória")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scales", default="10k",
+                            help=f"escalas separadas por vírgula ({', '.join(SCALES)})")
+        parser.add_argument("--repeat", type=int, default=5, help="requisições medidas por view")
+        parser.add_argument("--workers", type=int, default=1, help="repassado ao seed_demo")
+        parser.add_argument("--output", help="grava o resultado em JSON neste arquivo")
+        parser.add_argument("--baseline", help="JSON de uma execução anterior para comparar")
+        parser.add_argument("--tolerance", type=float, default=0.25,
+                            help="piora relativa aceita antes de acusar regressão (padrão 25%%)")
+
+    def handle(self, *args, **opts):
+        scales = [s.strip().lower() for s in opts["scales"].split(",") if s.strip()]
+        unknown = [s for s in scales if s not in SCALES]
+        if unknown:
+            raise CommandError(f"escala desconhecida: {', '.join(unknown)}")
+        baseline = None
+        if opts["baseline"]:
+            with open(opts["baseline"], encoding="utf-8") as fh:
+                baseline = json.load(fh)
+
+        report = {
+            "meta": {
+                "created_at": timezone.now().isoformat(),
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "database": connection.vendor,
+                "repeat": opts["repeat"],
+            },
+            "scales": {},
+        }
+
+        # base de teste descartável: nada é gravado no banco configurado
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            for scale in scales:
+                report["scales"][scale] = self.run_scale(scale, opts)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        if opts["output"]:
+            with open(opts["output"], "w", encoding="utf-8") as fh:
+                json.dump(report, fh, indent=2, ensure_ascii=False)
+            self.stdout.write(f"Resultado gravado em {opts['output']}")
+
+        if baseline is not None:
+            regressions = self.compare(baseline, report, opts["tolerance"])
+            if regressions:
+                raise CommandError(f"{len(regressions)} regressão(ões) em relação ao baseline")
+            self.stdout.write(self.style.SUCCESS("Sem regressões em relação ao baseline."))
+
+    # ------------------------------------------------------------------
+
+    def run_scale(self, scale, opts):
+        factor = SCALES[scale]
+        t0 = time.perf_counter()
+        call_command("seed_demo", patients=500 * factor, providers=15 * factor,
+                     care_plans=120 * factor, workers=opts["workers"], stdout=StringIO())
+        seed_seconds = time.perf_counter() - t0
+        appointments = Appointment.objects.count()
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"\n== {scale}: {appointments} consultas (seed em {seed_seconds:.1f}s)"))
+
+        user_model = get_user_model()
+        user = (user_model.objects.filter(username="bench").first()
+                or user_model.objects.create_user("bench", is_staff=True, is_superuser=True))
+        client = Client()
+        client.force_login(user)
+
+        measured = {}
+        for name, run in view_targets(client).items():
+            measured[name] = self.measure(run, opts["repeat"])
+            m = measured[name]
+            self.stdout.write(
+                f"  {name:<12} p50 {m['p50_ms']:9.1f} ms  p95 {m['p95_ms']:9.1f} ms  "
+                f"{m['queries']:4d} queries  {m['rows']:8d} linhas  pico {m['peak_kb']:9.0f} KB"
+            )
+        return {"appointments": appointments, "seed_seconds": round(seed_seconds, 2), "targets": measured}
+
+    def measure(self, run, repeat):
+        run()  # aquecimento (conexão, templates, imports)
+
+        timings = []
+        for _ in range(max(1, repeat)):
+            results().clear()  # sempre a frio: mede o cálculo, não o cache
+            t0 = time.perf_counter()
+            run()
+            timings.append((time.perf_counter() - t0) * 1000)
+
+        # rodada separada para queries/linhas/memória (tracemalloc distorce o tempo)
+        results().clear()
+        tracemalloc.start()
+        try:
+            with QueryProbe() as probe:
+                run()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        return {
+            "p50_ms": round(percentile(timings, 50), 2),
+            "p95_ms": round(percentile(timings, 95), 2),
+            "queries": probe.queries,
+            "rows": probe.rows,
+            "peak_kb": round(peak / 1024, 1),
+        }
+
+    def compare(self, baseline, report, tolerance):
+        self.stdout.write(self.style.MIGRATE_HEADING("\n== comparação com o baseline"))
+        regressions = []
+        for scale, current in report["scales"].items():
+            before = baseline.get("scales", {}).get(scale)
+            if not before:
+                self.stdout.write(f"  {scale}: ausente no baseline")
+                continue
+            for name, metrics in current["targets"].items():
+                old = before["targets"].get(name)
+                if not old:
+                    continue
+                if metrics["queries"] > old["queries"]:
+                    regressions.append((scale, name, "queries", old["queries"], metrics["queries"]))
+                for metric in TIMED_METRICS:
+                    if old.get(metric) and metrics[metric] > old[metric] * (1 + tolerance):
+                        regressions.append((scale, name, metric, old[metric], metrics[metric]))
+
+        for scale, name, metric, old, new in regressions:
+            self.stdout.write(self.style.ERROR(
+                f"  REGRESSÃO {scale}/{name} {metric}: {old} -> {new}"))
+        return regressions
@@ -0,0 +1,54 @@
+import asyncio
+import statistics
+import time
+from functools import partial
+
+from django.core.management.base import BaseCommand
+
+from clinic import parallel
+from clinic.cache import results
+from clinic.filters import DashboardFilters
+from clinic.widgets import BLOCKS
+
+
+class Command(BaseCommand):
+    help = ("Compara a latência dos blocos da dashboard calculados em sequência "
+            "(caminho síncrono) e em paralelo (views assíncronas), sem cache")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=90)
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--concurrency", type=int, default=None,
+                            help="limite de agregações simultâneas (padrão: CLINIC_ASYNC_CONCURRENCY)")
+
+    def handle(self, *args, **opts):
+        filters = DashboardFilters.from_params({"days": opts["days"]})
+        limit = opts["concurrency"] or parallel.concurrency_limit()
+        calls = [partial(fn, filters) for fn in BLOCKS.values()]
+
+        def run_sync():
+            for fn in calls:
+                fn()
+
+        # um único event loop para todas as rodadas, como num servidor ASGI
+        with asyncio.Runner() as runner:
+            def run_async():
+                runner.run(parallel.gather(calls, limit=limit))
+
+            run_sync()   # aquece conexões/caches do banco
+            run_async()  # e as threads do executor
+            timings = {"sync": [], "async": []}
+            for _ in range(opts["repeat"]):
+                for mode, run in (("sync", run_sync), ("async", run_async)):
+                    results().clear()
+                    t0 = time.perf_counter()
+                    run()
+                    timings[mode].append((time.perf_counter() - t0) * 1000)
+
+        sync_ms = statistics.median(timings["sync"])
+        async_ms = statistics.median(timings["async"])
+        self.stdout.write(f"{len(calls)} blocos, janela de {opts['days']} dias, "
+                          f"{opts['repeat']} repetições, concorrência {limit}")
+        self.stdout.write(f"  sequencial: p50 {sync_ms:8.1f} ms  (min {min(timings['sync']):.1f})")
+        self.stdout.write(f"  paralelo:   p50 {async_ms:8.1f} ms  (min {min(timings['async']):.1f})")
+        self.stdout.write(self.style.SUCCESS(f"  ganho: {sync_ms / async_ms:.2f}x"))
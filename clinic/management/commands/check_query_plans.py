@@ -0,0 +1,131 @@
+import json
+import re
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from clinic import pagination
+from clinic.cache import results
+from clinic.profiling import QueryProbe, view_targets
+
+# FROM "tabela" [AS] alias / JOIN "tabela" alias
+_TABLE_REF = re.compile(r'(?:FROM|JOIN)\s+"?(\w+)"?(?:\s+(?:AS\s+)?"?(\w+)"?)?', re.IGNORECASE)
+_IN_LIST = re.compile(r"\((?:%s, )+%s\)")
+_KEYWORDS = {"ON", "WHERE", "INNER", "LEFT", "RIGHT", "OUTER", "CROSS", "JOIN", "GROUP",
+             "ORDER", "LIMIT", "HAVING", "UNION", "WINDOW", "USING", "AS"}
+
+
+def _aliases(sql):
+    aliases = {}
+    for table, alias in _TABLE_REF.findall(sql):
+        aliases[table] = table
+        if alias and alias.upper() not in _KEYWORDS:
+            aliases[alias] = table
+    return aliases
+
+
+def full_scans(sql, params):
+    """Tabelas lidas por varredura completa no plano de `sql`."""
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+            aliases = _aliases(sql)
+            scans = set()
+            for *_, detail in cursor.fetchall():
+                # "SCAN t" é varredura da tabela; "SCAN t USING [COVERING] INDEX" percorre um índice
+                match = re.match(r"SCAN (\w+)$", detail)
+                if match:
+                    scans.add(aliases.get(match.group(1), match.group(1)))
+            return scans
+        if connection.vendor == "postgresql":
+            cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+            plan = cursor.fetchone()[0]
+            plan = json.loads(plan) if isinstance(plan, str) else plan
+            scans, stack = set(), [plan[0]["Plan"]]
+            while stack:
+                node = stack.pop()
+                if node.get("Node Type") == "Seq Scan":
+                    scans.add(node["Relation Name"])
+                stack.extend(node.get("Plans", []))
+            return scans
+    raise CommandError(f"EXPLAIN não suportado para o banco {connection.vendor}")
+
+
+class Command(BaseCommand):
+    help = ("Roda EXPLAIN nas queries de cada view e falha se alguma varre por completo "
+            "uma tabela acima do limite de linhas")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--min-rows", type=int, default=10000,
+                            help="tamanho a partir do qual uma varredura completa é erro")
+        parser.add_argument("--analyze", action="store_true",
+                            help="atualiza as estatísticas do planner (ANALYZE) antes de checar")
+        parser.add_argument("--user", help="usuário staff usado nas requisições (padrão: primeiro staff)")
+
+    def handle(self, *args, **opts):
+        users = get_user_model().objects.filter(is_active=True, is_staff=True)
+        if opts["user"]:
+            users = users.filter(username=opts["user"])
+        user = users.order_by("-is_superuser", "pk").first()
+        if user is None:
+            raise CommandError("nenhum usuário staff ativo encontrado")
+
+        if opts["analyze"] and not pagination.analyze():
+            self.stderr.write(f"ANALYZE não suportado para o banco {connection.vendor}; seguindo sem.")
+
+        setup_test_environment()
+        try:
+            client = Client()
+            client.force_login(user)
+            statements = self.collect(client)
+        finally:
+            teardown_test_environment()
+
+        tables = set(connection.introspection.table_names())
+        sizes = {}
+        failures = []
+        for name, queries in statements.items():
+            flagged = []
+            for sql, params in queries:
+                # subqueries (ex.: "SCAN qualify") aparecem pelo alias; as tabelas
+                # de dentro delas entram no plano com o próprio nome
+                for table in sorted(full_scans(sql, params) & tables):
+                    if table not in sizes:
+                        with connection.cursor() as cursor:
+                            cursor.execute(f"SELECT COUNT(*) FROM {connection.ops.quote_name(table)}")
+                            sizes[table] = cursor.fetchone()[0]
+                    if sizes[table] >= opts["min_rows"]:
+                        flagged.append((table, sql))
+
+            status = self.style.ERROR("FALHA") if flagged else self.style.SUCCESS("ok")
+            self.stdout.write(f"{name:<16} {len(queries):3d} queries  {status}")
+            for table, sql in flagged:
+                self.stdout.write(f"    varredura completa em {table} ({sizes[table]} linhas):")
+                self.stdout.write(f"      {_IN_LIST.sub('(%s, ...)', sql)}")
+            failures += flagged
+
+        if failures:
+            raise CommandError(f"{len(failures)} query(s) com varredura completa em tabela grande")
+
+    def collect(self, client):
+        """SELECTs distintos disparados por cada view, a frio."""
+        targets = view_targets(client)
+        targets["api_appointments"] = lambda: client.get(reverse("api_appointments"))
+        targets["api_encounters"] = lambda: client.get(reverse("api_encounters"))
+
+        statements = {}
+        for name, run in targets.items():
+            results().clear()
+            with QueryProbe() as probe:
+                run()
+            seen, queries = set(), []
+            for sql, params, _ in probe.statements:
+                if sql.lstrip().upper().startswith(("SELECT", "WITH")) and sql not in seen:
+                    seen.add(sql)
+                    queries.append((sql, params))
+            statements[name] = queries
+        return statements
@@ -0,0 +1,44 @@
+import csv
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from clinic import imports
+
+
+class Command(BaseCommand):
+    help = ("Importa consultas (com atendimento, diagnósticos e procedimentos) de um CSV "
+            f"com as colunas: {', '.join(imports.COLUMNS)}")
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="arquivo CSV em UTF-8 ('-' lê da entrada padrão)")
+        parser.add_argument("--chunk-size", type=int, default=imports.CHUNK_SIZE,
+                            help="linhas por transação")
+        parser.add_argument("--delimiter", default=",")
+        parser.add_argument("--dry-run", action="store_true",
+                            help="só valida, sem gravar")
+
+    def handle(self, *args, **opts):
+        if opts["chunk_size"] < 1:
+            raise CommandError("--chunk-size deve ser positivo.")
+        try:
+            fh = (sys.stdin if opts["path"] == "-"
+                  else open(opts["path"], encoding="utf-8-sig", newline=""))
+        except OSError as exc:
+            raise CommandError(f"Não foi possível abrir {opts['path']}: {exc}") from exc
+        with fh:
+            reader = csv.DictReader(fh, delimiter=opts["delimiter"])
+            missing = [c for c in imports.REQUIRED if c not in (reader.fieldnames or [])]
+            if missing:
+                raise CommandError(f"Colunas obrigatórias ausentes: {', '.join(missing)}")
+            result = imports.import_rows(reader, chunk_size=opts["chunk_size"], dry_run=opts["dry_run"],
+                                         stdout=self.stdout if opts["verbosity"] > 1 else None)
+
+        for line, message in result.errors:
+            self.stderr.write(f"linha {line}: {message}")
+        if result.skipped > len(result.errors):
+            self.stderr.write(f"… e mais {result.skipped - len(result.errors)} linhas com erro.")
+        verb = "seriam importadas" if opts["dry_run"] else "importadas"
+        self.stdout.write(self.style.SUCCESS(
+            f"{result.rows} linhas lidas: {result.appointments} consultas e "
+            f"{result.encounters} atendimentos {verb}, {result.skipped} linhas puladas."))
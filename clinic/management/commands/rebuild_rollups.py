@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from clinic import rollups
+
+
+class Command(BaseCommand):
+    help = "Reconstrói o rollup diário da agenda (tudo ou um intervalo de dias)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start", help="primeiro dia (YYYY-MM-DD)")
+        parser.add_argument("--end", help="último dia (YYYY-MM-DD)")
+        parser.add_argument("--provider", type=int, action="append",
+                            help="restringe a um profissional (pode repetir)")
+
+    def handle(self, *args, **opts):
+        start = parse_date(opts["start"]) if opts["start"] else None
+        end = parse_date(opts["end"]) if opts["end"] else None
+        if (opts["start"] and not start) or (opts["end"] and not end):
+            raise CommandError("Datas devem estar no formato YYYY-MM-DD.")
+        if start and end and start > end:
+            raise CommandError("--start deve ser anterior a --end.")
+
+        written = rollups.rebuild(start, end, provider_ids=opts["provider"],
+                                  stdout=self.stdout if opts["verbosity"] > 1 else None)
+        self.stdout.write(self.style.SUCCESS(f"Rollup OK: {written} buckets gravados."))
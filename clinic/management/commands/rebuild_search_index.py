@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from clinic import search
+from clinic.models import NameToken
+
+BATCH = 2000
+
+
+class Command(BaseCommand):
+    help = "Recalcula search_name e o índice de palavras dos nomes de pacientes e profissionais"
+
+    def handle(self, *args, **opts):
+        for model, kind in search.KIND_OF.items():
+            with transaction.atomic():
+                NameToken.objects.filter(kind=kind).delete()
+                total = 0
+                qs = model.objects.only("id", "full_name").order_by("id")
+                batch = []
+                for obj in qs.iterator(chunk_size=BATCH):
+                    batch.append(obj)
+                    if len(batch) >= BATCH:
+                        total += self.flush(model, batch)
+                        batch = []
+                total += self.flush(model, batch)
+            self.stdout.write(f"  {model._meta.verbose_name_plural}: {total}")
+        self.stdout.write(self.style.SUCCESS("Índice de nomes OK."))
+
+    def flush(self, model, batch):
+        model.objects.bulk_update(search.prepare(batch), ["search_name"])
+        search.index(model, batch)
+        return len(batch)
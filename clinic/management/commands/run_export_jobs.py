@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from clinic import exports
+
+
+class Command(BaseCommand):
+    help = "Worker das exportações em segundo plano (ExportJob)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true",
+                            help="processa a fila atual e sai")
+        parser.add_argument("--poll", type=float, default=2.0,
+                            help="intervalo (s) entre consultas à fila vazia")
+        parser.add_argument("--chunk-size", type=int, default=exports.CHUNK_SIZE)
+
+    def handle(self, *args, **opts):
+        while True:
+            job = exports.claim_next_job()
+            if job is None:
+                if opts["once"]:
+                    return
+                time.sleep(opts["poll"])
+                continue
+
+            self.stdout.write(f"Exportação #{job.pk} ({job.format}) iniciada…")
+            job = exports.run_job(job, chunk_size=opts["chunk_size"])
+            if job.status == "done":
+                self.stdout.write(self.style.SUCCESS(
+                    f"Exportação #{job.pk}: {job.rows_written} linhas, {job.size_bytes} bytes."))
+            else:
+                self.stderr.write(f"Exportação #{job.pk} falhou: {job.error}")
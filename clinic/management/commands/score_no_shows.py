@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from clinic import noshow
+
+
+class Command(BaseCommand):
+    help = ("Calcula o risco de no-show das consultas agendadas futuras a partir do histórico "
+            "e grava em NoShowScore (substitui as notas anteriores). Para rodar toda noite, ex.: "
+            "'30 2 * * * manage.py score_no_shows' no cron")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true",
+                            help="ajusta o modelo e calcula as notas, sem gravar")
+
+    def handle(self, *args, **opts):
+        started = time.perf_counter()
+        run = noshow.run(dry_run=opts["dry_run"])
+        elapsed = time.perf_counter() - started
+        verb = "seriam gravadas" if opts["dry_run"] else "gravadas"
+        self.stdout.write(
+            f"{run.history} consultas no histórico; modelo ajustado em {run.trained} "
+            f"(taxa de no-show {run.base_rate:.1%}, log-loss {run.log_loss:.4f}).")
+        self.stdout.write(self.style.SUCCESS(
+            f"{run.scored} notas {verb}: {run.expected:.1f} no-shows esperados ({elapsed:.2f}s)."))
@@ -1,229 +1,398 @@
-from django.core.management.base import BaseCommand
-from django.utils import timezone
-from faker import Faker
+"""
+Dados fake para demo/testes de carga.
+
+A geração é dividida em fatias fixas — blocos de pacientes e um dia da grade
+profissional × dia por fatia — e cada fatia usa um gerador próprio, semeado a
+partir de SEED e do número da fatia. As fatias podem então rodar num pool de
+processos (--workers) e o resultado é o mesmo com qualquer número de workers:
+o processo principal recebe as fatias em ordem e faz o bulk_create.
+"""
 import random
-from datetime import date
+from concurrent.futures import ProcessPoolExecutor
 from datetime import timedelta
-from clinic.models import Patient, Provider, Diagnosis, Appointment, Encounter, Vitals, Procedure, ProcedureCategory
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from faker import Faker
+
+from clinic import icd, pagination, rollups, search
+from clinic.cache import results
 from clinic.models import (
     Patient, Provider, Diagnosis, Appointment, Encounter, Vitals,
     Procedure, ProcedureCategory,
-    CarePlan, CareStep, PainAssessment,  # <-- NOVOS
+    CarePlan, CareStep, PainAssessment, DailyAppointmentStat,
+    ArchivedAppointment, ArchivedEncounter, ArchivedVitals, NameToken, NoShowScore,
 )
 
+SEED = 42
+PATIENT_SHARD = 1000  # pacientes por fatia
+
+SPECIALTIES = ["Clínica Médica", "Pediatria", "Ginecologia", "Ortopedia", "Cardiologia"]
+
+PROCEDURES = [
+    # code, name, category, duration, image_guidance, price
+    ("PROC-LASER", "Laser de Alta Potência", "Laserterapia", 25, False, 350.00),
+    ("PROC-INFIL", "Infiltração Articular/Muscular", "Infiltrações", 30, True, 520.00),
+    ("PROC-BLOQ", "Bloqueio Simpático/Neuroaxial", "Bloqueios (Simp./Neuroaxiais)", 40, True, 980.00),
+    ("PROC-RF", "Radiofrequência Convencional/Pulsada", "Radiofrequência", 45, True, 1850.00),
+    ("PROC-ESWT", "Ondas de Choque Extracorpóreas (ESWT)", "Ondas de Choque (ESWT)", 20, False, 650.00),
+]
+
+# Diagnósticos (pseudo-CID)
+DIAG_POOL = [
+    ("J06.9", "IVAS não especificada"),
+    ("I10", "Hipertensão essencial"),
+    ("E11.9", "DM2 sem complicações"),
+    ("M54.5", "Dor lombar"),
+    ("Z00.0", "Exame de rotina"),
+    ("N39.0", "ITU"),
+    ("J45.9", "Asma"),
+    ("K21.9", "DRGE"),
+]
+
+PROTOCOL_PROCEDURE = {
+    "LASER": "PROC-LASER",
+    "INFIL": "PROC-INFIL",
+    "BLOCK": "PROC-BLOQ",
+    "RF":    "PROC-RF",
+    "ESWT":  "PROC-ESWT",
+}
+
+# efeito médio semanal por protocolo (queda em pontos na escala 0–10)
+WEEKLY_EFFECT = {
+    "LASER": 0.25,  # resposta lenta e cumulativa
+    "INFIL": 0.60,  # resposta mais rápida
+    "BLOCK": 0.70,  # neuropática com boa resposta
+    "RF":    0.80,  # grande queda pós-aplicação
+    "ESWT":  0.35,  # progressiva
+}
+
+FUTURE_DAYS = 7  # agenda também cobre a próxima semana
+
+# ordem de limpeza respeitando as FKs (filhos antes dos pais)
+WIPE_ORDER = [
+    Vitals, PainAssessment, CareStep, CarePlan,
+    Encounter.diagnoses.through, Encounter.procedures.through, Encounter,
+    ArchivedVitals, ArchivedEncounter.diagnoses.through, ArchivedEncounter.procedures.through,
+    ArchivedEncounter, ArchivedAppointment,
+    DailyAppointmentStat, NoShowScore, Appointment,
+    Diagnosis, Provider, Patient, NameToken, Procedure, ProcedureCategory,
+]
+
+
+# ---------------------------------------------------------------------------
+# fatias (rodam nos workers: só Python puro, nada de banco)
+# ---------------------------------------------------------------------------
+
+_faker = None
+
+
+def shard_rng(kind, index):
+    """Gerador da fatia: depende só de SEED, do tipo e do número da fatia."""
+    return random.Random(f"{SEED}:{kind}:{index}")
+
+
+def shard_faker(rng):
+    global _faker
+    if _faker is None:  # um Faker por processo, re-semeado a cada fatia
+        _faker = Faker("pt_BR")
+    _faker.seed_instance(rng.getrandbits(64))
+    return _faker
+
+
+def patient_shard(args):
+    """Fatia `index` de pacientes: lista de (nome, sexo, nascimento)."""
+    index, count = args
+    rng = shard_rng("patients", index)
+    fake = shard_faker(rng)
+    rows = []
+    for _ in range(count):
+        sex = rng.choice(["M", "F"])
+        rows.append((
+            fake.name_male() if sex == "M" else fake.name_female(),
+            sex,
+            fake.date_of_birth(minimum_age=0, maximum_age=95),
+        ))
+    return rows
+
+
+def day_shard(args):
+    """
+    Agenda de um dia para todos os profissionais. Pacientes, procedimentos e
+    diagnósticos são índices; o processo principal troca pelos ids.
+    """
+    index, day, n_providers, n_patients = args
+    rng = shard_rng("day", index)
+    visits = []
+    for prov in range(n_providers):
+        slots = rng.randint(6, 12)  # consultas/dia por profissional
+        for i in range(slots):
+            sched = (day.replace(hour=8, minute=0, second=0, microsecond=0)
+                     + timedelta(minutes=i * (480 // slots)))
+
+            # menos agenda fim de semana
+            if sched.weekday() >= 5 and rng.random() < 0.7:
+                continue
+
+            patient = rng.randrange(n_patients)
+            status, detail = visit(rng)
+            visits.append((prov, sched, patient, status, detail))
+    return visits
+
+
+def visit(rng):
+    """Sorteia o desfecho da consulta: (status, dados do atendimento ou None)."""
+    r = rng.random()
+    if r < 0.15:
+        return "no_show", None
+    if r < 0.20:
+        return "cancelled", None
+
+    check_in_offset = rng.randint(-10, 20)
+    duration = rng.randint(12, 35)
+    reason = rng.choice(["Rotina", "Dor", "Retorno", "Resultado de exame"])
+    # Procedimentos de forma realista (maioria consultas sem procedimento, mas alguns têm)
+    roll = rng.random()
+    if roll < 0.55:
+        procs = []                                        # 55% apenas consulta clínica
+    elif roll < 0.85:
+        procs = [rng.randrange(len(PROCEDURES))]          # 30% 1 procedimento
+    else:
+        procs = rng.sample(range(len(PROCEDURES)), k=2)   # 15% 2 procedimentos combinados
+    dx = rng.sample(range(len(DIAG_POOL)), k=rng.choice([1, 1, 2]))
+    vitals = dict(
+        height_cm=rng.randint(150, 185),
+        weight_kg=rng.randint(50, 110),
+        systolic=rng.randint(105, 150),
+        diastolic=rng.randint(65, 95),
+        heart_rate=rng.randint(55, 105),
+    )
+    return "completed", (check_in_offset, duration, reason, procs, dx, vitals)
+
+
+# ---------------------------------------------------------------------------
+
+
 class Command(BaseCommand):
     help = "Gera dados fake para demo da clínica"
 
-    def handle(self, *args, **kwargs):
-        fake = Faker("pt_BR")
-        random.seed(42)
-    
-        # Limpa tabelas (MVP)
-        Vitals.objects.all().delete()
-        Encounter.objects.all().delete()
-        Appointment.objects.all().delete()
-        Diagnosis.objects.all().delete()
-        Provider.objects.all().delete()
-        Patient.objects.all().delete()
-
-        # Categorias de procedimento
-        for model in (Procedure, ProcedureCategory):
-            model.objects.all().delete()
-
-        cat_laser = ProcedureCategory.objects.create(name="Laserterapia")
-        cat_infil = ProcedureCategory.objects.create(name="Infiltrações")
-        cat_blocks = ProcedureCategory.objects.create(name="Bloqueios (Simp./Neuroaxiais)")
-        cat_rf = ProcedureCategory.objects.create(name="Radiofrequência")
-        cat_eswt = ProcedureCategory.objects.create(name="Ondas de Choque (ESWT)")
-
-        procedures = [
-            # code, name, category, duration, image_guidance, price
-            ("PROC-LASER", "Laser de Alta Potência", cat_laser, 25, False, 350.00),
-            ("PROC-INFIL", "Infiltração Articular/Muscular", cat_infil, 30, True, 520.00),
-            ("PROC-BLOQ", "Bloqueio Simpático/Neuroaxial", cat_blocks, 40, True, 980.00),
-            ("PROC-RF", "Radiofrequência Convencional/Pulsada", cat_rf, 45, True, 1850.00),
-            ("PROC-ESWT", "Ondas de Choque Extracorpóreas (ESWT)", cat_eswt, 20, False, 650.00),
-        ]
-        procedures = [Procedure.objects.create(
-            code=c, name=n, category=cat, duration_estimate_min=dur, requires_image_guidance=img, price_brl=price
-        ) for (c, n, cat, dur, img, price) in procedures]
-
-        # Providers
-        specialties = ["Clínica Médica", "Pediatria", "Ginecologia", "Ortopedia", "Cardiologia"]
-        providers = []
-        for s in specialties:
-            for _ in range(3):
-                providers.append(Provider.objects.create(
-                    full_name=fake.name(),
-                    crm=str(fake.random_number(digits=6)),
-                    specialty=s
-                ))
+    def add_arguments(self, parser):
+        parser.add_argument("--patients", type=int, default=500)
+        parser.add_argument("--days", type=int, default=90, help="dias de histórico da agenda")
+        parser.add_argument("--providers", type=int, default=15,
+                            help="profissionais, distribuídos entre as especialidades")
+        parser.add_argument("--care-plans", type=int, default=120)
+        parser.add_argument("--batch-size", type=int, default=5000,
+                            help="linhas por bulk_create/transação")
+        parser.add_argument("--workers", type=int, default=1,
+                            help="processos gerando fatias em paralelo (resultado idêntico)")
 
-        # Diagnósticos (pseudo-CID)
-        diag_pool = [
-            ("J06.9", "IVAS não especificada"),
-            ("I10", "Hipertensão essencial"),
-            ("E11.9", "DM2 sem complicações"),
-            ("M54.5", "Dor lombar"),
-            ("Z00.0", "Exame de rotina"),
-            ("N39.0", "ITU"),
-            ("J45.9", "Asma"),
-            ("K21.9", "DRGE"),
-        ]
-        diagnoses = [Diagnosis.objects.create(code=c, description=d) for c, d in diag_pool]
-
-        # Pacientes
-        patients = []
-        for _ in range(500):
-            sex = random.choice(["M", "F"])
-            patients.append(Patient.objects.create(
-                full_name=fake.name_male() if sex == "M" else fake.name_female(),
-                sex=sex,
-                birth_date=fake.date_of_birth(minimum_age=0, maximum_age=95),
-            ))
+    def handle(self, *args, **opts):
+        # antes de apagar qualquer coisa: sem pacientes/profissionais a agenda não tem quem sortear
+        for name in ("patients", "providers", "batch_size"):
+            if opts[name] < 1:
+                raise CommandError(f"--{name.replace('_', '-')} deve ser positivo.")
+        for name in ("days", "care_plans"):
+            if opts[name] < 0:
+                raise CommandError(f"--{name.replace('_', '-')} não pode ser negativo.")
+        self.batch_size = opts["batch_size"]
+        workers = max(1, opts["workers"])
 
-        # Agenda: últimos 90 dias + próximos 7
-        start = timezone.now() - timedelta(days=90)
-        end = timezone.now() + timedelta(days=7)
-        day = start
-        total_appts = 0
-
-        while day <= end:
-            for prov in providers:
-                slots = random.randint(6, 12)  # consultas/dia por profissional
-                for i in range(slots):
-                    sched = (day.replace(hour=8, minute=0, second=0, microsecond=0)
-                             + timedelta(minutes=i * (480 // slots)))
-
-                    # menos agenda fim de semana
-                    if sched.weekday() >= 5 and random.random() < 0.7:
-                        continue
-
-                    appt = Appointment.objects.create(
-                        patient=random.choice(patients),
-                        provider=prov,
-                        scheduled_at=sched,
-                        status="scheduled"
-                    )
-                    total_appts += 1
-
-                    r = random.random()
-                    if r < 0.15:
-                        appt.status = "no_show"
-                    elif r < 0.20:
-                        appt.status = "cancelled"
-                    else:
-                        appt.status = "completed"
-                        # Encounter
-                        check_in_offset = random.randint(-10, 20)
-                        duration = random.randint(12, 35)
-                        enc = Encounter.objects.create(
-                            appointment=appt,
-                            patient=appt.patient,
-                            provider=appt.provider,
-                            check_in=appt.scheduled_at + timedelta(minutes=check_in_offset),
-                            check_out=appt.scheduled_at + timedelta(minutes=check_in_offset + duration),
-                            reason=random.choice(["Rotina", "Dor", "Retorno", "Resultado de exame"]),
-                        )
-                        # Atribui procedimentos de forma realista (maioria consultas sem procedimento, mas alguns têm)
-                        roll = random.random()
-                        if roll < 0.55:
-                            # 55% apenas consulta clínica (sem procedimentos)
-                            pass
-                        elif roll < 0.85:
-                            # 30% 1 procedimento
-                            enc.procedures.add(random.choice(procedures))
-                        else:
-                            # 15% 2 procedimentos combinados (ex.: infiltração + laser ou RF sozinha)
-                            enc.procedures.add(*random.sample(procedures, k=2))
-
-                        enc.diagnoses.add(*random.sample(diagnoses, k=random.choice([1,1,2])))
-                        Vitals.objects.create(
-                            encounter=enc,
-                            height_cm=random.randint(150, 185),
-                            weight_kg=random.randint(50, 110),
-                            systolic=random.randint(105, 150),
-                            diastolic=random.randint(65, 95),
-                            heart_rate=random.randint(55, 105),
-                        )
-                    appt.save()
-            day += timedelta(days=1)
+        self.wipe()
+
+        pool = ProcessPoolExecutor(workers) if workers > 1 else None
+        self.map = pool.map if pool else map
+        try:
+            procedures, diagnoses = self.create_catalog()
+            providers = self.create_providers(opts["providers"])
+            patient_ids = self.create_patients(opts["patients"])
+            total_appts = self.create_schedule(providers, patient_ids, procedures, diagnoses, opts["days"])
+        finally:
+            if pool:
+                pool.shutdown()
 
         self.stdout.write(self.style.SUCCESS(
-            f"Seed OK: {len(patients)} pacientes, {len(providers)} profissionais, {total_appts} consultas."
+            f"Seed OK: {len(patient_ids)} pacientes, {len(providers)} profissionais, {total_appts} consultas."
         ))
-    # mapeia os seus procedimentos criados acima
-        proc_map = {
-            "LASER": Procedure.objects.get(code="PROC-LASER"),
-            "INFIL": Procedure.objects.get(code="PROC-INFIL"),
-            "BLOCK": Procedure.objects.get(code="PROC-BLOQ"),
-            "RF":    Procedure.objects.get(code="PROC-RF"),
-            "ESWT":  Procedure.objects.get(code="PROC-ESWT"),
-        }
-
-        # efeito médio semanal por protocolo (queda em pontos na escala 0–10)
-        weekly_effect = {
-            "LASER": 0.25,  # resposta lenta e cumulativa
-            "INFIL": 0.60,  # resposta mais rápida
-            "BLOCK": 0.70,  # neuropática com boa resposta
-            "RF":    0.80,  # grande queda pós-aplicação
-            "ESWT":  0.35,  # progressiva
-        }
 
+        plans = self.create_care_plans(patient_ids, procedures, opts["care_plans"])
+        self.stdout.write(f"Planos de cuidado: {plans}.")
+
+        # bulk_create não dispara signals: agregados derivados são refeitos de uma vez
+        rollups.rebuild()
+        results().clear()
+        icd.invalidate()
+
+        # estatísticas do planner refletindo a carga nova
+        pagination.analyze()
+
+    # ------------------------------------------------------------------
+
+    def wipe(self):
+        # Limpa tabelas (MVP). DELETE direto: o .delete() do ORM buscaria cada
+        # linha para disparar signals/cascatas, inviável com milhões de linhas.
+        with transaction.atomic(), connection.cursor() as cursor:
+            for model in WIPE_ORDER:
+                cursor.execute(f"DELETE FROM {connection.ops.quote_name(model._meta.db_table)}")
+
+    def bulk(self, model, objs):
+        return model.objects.bulk_create(objs, batch_size=self.batch_size)
+
+    def create_catalog(self):
+        categories = {c.name: c for c in self.bulk(ProcedureCategory, [
+            ProcedureCategory(name=cat) for (_, _, cat, _, _, _) in PROCEDURES
+        ])}
+        procedures = self.bulk(Procedure, [
+            Procedure(code=c, name=n, category=categories[cat], duration_estimate_min=dur,
+                      requires_image_guidance=img, price_brl=price)
+            for (c, n, cat, dur, img, price) in PROCEDURES
+        ])
+        diagnoses = self.bulk(Diagnosis, [Diagnosis(code=c, description=d) for c, d in DIAG_POOL])
+        return procedures, diagnoses
+
+    def create_providers(self, count):
+        fake = shard_faker(shard_rng("providers", 0))
+        providers = self.bulk(Provider, search.prepare([
+            Provider(full_name=fake.name(), crm=str(fake.random_number(digits=6)),
+                     specialty=SPECIALTIES[i * len(SPECIALTIES) // count])
+            for i in range(count)
+        ]))
+        search.index(Provider, providers)
+        return providers
+
+    def create_patients(self, count):
+        shards = [(i, min(PATIENT_SHARD, count - start))
+                  for i, start in enumerate(range(0, count, PATIENT_SHARD))]
+        ids, batch = [], []
+        for rows in self.map(patient_shard, shards):
+            batch += [Patient(full_name=name, sex=sex, birth_date=birth) for name, sex, birth in rows]
+            if len(batch) >= self.batch_size:
+                ids += self.flush_patients(batch)
+                batch = []
+        ids += self.flush_patients(batch)
+        return ids
+
+    def flush_patients(self, batch):
+        with transaction.atomic():
+            patients = self.bulk(Patient, search.prepare(batch))
+            search.index(Patient, patients)
+            return [p.pk for p in patients]
+
+    def create_schedule(self, providers, patient_ids, procedures, diagnoses, days):
+        """Agenda: últimos `days` dias + próximos 7, em lotes de batch_size consultas."""
+        start = timezone.now() - timedelta(days=days)
+        shards = [(i, start + timedelta(days=i), len(providers), len(patient_ids))
+                  for i in range(days + FUTURE_DAYS + 1)]
+        pending = []  # (Appointment, dados do atendimento ou None)
+        total = 0
+
+        for visits in self.map(day_shard, shards):
+            for prov, sched, patient, status, detail in visits:
+                appt = Appointment(patient_id=patient_ids[patient], provider=providers[prov],
+                                   scheduled_at=sched, status=status)
+                pending.append((appt, detail))
+            if len(pending) >= self.batch_size:
+                total += self.flush_visits(pending, procedures, diagnoses)
+                pending = []
+
+        total += self.flush_visits(pending, procedures, diagnoses)
+        return total
+
+    def flush_visits(self, pending, procedures, diagnoses):
+        if not pending:
+            return 0
+        with transaction.atomic():
+            self.bulk(Appointment, [appt for appt, _ in pending])
+
+            visits = [(appt, v) for appt, v in pending if v is not None]
+            encounters = self.bulk(Encounter, [
+                Encounter(
+                    appointment=appt, patient_id=appt.patient_id, provider_id=appt.provider_id,
+                    check_in=appt.scheduled_at + timedelta(minutes=offset),
+                    check_out=appt.scheduled_at + timedelta(minutes=offset + duration),
+                    duration_min=duration,  # bulk_create não passa pelo save()
+                    reason=reason,
+                )
+                for appt, (offset, duration, reason, _, _, _) in visits
+            ])
+
+            proc_links, dx_links, vitals = [], [], []
+            for enc, (_, (_, _, _, procs, dx, vit)) in zip(encounters, visits):
+                proc_links += [Encounter.procedures.through(encounter_id=enc.pk, procedure_id=procedures[i].pk)
+                               for i in procs]
+                dx_links += [Encounter.diagnoses.through(encounter_id=enc.pk, diagnosis_id=diagnoses[i].pk)
+                             for i in dx]
+                vitals.append(Vitals(encounter_id=enc.pk, **vit))
+            self.bulk(Encounter.procedures.through, proc_links)
+            self.bulk(Encounter.diagnoses.through, dx_links)
+            self.bulk(Vitals, vitals)
+        return len(pending)
+
+    def create_care_plans(self, patient_ids, procedures, count):
+        rng = shard_rng("care-plans", 0)
+        proc_map = {proto: next(p for p in procedures if p.code == code)
+                    for proto, code in PROTOCOL_PROCEDURE.items()}
         today = timezone.now().date()
 
         # pega uma amostra de pacientes (para não exagerar a base)
-        amostra = random.sample(patients, k=min(120, len(patients)))
+        amostra = rng.sample(patient_ids, k=min(count, len(patient_ids)))
 
+        plans, step_specs, pain = [], [], []
         for pt in amostra:
-            proto = random.choice(list(proc_map.keys()))
-            start = today - timedelta(days=random.randint(30, 120))
-
-            plan = CarePlan.objects.create(
-                patient=pt,
-                diagnosis=random.choice([
+            proto = rng.choice(list(proc_map.keys()))
+            start = today - timedelta(days=rng.randint(30, 120))
+            plans.append(CarePlan(
+                patient_id=pt,
+                diagnosis=rng.choice([
                     "Lombalgia crônica", "Osteoartrite de joelho",
                     "Cervicalgia", "Dor miofascial"
                 ]),
                 protocol=proto,
                 start_date=start,
-                goal_pain_score=random.choice([2, 3, 4]),
-            )
+                goal_pain_score=rng.choice([2, 3, 4]),
+            ))
 
             # 3 a 5 etapas do procedimento do protocolo
-            steps = random.randint(3, 5)
-            for k in range(steps):
-                step_date = start + timedelta(weeks=k)
-                CareStep.objects.create(
-                    care_plan=plan,
-                    procedure=proc_map[proto],
-                    scheduled_at=step_date,
-                    done_at=step_date,
-                    notes="Etapa planejada e realizada.",
-                )
-
-                # tenta vincular o procedimento a um encontro real daquele paciente na mesma data
-                enc = (Encounter.objects
-                    .filter(patient=pt,
-                            check_out__date=step_date)  # precisa que check_out exista
-                    .order_by('check_out')
-                    .first())
-                if enc:
-                    enc.procedures.add(proc_map[proto])
+            steps = rng.randint(3, 5)
+            step_specs.append([start + timedelta(weeks=k) for k in range(steps)])
 
             # linha do tempo da dor: 10–12 semanas
-            baseline = random.randint(7, 10)
+            baseline = rng.randint(7, 10)
             current = baseline
-            semanas = random.randint(10, 12)
-
+            semanas = rng.randint(10, 12)
             for w in range(semanas):
-                drop = weekly_effect[proto] + random.uniform(-0.15, 0.15)
+                drop = WEEKLY_EFFECT[proto] + rng.uniform(-0.15, 0.15)
                 drop = max(drop, 0)
                 current = max(0, current - drop)
-
-                PainAssessment.objects.create(
-                    patient=pt,
+                pain.append(PainAssessment(
+                    patient_id=pt,
                     recorded_at=start + timedelta(weeks=w),
                     score=round(current),
                     notes=f"Semana {w+1} • {proto}",
-                )
+                ))
+
+        # vincula cada etapa ao primeiro atendimento do paciente na mesma data
+        # (uma query só para todos os pacientes da amostra)
+        first_encounter = {}
+        encs = (Encounter.objects.filter(patient_id__in=amostra, check_out__isnull=False)
+                .order_by("check_out").values_list("patient_id", "check_out", "id"))
+        for patient_id, check_out, enc_id in encs.iterator(chunk_size=self.batch_size):
+            first_encounter.setdefault((patient_id, timezone.localdate(check_out)), enc_id)
+
+        with transaction.atomic():
+            plans = self.bulk(CarePlan, plans)
+            steps, links = [], []
+            for plan, dates in zip(plans, step_specs):
+                proc = proc_map[plan.protocol]
+                for step_date in dates:
+                    steps.append(CareStep(care_plan=plan, procedure=proc, scheduled_at=step_date,
+                                          done_at=step_date, notes="Etapa planejada e realizada."))
+                    enc_id = first_encounter.get((plan.patient_id, step_date))
+                    if enc_id:
+                        links.append(Encounter.procedures.through(encounter_id=enc_id, procedure_id=proc.pk))
+            self.bulk(CareStep, steps)
+            Encounter.procedures.through.objects.bulk_create(links, batch_size=self.batch_size,
+                                                             ignore_conflicts=True)
+            self.bulk(PainAssessment, pain)
+        return len(plans)
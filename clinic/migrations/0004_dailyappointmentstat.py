@@ -0,0 +1,71 @@
+# Generated by Django 5.2.7 on 2026-10-17 19:29
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+
+def backfill(apps, schema_editor):
+    """Popula o rollup com a agenda existente (mesma regra de clinic.rollups)."""
+    Appointment = apps.get_model("clinic", "Appointment")
+    Encounter = apps.get_model("clinic", "Encounter")
+    Stat = apps.get_model("clinic", "DailyAppointmentStat")
+    EncounterProcedure = Encounter._meta.get_field("procedures").remote_field.through
+
+    acc = {}
+    appts = (Appointment.objects.annotate(day=TruncDate("scheduled_at"))
+             .values_list("day", "provider_id", "status").annotate(cnt=Count("id")).order_by())
+    for day, provider_id, status, cnt in appts:
+        acc[(day, provider_id, status)] = [cnt, 0, 0, Decimal("0.00")]
+
+    encs = (Encounter.objects.filter(appointment__isnull=False, check_out__isnull=False)
+            .annotate(day=TruncDate("appointment__scheduled_at"))
+            .values_list("day", "appointment__provider_id", "appointment__status", "check_in", "check_out")
+            .order_by())
+    for day, provider_id, status, check_in, check_out in encs.iterator(chunk_size=5000):
+        slot = acc[(day, provider_id, status)]
+        slot[1] += 1
+        slot[2] += int((check_out - check_in).total_seconds() // 60)
+
+    links = (EncounterProcedure.objects
+             .filter(encounter__appointment__isnull=False, encounter__check_out__isnull=False)
+             .annotate(day=TruncDate("encounter__appointment__scheduled_at"))
+             .values_list("day", "encounter__appointment__provider_id", "encounter__appointment__status")
+             .annotate(rev=Sum("procedure__price_brl")).order_by())
+    for day, provider_id, status, rev in links:
+        acc[(day, provider_id, status)][3] = rev or Decimal("0.00")
+
+    Stat.objects.bulk_create([
+        Stat(day=day, provider_id=provider_id, status=status, appointments=a,
+             encounters=e, encounter_minutes=m, revenue_brl=r)
+        for (day, provider_id, status), (a, e, m, r) in acc.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0003_careplan_carestep_painassessment'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyAppointmentStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('status', models.CharField(choices=[('scheduled', 'Agendada'), ('completed', 'Concluída'), ('no_show', 'Não compareceu'), ('cancelled', 'Cancelada')], max_length=12)),
+                ('appointments', models.PositiveIntegerField(default=0)),
+                ('encounters', models.PositiveIntegerField(default=0)),
+                ('encounter_minutes', models.PositiveIntegerField(default=0)),
+                ('revenue_brl', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('provider', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='clinic.provider')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('day', 'provider', 'status'), name='uniq_daily_stat_bucket')],
+            },
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
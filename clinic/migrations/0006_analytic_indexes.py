@@ -0,0 +1,46 @@
+# Generated by Django 5.2.7 on 2026-10-17 19:51
+
+from django.db import migrations, models
+
+from clinic import pagination
+
+
+def analyze(apps, schema_editor):
+    pagination.analyze(schema_editor.connection.alias)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0005_exportjob'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['provider', 'scheduled_at'], name='clinic_appo_provide_f7a1b3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='careplan',
+            index=models.Index(fields=['protocol', 'patient', 'start_date'], name='clinic_care_protoco_a6ec78_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='carestep',
+            index=models.Index(fields=['care_plan', 'scheduled_at'], name='clinic_care_care_pl_b616e2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='encounter',
+            index=models.Index(fields=['appointment', 'check_out'], name='clinic_enco_appoint_3b6cd0_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='encounter',
+            index=models.Index(fields=['check_in'], name='clinic_enco_check_i_2c520c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='painassessment',
+            index=models.Index(fields=['patient', 'recorded_at'], name='clinic_pain_patient_cc17d9_idx'),
+        ),
+        # sem estatísticas o planner do SQLite estima às cegas e, com os
+        # índices novos, passa a varrer clinic_encounter_procedures na receita
+        migrations.RunPython(analyze, migrations.RunPython.noop),
+    ]
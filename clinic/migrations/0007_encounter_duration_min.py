@@ -0,0 +1,34 @@
+# Generated by Django 5.2.7 on 2026-10-17 19:54
+
+from django.db import migrations, models
+
+
+def backfill(apps, schema_editor):
+    """Preenche duration_min dos atendimentos existentes (minutos inteiros, como Encounter.save())."""
+    Encounter = apps.get_model("clinic", "Encounter")
+    pending = (Encounter.objects.filter(check_out__isnull=False)
+               .only("id", "check_in", "check_out").order_by("id"))
+    batch = []
+    for enc in pending.iterator(chunk_size=2000):
+        enc.duration_min = int((enc.check_out - enc.check_in).total_seconds() // 60)
+        batch.append(enc)
+        if len(batch) >= 2000:
+            Encounter.objects.bulk_update(batch, ["duration_min"])
+            batch = []
+    Encounter.objects.bulk_update(batch, ["duration_min"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0006_analytic_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='encounter',
+            name='duration_min',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.7 on 2026-10-17 19:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0007_encounter_duration_min'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedAppointment',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('scheduled_at', models.DateTimeField(db_index=True)),
+                ('status', models.CharField(choices=[('scheduled', 'Agendada'), ('completed', 'Concluída'), ('no_show', 'Não compareceu'), ('cancelled', 'Cancelada')], max_length=12)),
+                ('created_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='clinic.patient')),
+                ('provider', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='clinic.provider')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedEncounter',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('check_in', models.DateTimeField()),
+                ('check_out', models.DateTimeField(blank=True, null=True)),
+                ('reason', models.CharField(blank=True, max_length=200)),
+                ('duration_min', models.IntegerField(blank=True, null=True)),
+                ('appointment', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='encounter', to='clinic.archivedappointment')),
+                ('diagnoses', models.ManyToManyField(blank=True, related_name='archived_encounters', related_query_name='archived_encounter', to='clinic.diagnosis')),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='clinic.patient')),
+                ('procedures', models.ManyToManyField(blank=True, related_name='archived_encounters', related_query_name='archived_encounter', to='clinic.procedure')),
+                ('provider', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='clinic.provider')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedVitals',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('height_cm', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('weight_kg', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('systolic', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('diastolic', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('heart_rate', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('encounter', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='vitals', to='clinic.archivedencounter')),
+            ],
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 5.2.7 on 2026-10-17 20:04
+
+import re
+import unicodedata
+
+from django.db import migrations, models
+
+# cópias congeladas de clinic.search.fold/tokens: mudanças futuras na busca
+# não podem mudar o que esta migração grava num banco novo
+TOKEN_MAX = 40
+_NON_WORD = re.compile(r"[\W_]+")
+
+
+def fold(text):
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(_NON_WORD.sub(" ", text.casefold()).split())
+
+
+def tokens(text):
+    return sorted({word[:TOKEN_MAX] for word in fold(text).split()})
+
+
+def backfill(apps, schema_editor):
+    """search_name e palavras dos nomes já cadastrados (como clinic.search.prepare/index na época)."""
+    NameToken = apps.get_model("clinic", "NameToken")
+    for kind, name in (("patient", "Patient"), ("provider", "Provider")):
+        model = apps.get_model("clinic", name)
+        batch, words = [], []
+        for obj in model.objects.only("id", "full_name").order_by("id").iterator(chunk_size=2000):
+            obj.search_name = fold(obj.full_name)[:150]
+            batch.append(obj)
+            words += [NameToken(kind=kind, object_id=obj.pk, token=t) for t in tokens(obj.full_name)]
+            if len(batch) >= 2000:
+                model.objects.bulk_update(batch, ["search_name"])
+                NameToken.objects.bulk_create(words)
+                batch, words = [], []
+        model.objects.bulk_update(batch, ["search_name"])
+        NameToken.objects.bulk_create(words)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0008_archive_tables'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patient',
+            name='search_name',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=150),
+        ),
+        migrations.AddField(
+            model_name='provider',
+            name='search_name',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=150),
+        ),
+        migrations.CreateModel(
+            name='NameToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('patient', 'Paciente'), ('provider', 'Profissional')], max_length=10)),
+                ('object_id', models.BigIntegerField()),
+                ('token', models.CharField(max_length=40)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kind', 'token', 'object_id'], name='clinic_name_kind_7bcaa0_idx')],
+            },
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.7 on 2026-10-17 20:07
+
+from django.db import migrations, models
+
+
+def dedup(apps, schema_editor):
+    """
+    Junta diagnósticos com o mesmo código (ignorando espaços nas pontas e a
+    caixa, como Diagnosis.save()) no de menor id: os vínculos com
+    atendimentos (quentes e arquivados) passam para ele, sem duplicar pares,
+    e as cópias são apagadas.
+    """
+    Diagnosis = apps.get_model("clinic", "Diagnosis")
+    links = [apps.get_model("clinic", name)._meta.get_field("diagnoses").remote_field.through
+             for name in ("Encounter", "ArchivedEncounter")]
+
+    groups = {}
+    for pk, code in Diagnosis.objects.order_by("id").values_list("id", "code"):
+        groups.setdefault(code.strip().upper(), []).append(pk)
+
+    for code, (keep, *dupes) in groups.items():
+        if dupes:
+            for through in links:
+                # encounter / archivedencounter
+                owner = next(f.name for f in through._meta.fields if f.name not in ("id", "diagnosis"))
+                linked = set(through.objects.filter(diagnosis_id=keep).values_list(owner, flat=True))
+                for row in through.objects.filter(diagnosis_id__in=dupes).order_by("id"):
+                    owner_id = getattr(row, f"{owner}_id")
+                    if owner_id in linked:
+                        row.delete()
+                    else:
+                        linked.add(owner_id)
+                        through.objects.filter(pk=row.pk).update(diagnosis_id=keep)
+            Diagnosis.objects.filter(pk__in=dupes).delete()
+        Diagnosis.objects.filter(pk=keep).exclude(code=code).update(code=code)
+
+
+class Migration(migrations.Migration):
+
+    # sem transação em volta da migração: a limpeza roda na sua própria
+    # (atomic=True abaixo) e o ALTER TABLE depois dela — no PostgreSQL, o
+    # ALTER TABLE na mesma transação das atualizações falha com
+    # "pending trigger events"
+    atomic = False
+
+    dependencies = [
+        ('clinic', '0009_name_search'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedup, migrations.RunPython.noop, atomic=True),
+        migrations.AlterField(
+            model_name='diagnosis',
+            name='code',
+            field=models.CharField(max_length=10, unique=True),
+        ),
+    ]
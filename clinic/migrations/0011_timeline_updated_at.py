@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-17 20:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0010_diagnosis_code_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='carestep',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='painassessment',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.7 on 2026-10-17 20:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0011_timeline_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NoShowScore',
+            fields=[
+                ('appointment', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='no_show_score', serialize=False, to='clinic.appointment')),
+                ('probability', models.FloatField()),
+                ('scored_at', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -1,12 +1,17 @@
+from django.conf import settings
 from django.db import models
 from decimal import Decimal
 from django.core.validators import MinValueValidator, MaxValueValidator
 
 
 class Diagnosis(models.Model):
-    code = models.CharField(max_length=10)  # ex: J06.9
+    code = models.CharField(max_length=10, unique=True)  # ex: J06.9
     description = models.CharField(max_length=200)
 
+    def save(self, *args, **kwargs):
+        self.code = (self.code or "").strip().upper()  # mesma normalização de 0010_diagnosis_code_unique
+        super().save(*args, **kwargs)
+
     def __str__(self): 
         return f"{self.code} - {self.description}"
 
@@ -28,12 +33,27 @@ class Procedure(models.Model):
     def __str__(self):
         return f"{self.code} - {self.name}"
 
+def _fold_name(obj, save_kwargs):
+    from .search import prepare
+
+    prepare([obj])
+    update_fields = save_kwargs.get("update_fields")
+    if update_fields is not None and "full_name" in update_fields:
+        save_kwargs["update_fields"] = {*update_fields, "search_name"}
+
+
 class Patient(models.Model):
     SEX_CHOICES = (("M", "Masculino"), ("F", "Feminino"), ("O", "Outro"))
     full_name = models.CharField(max_length=150)
     sex = models.CharField(max_length=1, choices=SEX_CHOICES)
     birth_date = models.DateField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # nome sem acento/caixa (clinic.search.fold), mantido pelo save()
+    search_name = models.CharField(max_length=150, blank=True, editable=False, db_index=True)
+
+    def save(self, *args, **kwargs):
+        _fold_name(self, kwargs)
+        super().save(*args, **kwargs)
 
     def __str__(self): 
         return self.full_name
@@ -50,6 +70,11 @@ class Provider(models.Model):
     full_name = models.CharField(max_length=150)
     crm = models.CharField(max_length=30, blank=True)
     specialty = models.CharField(max_length=60, choices=SPECIALTY_CHOICES)
+    search_name = models.CharField(max_length=150, blank=True, editable=False, db_index=True)
+
+    def save(self, *args, **kwargs):
+        _fold_name(self, kwargs)
+        super().save(*args, **kwargs)
 
     def __str__(self): 
         return f"{self.full_name} ({self.specialty})"
@@ -67,7 +92,10 @@ class Appointment(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
-        indexes = [models.Index(fields=["scheduled_at", "status"])]
+        indexes = [
+            models.Index(fields=["scheduled_at", "status"]),
+            models.Index(fields=["provider", "scheduled_at"]),  # agenda por profissional
+        ]
 
     def __str__(self):
         return f"{self.patient} - {self.provider} @ {self.scheduled_at:%d/%m %H:%M}"
@@ -82,14 +110,32 @@ class Encounter(models.Model):
     reason = models.CharField(max_length=200, blank=True)
     diagnoses = models.ManyToManyField('Diagnosis', blank=True)
     procedures = models.ManyToManyField('Procedure', blank=True)
+    # minutos inteiros entre check_in e check_out, mantido pelo save() para
+    # que médias, percentis e histogramas rodem no banco
+    duration_min = models.IntegerField(null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["appointment", "check_out"]),  # atendimentos concluídos por consulta
+            models.Index(fields=["check_in"]),                  # API paginada por check_in
+        ]
+
+    @staticmethod
+    def minutes_between(check_in, check_out):
+        if check_in and check_out:
+            return int((check_out - check_in).total_seconds() // 60)
+        return None
 
+    def save(self, *args, **kwargs):
+        self.duration_min = self.minutes_between(self.check_in, self.check_out)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and {"check_in", "check_out"} & set(update_fields):
+            kwargs["update_fields"] = {*update_fields, "duration_min"}
+        super().save(*args, **kwargs)
 
     @property
     def duration_minutes(self):
-        if self.check_in and self.check_out:
-            delta = self.check_out - self.check_in
-            return int(delta.total_seconds() // 60)
-        return None
+        return self.duration_min
 
     def __str__(self):
         return f"Atendimento de {self.patient} com {self.provider} em {self.check_in:%d/%m/%Y}"
@@ -109,6 +155,9 @@ class CarePlan(models.Model):
     goal_pain_score = models.PositiveSmallIntegerField(default=3,
                        validators=[MinValueValidator(0), MaxValueValidator(10)])
 
+    class Meta:
+        indexes = [models.Index(fields=["protocol", "patient", "start_date"])]
+
     @property
     def protocol_label(self) -> str:
         # evita o alerta do Pylance
@@ -127,6 +176,10 @@ class CareStep(models.Model):
     scheduled_at = models.DateField()
     done_at = models.DateField(null=True, blank=True)
     notes = models.CharField(max_length=200, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)  # ETag/Last-Modified da linha do tempo
+
+    class Meta:
+        indexes = [models.Index(fields=["care_plan", "scheduled_at"])]
 
     def __str__(self):
         return f"{self.care_plan} • {self.procedure.name}"
@@ -143,9 +196,11 @@ class PainAssessment(models.Model):
     recorded_at = models.DateField()
     score = models.PositiveSmallIntegerField(validators=[MinValueValidator(0), MaxValueValidator(10)])
     notes = models.CharField(max_length=200, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)  # ETag/Last-Modified da linha do tempo
 
     class Meta:
         ordering = ["recorded_at"]
+        indexes = [models.Index(fields=["patient", "recorded_at"])]
 
     def __str__(self):
         return f"{self.patient.full_name} • {self.recorded_at} = {self.score}"
@@ -161,3 +216,153 @@ class Vitals(models.Model):
 
     def __str__(self):
         return f"Sinais vitais #{self.pk}"
+
+
+class DailyAppointmentStat(models.Model):
+    """
+    Rollup diário da agenda: uma linha por (dia local, profissional, status).
+    Mantido incrementalmente por clinic.rollups (signals) e reconstruível
+    com `manage.py rebuild_rollups`.
+    """
+    day = models.DateField()  # dia no fuso do projeto (America/Sao_Paulo)
+    provider = models.ForeignKey("Provider", on_delete=models.CASCADE, related_name="daily_stats")
+    status = models.CharField(max_length=12, choices=Appointment.STATUS)
+    appointments = models.PositiveIntegerField(default=0)
+    encounters = models.PositiveIntegerField(default=0)         # atendimentos com check_out
+    encounter_minutes = models.PositiveIntegerField(default=0)  # soma de Encounter.duration_min
+    revenue_brl = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal("0.00"))
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["day", "provider", "status"], name="uniq_daily_stat_bucket"),
+        ]
+
+    def __str__(self):
+        return f"{self.day} • {self.provider_id} • {self.status} = {self.appointments}"
+
+
+class ExportJob(models.Model):
+    """
+    Exportação de consultas feita em segundo plano (`manage.py run_export_jobs`).
+    O arquivo gerado fica em settings.CLINIC_EXPORTS_DIR, comprimido em gzip.
+    """
+    STATUS = (
+        ("pending", "Na fila"),
+        ("running", "Gerando"),
+        ("done", "Pronto"),
+        ("failed", "Falhou"),
+    )
+    FORMATS = (("csv", "CSV"), ("ndjson", "NDJSON"))
+
+    requested_by = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True,
+                                     on_delete=models.SET_NULL, related_name="+")
+    format = models.CharField(max_length=10, choices=FORMATS, default="csv")
+    params = models.JSONField(default=dict, blank=True)  # mesmos filtros da dashboard
+    status = models.CharField(max_length=10, choices=STATUS, default="pending")
+    rows_total = models.PositiveIntegerField(null=True, blank=True)
+    rows_written = models.PositiveIntegerField(default=0)
+    file_name = models.CharField(max_length=200, blank=True)
+    size_bytes = models.PositiveBigIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)  # atualizado a cada bloco gravado
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "created_at"])]
+
+    @property
+    def download_name(self):
+        return f"appointments-{self.pk}.{self.format}.gz"
+
+    def __str__(self):
+        return f"Exportação #{self.pk} ({self.format}) • {self.get_status_display()}"
+
+
+class NameToken(models.Model):
+    """
+    Palavras normalizadas dos nomes de pacientes e profissionais, para a
+    busca por prefixo de clinic.search. Mantida pelos signals de
+    Patient/Provider.
+    """
+    KINDS = (("patient", "Paciente"), ("provider", "Profissional"))
+    kind = models.CharField(max_length=10, choices=KINDS)
+    object_id = models.BigIntegerField()
+    token = models.CharField(max_length=40)
+
+    class Meta:
+        # cobre a busca inteira: faixa de token -> ids, sem tocar na tabela
+        indexes = [models.Index(fields=["kind", "token", "object_id"])]
+
+    def __str__(self):
+        return f"{self.kind}:{self.object_id} {self.token}"
+
+
+class NoShowScore(models.Model):
+    """
+    Probabilidade de não comparecimento de uma consulta agendada futura,
+    calculada em lote por `manage.py score_no_shows` (clinic.noshow). Cada
+    execução substitui todas as notas.
+    """
+    appointment = models.OneToOneField(Appointment, primary_key=True, on_delete=models.CASCADE,
+                                       related_name="no_show_score")
+    probability = models.FloatField()
+    scored_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"Consulta #{self.appointment_id}: {self.probability:.0%} de no-show"
+
+
+# ---------------------------------------------------------------------------
+# arquivo histórico (clinic.archive / manage.py archive_history)
+#
+# Cópias frias de Appointment, Encounter e Vitals, com os mesmos ids e os
+# mesmos nomes de campos e relações (appointment.encounter, encounter.vitals,
+# encounter.procedures...), para que as agregações rodem sem mudança nas duas
+# pontas. Só o índice de data: consultas ao arquivo são sempre por período.
+# ---------------------------------------------------------------------------
+
+class ArchivedAppointment(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    patient = models.ForeignKey("Patient", on_delete=models.CASCADE, related_name="+")
+    provider = models.ForeignKey("Provider", on_delete=models.PROTECT, related_name="+")
+    scheduled_at = models.DateTimeField(db_index=True)
+    status = models.CharField(max_length=12, choices=Appointment.STATUS)
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.patient_id} - {self.provider_id} @ {self.scheduled_at:%d/%m/%Y %H:%M} (arquivo)"
+
+
+class ArchivedEncounter(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    appointment = models.OneToOneField(ArchivedAppointment, null=True, blank=True,
+                                       on_delete=models.SET_NULL, related_name="encounter")
+    patient = models.ForeignKey("Patient", on_delete=models.CASCADE, related_name="+")
+    provider = models.ForeignKey("Provider", on_delete=models.PROTECT, related_name="+")
+    check_in = models.DateTimeField()
+    check_out = models.DateTimeField(null=True, blank=True)
+    reason = models.CharField(max_length=200, blank=True)
+    diagnoses = models.ManyToManyField("Diagnosis", blank=True, related_name="archived_encounters",
+                                       related_query_name="archived_encounter")
+    procedures = models.ManyToManyField("Procedure", blank=True, related_name="archived_encounters",
+                                        related_query_name="archived_encounter")
+    duration_min = models.IntegerField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Atendimento #{self.pk} em {self.check_in:%d/%m/%Y} (arquivo)"
+
+
+class ArchivedVitals(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    encounter = models.OneToOneField(ArchivedEncounter, on_delete=models.CASCADE, related_name="vitals")
+    height_cm = models.PositiveSmallIntegerField(null=True, blank=True)
+    weight_kg = models.PositiveSmallIntegerField(null=True, blank=True)
+    systolic = models.PositiveSmallIntegerField(null=True, blank=True)
+    diastolic = models.PositiveSmallIntegerField(null=True, blank=True)
+    heart_rate = models.PositiveSmallIntegerField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Sinais vitais #{self.pk} (arquivo)"
@@ -0,0 +1,245 @@
+"""
+Risco de no-show das consultas agendadas (`manage.py score_no_shows`, para
+rodar toda noite).
+
+Todo o histórico (tabelas quentes e arquivo) é lido uma vez, em colunas
+NumPy — uma query por tabela, datas já em segundos (clinic.slots.Epoch) — e
+as características de cada consulta saem de somas acumuladas por grupo, sem
+ORM linha a linha:
+
+- taxa de no-show anterior do paciente e do profissional (só consultas já
+  resolvidas antes desta, suavizada em direção à taxa geral), e quantas
+  consultas o paciente já teve;
+- antecedência (scheduled_at - created_at), dia da semana e hora local;
+- dias desde o último atendimento do paciente até a véspera da consulta (o
+  atendimento da própria consulta entregaria o resultado), ou se nunca foi
+  atendido.
+
+Uma regressão logística (Newton, com regularização L2) é ajustada sobre as
+consultas passadas concluídas ou faltadas e dá a probabilidade de cada
+consulta futura com status "scheduled". As notas vão para NoShowScore,
+substituindo as da execução anterior.
+"""
+import math
+from collections import namedtuple
+from datetime import datetime
+from itertools import chain
+
+import numpy as np
+from django.db import connection, connections, transaction
+from django.db.models import Case, IntegerField, Value, When
+from django.utils import timezone
+
+from . import archive, slots
+from .cache import results
+from .models import NoShowScore
+from .payloads import NO_SHOWS_TAG
+
+STATUSES = ("scheduled", "completed", "no_show", "cancelled")
+SCHEDULED, COMPLETED, NO_SHOW, CANCELLED = range(len(STATUSES))
+PRIOR_WEIGHT = 5.0  # consultas "fictícias" na taxa geral que suavizam as taxas
+L2 = 1.0
+MAX_ITER = 25
+HOURS = range(7, 20)  # horas fora da faixa caem na ponta mais próxima
+CHUNK_SIZE = 20000
+DAY = 86400
+
+FEATURES = ("patient_rate", "patient_history", "provider_rate", "lead_days", "since_encounter",
+            "first_visit", *(f"weekday_{d}" for d in range(7)), *(f"hour_{h}" for h in HOURS))
+
+Model = namedtuple("Model", "mean scale weights")
+Run = namedtuple("Run", "history trained base_rate log_loss scored expected")
+
+_SHIFT = np.int64(1 << 33)  # acima de qualquer epoch em segundos até o ano 2242
+
+
+def _columns(qs, names, dates=()):
+    """Colunas int64 de `qs`, uma por nome; as de `dates` em segundos desde a época."""
+    conn = connections[qs.db]
+    if conn.vendor in slots.Epoch.vendors:
+        qs = qs.annotate(**{f"_{n}": slots.Epoch(n) for n in dates})
+        sql, params = (qs.values_list(*(f"_{n}" if n in dates else n for n in names))
+                       .order_by().query.sql_with_params())
+        with conn.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = chain.from_iterable(iter(lambda: cursor.fetchmany(CHUNK_SIZE), []))
+            flat = np.fromiter(chain.from_iterable(rows), dtype=np.int64)
+    else:
+        at = [i for i, n in enumerate(names) if n in dates]
+
+        def convert(row):
+            row = list(row)
+            for i in at:
+                row[i] = int(row[i].timestamp())
+            return row
+        rows = qs.values_list(*names).order_by().iterator(chunk_size=CHUNK_SIZE)
+        flat = np.fromiter(chain.from_iterable(map(convert, rows)), dtype=np.int64)
+    return flat.reshape(-1, len(names)).T
+
+
+def load():
+    """
+    Histórico completo em colunas: (consultas, atendimentos), cada um um dict
+    de arrays. Consultas: id, patient, provider, at, created, status (índice
+    em STATUSES); atendimentos: patient, at (check_in).
+    """
+    status = Case(*(When(status=s, then=Value(i)) for i, s in enumerate(STATUSES)),
+                  default=Value(CANCELLED), output_field=IntegerField())
+    appts, encs = [], []
+    for storage in (archive.COLD, archive.HOT):
+        qs = storage.appointment.objects.annotate(status_code=status)
+        appts.append(_columns(qs, ("id", "patient_id", "provider_id", "scheduled_at", "created_at",
+                                   "status_code"), dates=("scheduled_at", "created_at")))
+        encs.append(_columns(storage.encounter.objects.all(), ("patient_id", "check_in"),
+                             dates=("check_in",)))
+    appts = dict(zip(("id", "patient", "provider", "at", "created", "status"), np.hstack(appts)))
+    encs = dict(zip(("patient", "at"), np.hstack(encs)))
+    return appts, encs
+
+
+def _prior(group, values):
+    """Soma de `values` nas linhas anteriores do mesmo grupo (arrays ordenados por grupo)."""
+    total = np.cumsum(values) - values
+    starts = np.flatnonzero(np.concatenate(([True], group[1:] != group[:-1])))
+    first = np.repeat(starts, np.diff(np.append(starts, len(group))))
+    return total - total[first]
+
+
+def _rate(group, at, ids, resolved, missed, base):
+    """Taxa de no-show anterior de cada linha no seu grupo, e o número de consultas resolvidas."""
+    order = np.lexsort((ids, at, group))
+    seen = np.empty(len(group))
+    misses = np.empty(len(group))
+    seen[order] = _prior(group[order], resolved[order])
+    misses[order] = _prior(group[order], missed[order])
+    return (misses + PRIOR_WEIGHT * base) / (seen + PRIOR_WEIGHT), seen
+
+
+def _last_encounter(patient, at, enc_patient, enc_at):
+    """Epoch do último atendimento do paciente até cada instante de `at` (0 se nenhum)."""
+    n = len(patient)
+    who = np.concatenate((patient, enc_patient))
+    when = np.concatenate((at, enc_at))
+    is_enc = np.concatenate((np.zeros(n, bool), np.ones(len(enc_patient), bool)))
+    # no mesmo instante a consulta vem antes: o atendimento não conta
+    order = np.lexsort((is_enc, when, who))
+    # máximo acumulado por paciente (o deslocamento impede que vaze para o
+    # seguinte); consultas entram com 0 e não mexem no máximo
+    keyed = who[order] * _SHIFT + np.where(is_enc[order], when[order], 0)
+    last = np.maximum.accumulate(keyed) - who[order] * _SHIFT
+    out = np.empty(len(who), dtype=np.int64)
+    out[order] = last
+    return out[:n]
+
+
+def _local(epochs):
+    """(dia da semana, hora) locais de cada epoch; o fuso é consultado uma vez por hora distinta."""
+    tz = timezone.get_current_timezone()
+    hours, inverse = np.unique(epochs // 3600, return_inverse=True)
+    offsets = np.array([datetime.fromtimestamp(int(h) * 3600, tz).utcoffset().total_seconds()
+                        for h in hours], dtype=np.int64)
+    local = epochs + offsets[inverse]
+    # 1970-01-01 foi uma quinta-feira (weekday 3)
+    return (local // DAY + 3) % 7, local % DAY // 3600
+
+
+def features(appts, encs):
+    """Matriz (consultas x FEATURES) e a taxa geral de no-show do histórico."""
+    resolved = np.isin(appts["status"], (COMPLETED, NO_SHOW)).astype(float)
+    missed = (appts["status"] == NO_SHOW).astype(float)
+    base = missed.sum() / resolved.sum() if resolved.any() else 0.0
+
+    patient_rate, history = _rate(appts["patient"], appts["at"], appts["id"], resolved, missed, base)
+    provider_rate, _ = _rate(appts["provider"], appts["at"], appts["id"], resolved, missed, base)
+    lead = np.maximum(appts["at"] - appts["created"], 0) / DAY
+    last = _last_encounter(appts["patient"], appts["at"] - DAY, encs["patient"], encs["at"])
+    first_visit = last == 0
+    since = np.where(first_visit, 0, (appts["at"] - last) / DAY)
+    weekday, hour = _local(appts["at"])
+
+    n = len(appts["id"])
+    X = np.zeros((n, len(FEATURES)), dtype=np.float32)
+    X[:, 0] = patient_rate
+    X[:, 1] = np.log1p(history)
+    X[:, 2] = provider_rate
+    X[:, 3] = np.log1p(lead)
+    X[:, 4] = np.log1p(since)
+    X[:, 5] = first_visit
+    X[np.arange(n), 6 + weekday] = 1
+    X[np.arange(n), 13 + np.clip(hour, HOURS.start, HOURS.stop - 1) - HOURS.start] = 1
+    return X, base
+
+
+def _sigmoid(z):
+    return 0.5 * (1 + np.tanh(0.5 * z))
+
+
+def fit(X, y):
+    """Regressão logística com L2 (o intercepto não é penalizado), por Newton."""
+    mean = X.mean(axis=0, dtype=np.float64)
+    scale = X.std(axis=0, dtype=np.float64)
+    scale[scale == 0] = 1
+    A = np.empty((len(X), X.shape[1] + 1))
+    A[:, 0] = 1
+    np.subtract(X, mean, out=A[:, 1:])
+    A[:, 1:] /= scale
+    penalty = np.full(A.shape[1], L2)
+    penalty[0] = 0
+    rate = min(max(y.mean(), 1e-6), 1 - 1e-6)
+    w = np.zeros(A.shape[1])
+    w[0] = math.log(rate / (1 - rate))
+    for _ in range(MAX_ITER):
+        p = _sigmoid(A @ w)
+        grad = A.T @ (p - y) + penalty * w
+        hess = np.diag(penalty + 1e-9)
+        weight = p * (1 - p)
+        for i in range(0, len(A), CHUNK_SIZE):  # sem uma segunda cópia de A inteira
+            block = A[i:i + CHUNK_SIZE]
+            hess += (block * weight[i:i + CHUNK_SIZE, None]).T @ block
+        step = np.linalg.solve(hess, grad)
+        w -= step
+        if np.abs(step).max() < 1e-6:
+            break
+    return Model(mean, scale, w)
+
+
+def predict(model, X):
+    return _sigmoid(model.weights[0] + ((X - model.mean) / model.scale) @ model.weights[1:])
+
+
+def _save(ids, probabilities, now):
+    """Troca todas as notas pelas novas numa transação (DELETE + INSERT em lote)."""
+    qn = connection.ops.quote_name
+    table = qn(NoShowScore._meta.db_table)
+    sql = (f"INSERT INTO {table} ({qn('appointment_id')}, {qn('probability')}, {qn('scored_at')}) "
+           f"VALUES (%s, %s, %s)")
+    stamp = connection.ops.adapt_datetimefield_value(now)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {table}")
+        for i in range(0, len(ids), CHUNK_SIZE):
+            cursor.executemany(sql, [(pk, p, stamp) for pk, p in
+                                     zip(ids[i:i + CHUNK_SIZE].tolist(), probabilities[i:i + CHUNK_SIZE].tolist())])
+
+
+def run(now=None, dry_run=False):
+    """Ajusta o modelo no histórico e grava as notas das consultas futuras. Retorna um Run."""
+    now = now or timezone.now()
+    appts, encs = load()
+    X, base = features(appts, encs)
+    at, status = appts["at"], appts["status"]
+    past = (at < now.timestamp()) & np.isin(status, (COMPLETED, NO_SHOW))
+    upcoming = (at >= now.timestamp()) & (status == SCHEDULED)
+
+    y = (status[past] == NO_SHOW).astype(float)
+    if len(y):
+        model = fit(X[past], y)
+        fitted = np.clip(predict(model, X[past]), 1e-12, 1 - 1e-12)
+        log_loss = float(-(y * np.log(fitted) + (1 - y) * np.log(1 - fitted)).mean())
+        scores = predict(model, X[upcoming])
+    else:  # sem histórico: todas ficam com a taxa geral (zero)
+        log_loss = 0.0
+        scores = np.full(int(upcoming.sum()), base)
+    if not dry_run:
+        _save(appts["id"][upcoming], scores, now)
+        results().invalidate_tag(NO_SHOWS_TAG)
+    return Run(len(at), int(past.sum()), float(base), log_loss, len(scores), float(scores.sum()))
@@ -0,0 +1,145 @@
+"""
+Auditoria de sobreposições na agenda: consultas do mesmo profissional que
+se sobrepõem (cada uma ocupa CLINIC_SCHEDULE["APPOINTMENT_MIN"] minutos, como
+na busca de horários livres) e atendimentos do mesmo profissional com
+check_in/check_out sobrepostos.
+
+Em vez de comparar pares no banco, cada tipo vira quatro arrays NumPy
+(profissional, início, fim, id) — uma query por armazenamento, com as datas
+já em segundos (clinic.slots.Epoch) — ordenados por (profissional, início)
+e varridos uma vez: um intervalo conflita com o anterior do mesmo
+profissional se começa antes do maior fim visto até ali. Intervalos
+encadeados formam um conjunto de conflito.
+
+A janela pode ser qualquer período (execuções incrementais, ex.: só o último
+dia); ela é estendida para trás para pegar intervalos que começam antes e
+invadem o período, e só os conjuntos que tocam a janela são relatados.
+Consultas canceladas e atendimentos em aberto (sem check_out) não contam.
+"""
+from collections import namedtuple
+from datetime import timedelta
+from itertools import chain
+
+import numpy as np
+from django.db import connections
+from django.db.models import F
+
+from . import archive, slots
+from .cache import results
+
+KINDS = ("appointments", "encounters")
+# atendimentos mais longos que isso não entram na margem da janela
+ENCOUNTER_MARGIN = timedelta(days=1)
+CHUNK_SIZE = 20000
+
+Conflict = namedtuple("Conflict", "kind provider_id ids start end")
+
+_SHIFT = np.int64(1 << 33)  # acima de qualquer epoch em segundos até o ano 2242
+
+
+def _arrays(qs, start, end=None, length=0):
+    """
+    (profissional, início, fim, id) de `qs` como arrays int64. Com `end`
+    None, o fim é início + `length` segundos.
+    """
+    fields = ["provider_id", "id"]
+    if connections[qs.db].vendor in slots.Epoch.vendors:
+        qs = qs.annotate(_start=slots.Epoch(start), _end=slots.Epoch(end or start))
+        # SQL cru: os valores já são inteiros, sem os conversores do ORM linha a linha
+        sql, params = qs.values_list(*fields, "_start", "_end").order_by().query.sql_with_params()
+        with connections[qs.db].cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = chain.from_iterable(iter(lambda: cursor.fetchmany(CHUNK_SIZE), []))
+            flat = np.fromiter(chain.from_iterable(rows), dtype=np.int64)
+    else:
+        rows = ((p, pk, int(s.timestamp()), int((e or s).timestamp()))
+                for p, pk, s, e in qs.values_list(*fields, start, end or start).order_by()
+                .iterator(chunk_size=CHUNK_SIZE))
+        flat = np.fromiter(chain.from_iterable(rows), dtype=np.int64)
+    flat = flat.reshape(-1, 4)
+    provider, pk, lo, hi = flat.T
+    if end is None:
+        hi = hi + length
+    return provider, lo, hi, pk
+
+
+def sweep(provider, start, end):
+    """
+    Rótulo do conjunto de conflito de cada intervalo (ou -1 se não conflita
+    com nenhum). Os arrays devem vir ordenados por (provider, start).
+    """
+    n = len(start)
+    if n < 2:
+        return np.full(n, -1, dtype=np.int64)
+    # maior fim até cada posição, por profissional: o deslocamento por
+    # profissional impede que o máximo de um vaze para o seguinte
+    reach = np.maximum.accumulate(provider * _SHIFT + end) - provider * _SHIFT
+    same = provider[1:] == provider[:-1]
+    overlaps = np.concatenate(([False], same & (start[1:] < reach[:-1])))
+    group = np.cumsum(~overlaps) - 1  # cada não-sobreposição abre um grupo
+    sizes = np.bincount(group)
+    labels = group.copy()
+    labels[sizes[group] < 2] = -1
+    return labels
+
+
+def conflicts(kind, provider, start, end, ids, since=None):
+    """Conjuntos de conflito (Conflict) dos arrays; só os que terminam depois de `since`."""
+    order = np.lexsort((ids, start, provider))
+    provider, start, end, ids = provider[order], start[order], end[order], ids[order]
+    labels = sweep(provider, start, end)
+    members = np.flatnonzero(labels >= 0)
+    if not len(members):
+        return []
+    # posições consecutivas com o mesmo rótulo formam o conjunto; o início
+    # é o do primeiro (ordem por início) e o fim, o maior entre os membros
+    heads = np.concatenate(([0], np.flatnonzero(np.diff(labels[members])) + 1))
+    firsts = start[members[heads]]
+    lasts = np.maximum.reduceat(end[members], heads)
+    sets = np.split(ids[members], heads[1:])
+    return [Conflict(kind, p, group.tolist(), first, last)
+            for p, group, first, last in zip(provider[members[heads]].tolist(), sets,
+                                             firsts.tolist(), lasts.tolist())
+            if since is None or last > since]
+
+
+def _load(kind, since, until, provider_id=None):
+    """Arrays de `kind` com início em [since - margem, until], de todos os armazenamentos."""
+    conf = slots.schedule()
+    parts = []
+    if kind == "appointments":
+        margin = timedelta(minutes=conf["APPOINTMENT_MIN"])
+        for storage in archive.storages(since - margin):
+            qs = (storage.appointment.objects.exclude(status="cancelled")
+                  .filter(scheduled_at__gte=since - margin, scheduled_at__lte=until))
+            if provider_id:
+                qs = qs.filter(provider_id=provider_id)
+            parts.append(_arrays(qs, "scheduled_at", length=conf["APPOINTMENT_MIN"] * 60))
+    else:
+        for storage in archive.storages(since - ENCOUNTER_MARGIN):
+            qs = (storage.encounter.objects.filter(check_out__isnull=False, check_out__gt=F("check_in"),
+                                                   check_in__gte=since - ENCOUNTER_MARGIN,
+                                                   check_in__lte=until))
+            if provider_id:
+                qs = qs.filter(provider_id=provider_id)
+            parts.append(_arrays(qs, "check_in", "check_out"))
+    return [np.concatenate(columns) for columns in zip(*parts)]
+
+
+def audit(since, until, provider_id=None, kinds=KINDS):
+    """Conflitos (Conflict) de cada tipo em `kinds` que tocam [since, until], por profissional e horário."""
+    found = []
+    for kind in kinds:
+        provider, start, end, ids = _load(kind, since, until, provider_id)
+        found += conflicts(kind, provider, start, end, ids, since=int(since.timestamp()))
+    return found
+
+
+def cached_audit(filters):
+    """Relatório do admin para a janela de `filters` (DashboardFilters), no cache de resultados."""
+    first, last = filters.span
+    # a janela carregada começa um dia antes (margem dos atendimentos)
+    return results().get_or_compute(
+        ("overlaps", filters.key),
+        lambda: audit(filters.since, filters.until, int(filters.provider_id) if filters.provider_id else None),
+        span=(first - ENCOUNTER_MARGIN, last))
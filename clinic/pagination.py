@@ -0,0 +1,74 @@
+"""
+Paginação dos changelists do admin sem COUNT(*) nas tabelas grandes.
+
+Abaixo de settings.CLINIC_ADMIN_COUNT_THRESHOLD linhas (estimadas) a
+contagem é exata, como no Paginator do Django. Acima disso:
+
+- sem filtro, vale a estimativa do banco (estatísticas do ANALYZE no SQLite,
+  pg_class.reltuples no PostgreSQL), que não lê a tabela;
+- com filtro/busca, o COUNT exato roda uma vez e fica no cache de resultados
+  (clinic.cache) pelo TTL — páginas seguintes e voltas à lista não repetem.
+
+Tabelas sem estatística (nunca analisadas) caem na contagem exata em cache.
+"""
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections
+from django.utils.functional import cached_property
+
+from .cache import results
+
+DEFAULT_THRESHOLD = 50000
+COUNTS_TAG = "admin_counts"
+
+
+def estimated_rows(model, using="default"):
+    """Linhas da tabela segundo as estatísticas do planner, ou None se não houver."""
+    connection = connections[using]
+    table = model._meta.db_table
+    if connection.vendor == "sqlite":
+        # a primeira coluna de sqlite_stat1.stat é o número de linhas da tabela
+        sql = ("SELECT MAX(CAST(substr(stat, 1, instr(stat || ' ', ' ') - 1) AS INTEGER)) "
+               "FROM sqlite_stat1 WHERE tbl = %s")
+    elif connection.vendor == "postgresql":
+        sql = "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass"
+    else:
+        return None
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [table])
+            row = cursor.fetchone()
+    except DatabaseError:  # sqlite_stat1 só existe depois do primeiro ANALYZE
+        return None
+    value = row[0] if row else None
+    return value if value is not None and value >= 0 else None
+
+
+def analyze(using="default"):
+    """
+    Atualiza as estatísticas do planner (ANALYZE) onde o comando existe assim,
+    no SQLite e no PostgreSQL; nos demais bancos não faz nada. Retorna se rodou.
+    """
+    connection = connections[using]
+    if connection.vendor not in ("sqlite", "postgresql"):
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE")
+    return True
+
+
+class ApproximateCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        qs = self.object_list
+        if not hasattr(qs, "query"):
+            return super().count
+        threshold = getattr(settings, "CLINIC_ADMIN_COUNT_THRESHOLD", DEFAULT_THRESHOLD)
+        estimate = estimated_rows(qs.model, qs.db)
+        if estimate is not None and estimate < threshold:
+            return qs.count()
+        if estimate is not None and not qs.query.where:
+            return estimate
+        sql, params = qs.query.sql_with_params()
+        key = ("admin_count", qs.db, sql, tuple(map(repr, params)))
+        return results().get_or_compute(key, qs.count, tags=[COUNTS_TAG])
@@ -0,0 +1,48 @@
+"""
+Execução concorrente de agregações síncronas (ORM) a partir de views async.
+
+Cada chamada roda numa thread própria via `sync_to_async(thread_sensitive=False)`
+e um semáforo limita quantas rodam ao mesmo tempo — cada thread abre a sua
+conexão com o banco, então o limite também é o número de conexões extras por
+requisição (settings.CLINIC_ASYNC_CONCURRENCY).
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+DEFAULT_CONCURRENCY = 4
+
+
+def concurrency_limit():
+    return max(1, int(getattr(settings, "CLINIC_ASYNC_CONCURRENCY", DEFAULT_CONCURRENCY)))
+
+
+def _in_worker(fn):
+    def run():
+        try:
+            return fn()
+        finally:
+            # a thread do executor é reaproveitada: devolve a conexão conforme CONN_MAX_AGE
+            close_old_connections()
+    return run
+
+
+async def gather(calls, limit=None):
+    """
+    Roda os callables (sem argumentos) de `calls` concorrentemente, no máximo
+    `limit` por vez, e devolve os resultados na mesma ordem. Com limite 1
+    roda tudo em sequência na thread da requisição (mesma conexão).
+    """
+    limit = limit or concurrency_limit()
+    if limit <= 1:
+        return [await sync_to_async(fn)() for fn in calls]
+
+    semaphore = asyncio.Semaphore(limit)
+
+    async def bounded(fn):
+        async with semaphore:
+            return await sync_to_async(_in_worker(fn), thread_sensitive=False)()
+
+    return await asyncio.gather(*(bounded(fn) for fn in calls))
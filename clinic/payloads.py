@@ -0,0 +1,132 @@
+"""
+Blocos de dados da dashboard, já no formato que os gráficos consomem.
+
+Cada bloco é calculado uma vez por combinação de filtros e guardado no cache
+de resultados (clinic.cache); as views só montam o contexto a partir deles.
+Janelas que alcançam o arquivo histórico (clinic.archive) somam as tabelas
+quentes e as frias.
+"""
+from datetime import datetime, time, timedelta
+
+from django.db.models import Count
+from django.utils import timezone
+
+from . import analytics, archive, rollups
+from .cache import results
+from .models import Diagnosis, Procedure
+
+PROTOCOLS_TAG = "protocols"
+NO_SHOWS_TAG = "no_shows"
+FORECAST_DAYS = 14
+
+
+def _cached(name, filters, compute):
+    return results().get_or_compute((name, *filters.key), compute, span=filters.span)
+
+
+def _counted(filters, build, count, limit=None):
+    """
+    Ranking por contagem: `build(storage, appts)` monta a query (ordenada por
+    -count) de cada armazenamento. Com um só, o limite vai para o SQL; com
+    arquivo, as contagens das linhas iguais são somadas antes de ordenar.
+    """
+    sources = archive.sources(filters)
+    if len(sources) == 1:
+        qs = build(*sources[0])
+        return list(qs[:limit] if limit else qs)
+    totals = {}
+    for storage, appts in sources:
+        for r in build(storage, appts):
+            n = r.pop(count)
+            key = tuple(r.items())
+            totals[key] = totals.get(key, 0) + n
+    ranked = sorted(totals.items(), key=lambda kv: (-kv[1], kv[0]))
+    return [{**dict(key), count: n} for key, n in ranked[:limit]]
+
+
+def appointments(filters):
+    """KPIs, série diária, especialidades e receita do período."""
+    def compute():
+        # contagens, séries e receita vêm do rollup diário; se ele estiver
+        # desligado, caem para as agregações diretas sobre Appointment
+        if rollups.enabled():
+            buckets = rollups.buckets(filters.since, filters.until,
+                                      status=filters.status, provider_id=filters.provider_id)
+            return {
+                "kpis": analytics.bucket_kpis(buckets),
+                "daily": analytics.bucket_daily(buckets),
+                "by_spec": analytics.bucket_specialties(buckets),
+                "revenue_total": round(analytics.bucket_revenue(buckets), 2),
+            }
+        appts = [qs for _, qs in archive.sources(filters)]
+        return {
+            "kpis": analytics.appointment_kpis(*appts),
+            "daily": analytics.daily_counts(*appts),
+            "by_spec": analytics.specialty_counts(*appts),
+            "revenue_total": round(analytics.procedure_revenue(*appts), 2),
+        }
+    return _cached("appointments", filters, compute)
+
+
+def top_diagnoses(filters, limit=10):
+    def compute():
+        def build(storage, appts):
+            return (Diagnosis.objects
+                    .filter(**{f"{storage.relation}__appointment__in": appts,
+                               f"{storage.relation}__check_out__isnull": False})
+                    .values("code", "description").annotate(cnt=Count("id")).order_by("-cnt"))
+        return [{"label": f'{r["code"]}', "cnt": r["cnt"]} for r in _counted(filters, build, "cnt", limit)]
+    return _cached("top_dx", filters, compute)
+
+
+def procedures(filters):
+    """Procedimentos realizados nos atendimentos concluídos do período."""
+    def compute():
+        def build(storage, appts):
+            return (Procedure.objects
+                    .filter(**{f"{storage.relation}__appointment__in": appts,
+                               f"{storage.relation}__check_out__isnull": False})
+                    .values("name", "category__name")
+                    .annotate(qtd=Count("id"))
+                    .order_by("-qtd"))
+        return [{"label": r["name"], "cnt": r["qtd"], "cat": r["category__name"]}
+                for r in _counted(filters, build, "qtd")]
+    return _cached("procedures", filters, compute)
+
+
+def durations(filters):
+    """Duração dos atendimentos concluídos por profissional, especialidade e procedimento."""
+    def compute():
+        encounters = [storage.encounter.objects.filter(appointment__in=appts, check_out__isnull=False)
+                      for storage, appts in archive.sources(filters)]
+        if len(encounters) == 1:
+            return {by: analytics.duration_stats(encounters[0], by) for by in analytics.DURATION_GROUPS}
+        return {by: analytics.merged_duration_stats(encounters, by) for by in analytics.DURATION_GROUPS}
+    return _cached("durations", filters, compute)
+
+
+def pain_protocols():
+    """Redução média e curva de dor por protocolo (independem do período)."""
+    return results().get_or_compute(("pain_protocols",), analytics.pain_protocol_stats,
+                                    tags=[PROTOCOLS_TAG])
+
+
+def top_procedures():
+    """Procedimentos mais frequentes nos planos de cuidado (independem do período)."""
+    return results().get_or_compute(("top_procedures",), analytics.top_procedures,
+                                    tags=[PROTOCOLS_TAG])
+
+
+def expected_no_shows(filters):
+    """
+    Consultas agendadas e no-shows esperados (soma das notas de clinic.noshow)
+    por dia, de agora até FORECAST_DAYS dias à frente. Só o profissional dos
+    filtros vale: o período da dashboard olha para trás.
+    """
+    first = timezone.localdate()
+    last = first + timedelta(days=FORECAST_DAYS - 1)
+    until = timezone.make_aware(datetime.combine(last, time.max))
+    return results().get_or_compute(
+        ("no_shows", first, filters.provider_id),
+        lambda: analytics.expected_no_shows(timezone.now(), until, filters.provider_id),
+        span=(first, last), tags=[NO_SHOWS_TAG])
@@ -0,0 +1,146 @@
+"""
+Instrumentação de queries para benchmarks e testes de orçamento de queries.
+
+`QueryProbe` se pendura na conexão via `execute_wrapper` e conta, enquanto
+ativo, as queries executadas e as linhas efetivamente lidas (fetchone /
+fetchmany / fetchall / iteração no cursor) — o que o ORM trouxe do banco,
+não o que a view acabou usando. Com `trace=True` cada query guarda também o
+ponto do código do projeto que a disparou, para relatórios agrupados.
+"""
+import os
+import traceback
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import connections
+from django.urls import reverse
+
+
+def call_site():
+    """Frame mais interno do código do projeto (fora de libs e deste módulo)."""
+    base = str(settings.BASE_DIR) + os.sep
+    for frame in reversed(traceback.extract_stack()[:-1]):
+        path = frame.filename
+        if (path.startswith(base) and "site-packages" not in path
+                and not path.endswith(os.sep + "profiling.py")):
+            return f"{os.path.relpath(path, base)}:{frame.lineno} ({frame.name})"
+    return "?"
+
+
+class _CountingCursor:
+    """Proxy do cursor DB-API que soma as linhas lidas no probe."""
+
+    def __init__(self, cursor, probe):
+        self._cursor = cursor
+        self._probe = probe
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._probe.rows += 1
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = self._cursor.fetchmany(*args, **kwargs)
+        self._probe.rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._probe.rows += len(rows)
+        return rows
+
+    def __iter__(self):
+        for row in self._cursor:
+            self._probe.rows += 1
+            yield row
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class QueryProbe:
+    """
+    Context manager: conta queries e linhas lidas na conexão `using`.
+
+        with QueryProbe() as probe:
+            client.get(url)
+        probe.queries, probe.rows, probe.statements
+    """
+
+    def __init__(self, using="default", trace=False):
+        self.connection = connections[using]
+        self.trace = trace
+        self.queries = 0
+        self.rows = 0
+        self.statements = []  # (sql, params, call_site ou None)
+        self._wrapper = None
+
+    def __call__(self, execute, sql, params, many, context):
+        wrapper = context["cursor"]
+        if not isinstance(wrapper.cursor, _CountingCursor):
+            wrapper.cursor = _CountingCursor(wrapper.cursor, self)
+        self.queries += 1
+        self.statements.append((sql, params, call_site() if self.trace else None))
+        return execute(sql, params, many, context)
+
+    def report(self):
+        """Queries agrupadas por ponto de chamada, na ordem em que apareceram."""
+        groups = OrderedDict()
+        for sql, _, site in self.statements:
+            groups.setdefault(site or "?", []).append(sql)
+        lines = []
+        for site, sqls in groups.items():
+            lines.append(f"{site} — {len(sqls)} quer{'y' if len(sqls) == 1 else 'ies'}")
+            lines.extend(f"    {sql}" for sql in sqls)
+        return "\n".join(lines)
+
+    def __enter__(self):
+        self._wrapper = self.connection.execute_wrapper(self)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        self._wrapper.__exit__(*exc)
+        self._wrapper = None
+
+
+def view_targets(client):
+    """
+    Carregamentos das views principais pelo `client` (test Client já logado
+    como staff), cada um consumindo a resposta inteira. Usado por
+    `manage.py bench` e `manage.py check_query_plans`.
+    """
+    from .models import CarePlan
+    from .widgets import WIDGETS
+
+    plan = CarePlan.objects.order_by("id").first()
+
+    def get(url, status=200, headers=None):
+        response = client.get(url, headers=headers)
+        if response.status_code != status:
+            raise RuntimeError(f"GET {url} devolveu {response.status_code}")
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+        return response
+
+    def dashboard():
+        # esqueleto + todos os widgets, como o navegador faz
+        get(reverse("dashboard"))
+        for widget in WIDGETS:
+            get(reverse("dashboard_widget", args=[widget]))
+
+    targets = {
+        "dashboard": dashboard,
+        "protocols": lambda: get(reverse("protocols_dashboard")),
+        "export_csv": lambda: get(reverse("export_csv")),
+    }
+    if plan:
+        targets["timeline"] = lambda: get(reverse("patient_timeline", args=[plan.patient_id]))
+        api = reverse("api_patient_timeline", args=[plan.patient_id])
+        # GET condicional com a versão atual, como o navegador revalidando: 304
+        etag = get(api)["ETag"]
+        targets["timeline_api"] = lambda: get(api)
+        targets["timeline_304"] = lambda: get(api, 304, {"If-None-Match": etag})
+    return targets
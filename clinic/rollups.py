@@ -0,0 +1,275 @@
+"""
+Rollup diário da agenda (DailyAppointmentStat).
+
+Cada bucket (dia local, profissional, status) guarda contagem de consultas,
+atendimentos concluídos, minutos atendidos e receita estimada. Os buckets são
+recalculados a partir das tabelas brutas:
+
+- incrementalmente, pelos signals de Appointment/Encounter (clinic.signals);
+- em lote, por `rebuild()` / `manage.py rebuild_rollups`.
+
+Consultas movidas para o arquivo histórico (clinic.archive) continuam
+contando: o cálculo lê também as tabelas frias quando o intervalo alcança o
+arquivo.
+
+`buckets()` devolve a janela pedida lendo os dias completos do rollup e só as
+bordas parciais (ex.: "últimos 30 dias" começa no meio de um dia) das tabelas
+brutas, então o resultado é sempre igual ao cálculo direto.
+
+Mudar o preço de um Procedure (ou apagá-lo) suja os dias dos atendimentos
+concluídos que o usam (`procedure_keys()`), nas duas pontas; reajustes de
+procedimentos muito usados recalculam muitos dias na mesma transação.
+"""
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Min, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from . import archive
+from .models import DailyAppointmentStat
+
+Bucket = namedtuple(
+    "Bucket",
+    "day provider_id status appointments encounters encounter_minutes revenue_brl",
+)
+
+REBUILD_CHUNK_DAYS = 31
+
+_local = threading.local()
+
+
+def enabled():
+    return getattr(settings, "CLINIC_DASHBOARD_ROLLUPS", True)
+
+
+def day_start(day):
+    """Meia-noite local do dia, como datetime aware."""
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+# ---------------------------------------------------------------------------
+# cálculo a partir das tabelas brutas
+# ---------------------------------------------------------------------------
+
+def _compute(lo, hi, provider_ids=None, include_hi=False, cached=True):
+    """
+    Agrega as consultas com lo <= scheduled_at < hi (ou <= hi) em buckets.
+    Retorna {(day, provider_id, status): Bucket}. Antes de gravar no rollup
+    use `cached=False`: os limites do arquivo vêm do banco, não do cache.
+    """
+    def appt_filter(prefix=""):
+        f = {f"{prefix}scheduled_at__gte": lo,
+             f"{prefix}scheduled_at__{'lte' if include_hi else 'lt'}": hi}
+        if provider_ids is not None:
+            f[f"{prefix}provider_id__in"] = provider_ids
+        return f
+
+    acc = {}
+
+    def slot(day, provider_id, status):
+        key = (day, provider_id, status)
+        if key not in acc:
+            acc[key] = [0, 0, 0, Decimal("0.00")]
+        return acc[key]
+
+    for storage in archive.storages(lo, cached):
+        appts = (storage.appointment.objects.filter(**appt_filter())
+                 .annotate(day=TruncDate("scheduled_at"))
+                 .values_list("day", "provider_id", "status")
+                 .annotate(cnt=Count("id"))
+                 .order_by())
+        for day, provider_id, status, cnt in appts:
+            slot(day, provider_id, status)[0] += cnt
+
+        encs = (storage.encounter.objects.filter(check_out__isnull=False, **appt_filter("appointment__"))
+                .annotate(day=TruncDate("appointment__scheduled_at"))
+                .values_list("day", "appointment__provider_id", "appointment__status")
+                .annotate(cnt=Count("id"), minutes=Sum("duration_min"))
+                .order_by())
+        for day, provider_id, status, cnt, minutes in encs:
+            s = slot(day, provider_id, status)
+            s[1] += cnt
+            s[2] += minutes or 0
+
+        link = f"{storage.link}__"
+        links = (storage.encounter.procedures.through.objects
+                 .filter(**{f"{link}check_out__isnull": False}, **appt_filter(f"{link}appointment__"))
+                 .annotate(day=TruncDate(f"{link}appointment__scheduled_at"))
+                 .values_list("day", f"{link}appointment__provider_id", f"{link}appointment__status")
+                 .annotate(rev=Sum("procedure__price_brl"))
+                 .order_by())
+        for day, provider_id, status, rev in links:
+            slot(day, provider_id, status)[3] += rev or Decimal("0.00")
+
+    return {k: Bucket(*k, *v) for k, v in acc.items()}
+
+
+def _store(first_day, last_day, computed, provider_ids=None):
+    """Substitui os buckets de [first_day, last_day] (e dos profissionais dados)."""
+    stale = DailyAppointmentStat.objects.filter(day__gte=first_day, day__lte=last_day)
+    if provider_ids is not None:
+        stale = stale.filter(provider_id__in=provider_ids)
+    stale.delete()
+    DailyAppointmentStat.objects.bulk_create([
+        DailyAppointmentStat(
+            day=b.day, provider_id=b.provider_id, status=b.status,
+            appointments=b.appointments, encounters=b.encounters,
+            encounter_minutes=b.encounter_minutes, revenue_brl=b.revenue_brl,
+        )
+        for b in computed.values() if b.appointments
+    ], batch_size=1000)
+    return sum(1 for b in computed.values() if b.appointments)
+
+
+def rebuild(start=None, end=None, provider_ids=None, stdout=None):
+    """
+    Recalcula os buckets entre os dias `start` e `end` (inclusive). Sem
+    limites, cobre toda a agenda. Processa em blocos de ~1 mês, cada um na
+    sua transação. Retorna o total de buckets gravados.
+    """
+    if start is None or end is None:
+        ends = [s.appointment.objects.aggregate(first=Min("scheduled_at"), last=Max("scheduled_at"))
+                for s in (archive.COLD, archive.HOT)]
+        ends = [row for row in ends if row["first"] is not None]
+        if not ends:
+            DailyAppointmentStat.objects.all().delete()
+            return 0
+        start = start or timezone.localdate(min(row["first"] for row in ends))
+        end = end or timezone.localdate(max(row["last"] for row in ends))
+
+    written = 0
+    chunk_start = start
+    while chunk_start <= end:
+        chunk_end = min(chunk_start + timedelta(days=REBUILD_CHUNK_DAYS - 1), end)
+        with transaction.atomic():
+            computed = _compute(day_start(chunk_start), day_start(chunk_end + timedelta(days=1)),
+                                provider_ids=provider_ids, cached=False)
+            written += _store(chunk_start, chunk_end, computed, provider_ids=provider_ids)
+        if stdout is not None:
+            stdout.write(f"  {chunk_start} → {chunk_end}")
+        chunk_start = chunk_end + timedelta(days=1)
+    return written
+
+
+def refresh(keys):
+    """
+    Recalcula os buckets dos pares (dia, profissional) informados. Dias
+    seguidos (até REBUILD_CHUNK_DAYS) são calculados juntos, para a união
+    dos profissionais — cargas em lote tocam muitos dias de uma vez.
+    """
+    by_day = {}
+    for day, provider_id in keys:
+        by_day.setdefault(day, set()).add(provider_id)
+    runs = []  # [primeiro dia, último dia, profissionais]
+    for day, provider_ids in sorted(by_day.items()):
+        run = runs[-1] if runs else None
+        if run and day == run[1] + timedelta(days=1) and (day - run[0]).days < REBUILD_CHUNK_DAYS:
+            run[1] = day
+            run[2] |= provider_ids
+        else:
+            runs.append([day, day, set(provider_ids)])
+    for first, last, provider_ids in runs:
+        provider_ids = sorted(provider_ids)
+        computed = _compute(day_start(first), day_start(last + timedelta(days=1)),
+                            provider_ids=provider_ids, cached=False)
+        _store(first, last, computed, provider_ids=provider_ids)
+
+
+# ---------------------------------------------------------------------------
+# manutenção incremental
+# ---------------------------------------------------------------------------
+
+def mark_dirty(scheduled_at, provider_id):
+    """
+    Marca o bucket de uma consulta como desatualizado. Fora de `deferred()`
+    o recálculo é imediato (na mesma transação de quem salvou).
+    """
+    if scheduled_at is None or provider_id is None:
+        return
+    mark_keys([(timezone.localdate(scheduled_at), provider_id)])
+
+
+def mark_keys(keys):
+    """Como `mark_dirty`, para pares (dia, profissional) já calculados."""
+    pending = getattr(_local, "pending", None)
+    if pending is not None:
+        pending.update(keys)
+    elif keys:
+        refresh(keys)
+
+
+def procedure_keys(procedure_id):
+    """(dia, profissional) das consultas com atendimento concluído que usam o procedimento."""
+    keys = set()
+    for storage in (archive.COLD, archive.HOT):
+        link = f"{storage.link}__"
+        keys.update(storage.encounter.procedures.through.objects
+                    .filter(**{"procedure_id": procedure_id, f"{link}check_out__isnull": False,
+                               f"{link}appointment__isnull": False})
+                    .annotate(day=TruncDate(f"{link}appointment__scheduled_at"))
+                    .values_list("day", f"{link}appointment__provider_id")
+                    .distinct().order_by())
+    return keys
+
+
+@contextmanager
+def deferred():
+    """
+    Acumula os buckets sujos e recalcula cada um uma única vez na saída.
+    Útil para cargas em lote (seed, importações) que salvam muitas linhas.
+    """
+    outer = getattr(_local, "pending", None)
+    if outer is not None:
+        yield
+        return
+    _local.pending = set()
+    try:
+        yield
+        pending = _local.pending
+    finally:
+        _local.pending = None
+    refresh(pending)
+
+
+# ---------------------------------------------------------------------------
+# leitura
+# ---------------------------------------------------------------------------
+
+def buckets(since, until, status="", provider_id=""):
+    """
+    Buckets das consultas com since <= scheduled_at <= until, já filtrados
+    por status/profissional. Dias completos vêm do rollup; as bordas
+    parciais da janela são calculadas das tabelas brutas.
+    """
+    first_full = timezone.localdate(since)
+    if since > day_start(first_full):
+        first_full += timedelta(days=1)
+    last_full = timezone.localdate(until)
+    if until < day_start(last_full + timedelta(days=1)) - timedelta(microseconds=1):
+        last_full -= timedelta(days=1)
+
+    provider_ids = [int(provider_id)] if provider_id else None
+    rows = []
+    if first_full > last_full:
+        rows.extend(_compute(since, until, provider_ids, include_hi=True).values())
+    else:
+        if since < day_start(first_full):
+            rows.extend(_compute(since, day_start(first_full), provider_ids).values())
+        stats = DailyAppointmentStat.objects.filter(day__gte=first_full, day__lte=last_full)
+        if provider_ids is not None:
+            stats = stats.filter(provider_id__in=provider_ids)
+        if status:
+            stats = stats.filter(status=status)
+        rows.extend(Bucket(*r) for r in stats.values_list(*Bucket._fields))
+        tail = day_start(last_full + timedelta(days=1))
+        if tail <= until:
+            rows.extend(_compute(tail, until, provider_ids, include_hi=True).values())
+
+    return [b for b in rows if b.appointments and (not status or b.status == status)]
@@ -0,0 +1,93 @@
+"""
+Busca de pacientes e profissionais por nome, sem acento e sem caixa.
+
+Cada nome é normalizado por `fold()` ("João da Silva" → "joao da silva") e
+guardado em `search_name` (ordem e exibição) e quebrado em palavras na tabela
+NameToken, indexada por (kind, token, object_id). Cada palavra da busca é um
+prefixo de alguma palavra do nome ("jo sil" acha "João da Silva") e vira uma
+faixa token >= "sil" AND token < "sil" + U+10FFFF, que o índice resolve sem
+varrer a tabela — diferente de LIKE/icontains.
+
+As palavras são mantidas pelos signals de Patient/Provider (clinic.signals);
+cargas com bulk_create chamam `prepare()` antes e `index()` depois.
+`manage.py rebuild_search_index` refaz tudo.
+"""
+import re
+import unicodedata
+
+from django.contrib.admin.utils import get_fields_from_path
+from django.db.models import Q
+
+from .models import NameToken, Patient, Provider
+
+TOKEN_MAX = 40
+LOOKUP_LIMIT = 20
+LOOKUP_MAX = 50
+
+KIND_OF = {Patient: "patient", Provider: "provider"}
+
+_NON_WORD = re.compile(r"[\W_]+")
+_AFTER = chr(0x10FFFF)  # maior que qualquer continuação do prefixo
+
+
+def fold(text):
+    """Minúsculas, sem acentos, só letras/dígitos separados por um espaço."""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(_NON_WORD.sub(" ", text.casefold()).split())
+
+
+def tokens(text):
+    return sorted({word[:TOKEN_MAX] for word in fold(text).split()})
+
+
+def prepare(objs):
+    """Preenche search_name de objetos que vão para um bulk_create."""
+    for obj in objs:
+        obj.search_name = fold(obj.full_name)[:obj._meta.get_field("search_name").max_length]
+    return objs
+
+
+def index(model, objs):
+    """(Re)grava as palavras dos nomes de `objs` (já salvos)."""
+    kind = KIND_OF[model]
+    objs = list(objs)
+    NameToken.objects.filter(kind=kind, object_id__in=[o.pk for o in objs]).delete()
+    NameToken.objects.bulk_create([
+        NameToken(kind=kind, object_id=o.pk, token=token)
+        for o in objs for token in tokens(o.full_name)
+    ], batch_size=2000)
+
+
+def unindex(model, ids):
+    NameToken.objects.filter(kind=KIND_OF[model], object_id__in=ids).delete()
+
+
+def matching_ids(model, query):
+    """
+    Subquery com os ids de `model` cujo nome tem, para cada palavra da
+    busca, uma palavra começando por ela. Busca vazia não acha nada.
+    """
+    kind = KIND_OF[model]
+    ids = NameToken.objects.none().values("object_id")
+    for i, word in enumerate(tokens(query)):
+        words = NameToken.objects.filter(kind=kind, token__gte=word, token__lt=word + _AFTER)
+        ids = words.values("object_id") if i == 0 else words.filter(object_id__in=ids).values("object_id")
+    return ids
+
+
+def lookup(model, query, limit=LOOKUP_LIMIT):
+    """Primeiros `limit` registros de `model` que casam com `query`, em ordem de nome."""
+    return (model.objects.filter(pk__in=matching_ids(model, query))
+            .order_by("search_name", "pk")[:limit])
+
+
+def is_name_field(field):
+    return field == "search_name" or field.endswith("__search_name")
+
+
+def name_condition(model, field, query):
+    """Q de busca por palavras para um campo `search_name` / `<fk>__search_name` de `model`."""
+    path = field[:-len("search_name")]
+    target = get_fields_from_path(model, path[:-2])[-1].related_model if path else model
+    return Q(**{f"{path}pk__in": matching_ids(target, query)})
@@ -0,0 +1,215 @@
+"""
+Signals que mantêm os agregados derivados (rollup diário e cache de
+resultados da dashboard) em dia.
+"""
+import functools
+import threading
+from contextlib import contextmanager
+
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import icd, rollups, search
+from .cache import results
+from .models import (
+    Appointment, CarePlan, CareStep, Diagnosis, Encounter, PainAssessment, Patient,
+    Procedure, ProcedureCategory, Provider,
+)
+from .payloads import PROTOCOLS_TAG
+
+_local = threading.local()
+
+
+@contextmanager
+def suspended():
+    """
+    Desliga, na thread atual, os receivers da agenda (rollup + cache por dia).
+    Para quem move linhas sem mudar nenhum total, como o arquivamento.
+    """
+    outer = getattr(_local, "suspended", False)
+    _local.suspended = True
+    try:
+        yield
+    finally:
+        _local.suspended = outer
+
+
+def _agenda(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not getattr(_local, "suspended", False):
+            func(*args, **kwargs)
+    return wrapper
+
+
+def _touch(scheduled_at, provider_id, rollup=True):
+    """A consulta (ou algo pendurado nela) mudou: suja rollup e cache do dia."""
+    if scheduled_at is None:
+        return
+    if rollup:
+        rollups.mark_dirty(scheduled_at, provider_id)
+    results().invalidate_days(timezone.localdate(scheduled_at))
+
+
+def _mark_appointments(appointment_ids, rollup=True):
+    ids = [pk for pk in appointment_ids if pk is not None]
+    if not ids:
+        return
+    for scheduled_at, provider_id in (Appointment.objects.filter(pk__in=ids)
+                                      .values_list("scheduled_at", "provider_id")):
+        _touch(scheduled_at, provider_id, rollup=rollup)
+
+
+# --- Appointment ------------------------------------------------------------
+
+@receiver(pre_save, sender=Appointment)
+@_agenda
+def appointment_pre_save(sender, instance, raw=False, **kwargs):
+    # guarda o bucket antigo: remarcar/trocar de médico suja os dois
+    instance._rollup_old = None
+    if instance.pk and not raw:
+        instance._rollup_old = (Appointment.objects.filter(pk=instance.pk)
+                                .values_list("scheduled_at", "provider_id").first())
+
+
+@receiver(post_save, sender=Appointment)
+@_agenda
+def appointment_post_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    old = getattr(instance, "_rollup_old", None)
+    if old and old != (instance.scheduled_at, instance.provider_id):
+        _touch(*old)
+    _touch(instance.scheduled_at, instance.provider_id)
+
+
+@receiver(post_delete, sender=Appointment)
+@_agenda
+def appointment_post_delete(sender, instance, **kwargs):
+    _touch(instance.scheduled_at, instance.provider_id)
+
+
+# --- Encounter --------------------------------------------------------------
+
+@receiver(pre_save, sender=Encounter)
+@_agenda
+def encounter_pre_save(sender, instance, raw=False, **kwargs):
+    instance._rollup_old_appointment = None
+    if instance.pk and not raw:
+        instance._rollup_old_appointment = (Encounter.objects.filter(pk=instance.pk)
+                                            .values_list("appointment_id", flat=True).first())
+
+
+@receiver(post_save, sender=Encounter)
+@_agenda
+def encounter_post_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    _mark_appointments({instance.appointment_id,
+                        getattr(instance, "_rollup_old_appointment", None)})
+
+
+@receiver(post_delete, sender=Encounter)
+@_agenda
+def encounter_post_delete(sender, instance, **kwargs):
+    _mark_appointments([instance.appointment_id])
+
+
+@receiver(m2m_changed, sender=Encounter.diagnoses.through)
+@receiver(m2m_changed, sender=Encounter.procedures.through)
+@_agenda
+def encounter_links_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # diagnósticos não entram no rollup, só nos blocos em cache
+    rollup = sender is Encounter.procedures.through
+    if action == "pre_clear":
+        # depois do clear não dá mais para saber quais atendimentos eram afetados
+        encounters = instance.encounter_set.all() if reverse else Encounter.objects.filter(pk=instance.pk)
+        instance._rollup_cleared = list(encounters.values_list("appointment_id", flat=True))
+    elif action == "post_clear":
+        _mark_appointments(getattr(instance, "_rollup_cleared", []), rollup=rollup)
+    elif action in ("post_add", "post_remove"):
+        if reverse:
+            _mark_appointments(Encounter.objects.filter(pk__in=pk_set)
+                               .values_list("appointment_id", flat=True), rollup=rollup)
+        else:
+            _mark_appointments([instance.appointment_id], rollup=rollup)
+
+
+# --- preços de procedimentos (receita do rollup) ------------------------------
+
+@receiver(pre_save, sender=Procedure)
+@_agenda
+def procedure_pre_save(sender, instance, raw=False, **kwargs):
+    instance._rollup_old_price = None
+    if instance.pk and not raw:
+        instance._rollup_old_price = (Procedure.objects.filter(pk=instance.pk)
+                                      .values_list("price_brl", flat=True).first())
+
+
+@receiver(post_save, sender=Procedure)
+@_agenda
+def procedure_post_save(sender, instance, raw=False, **kwargs):
+    old = getattr(instance, "_rollup_old_price", None)
+    if old is not None and old != instance.price_brl:
+        rollups.mark_keys(rollups.procedure_keys(instance.pk))
+
+
+@receiver(pre_delete, sender=Procedure)
+@_agenda
+def procedure_pre_delete(sender, instance, **kwargs):
+    # os vínculos somem em cascata, sem m2m_changed
+    instance._rollup_keys = rollups.procedure_keys(instance.pk)
+
+
+@receiver(post_delete, sender=Procedure)
+@_agenda
+def procedure_post_delete(sender, instance, **kwargs):
+    rollups.mark_keys(getattr(instance, "_rollup_keys", ()))
+
+
+# --- planos de cuidado / dor -------------------------------------------------
+
+@receiver(post_save, sender=CarePlan)
+@receiver(post_delete, sender=CarePlan)
+@receiver(post_save, sender=CareStep)
+@receiver(post_delete, sender=CareStep)
+@receiver(post_save, sender=PainAssessment)
+@receiver(post_delete, sender=PainAssessment)
+def care_plan_changed(sender, **kwargs):
+    results().invalidate_tag(PROTOCOLS_TAG)
+
+
+# --- cadastros (nomes, preços, especialidades aparecem em todos os blocos) ---
+
+@receiver(post_save, sender=Provider)
+@receiver(post_delete, sender=Provider)
+@receiver(post_save, sender=Diagnosis)
+@receiver(post_delete, sender=Diagnosis)
+@receiver(post_save, sender=Procedure)
+@receiver(post_delete, sender=Procedure)
+@receiver(post_save, sender=ProcedureCategory)
+@receiver(post_delete, sender=ProcedureCategory)
+def catalog_changed(sender, **kwargs):
+    results().clear()
+
+
+@receiver(post_save, sender=Diagnosis)
+@receiver(post_delete, sender=Diagnosis)
+def diagnosis_changed(sender, **kwargs):
+    icd.invalidate()
+
+
+# --- busca por nome (clinic.search) -----------------------------------------
+
+@receiver(post_save, sender=Patient)
+@receiver(post_save, sender=Provider)
+def name_saved(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or "full_name" in update_fields:
+        search.index(sender, [instance])
+
+
+@receiver(post_delete, sender=Patient)
+@receiver(post_delete, sender=Provider)
+def name_deleted(sender, instance, **kwargs):
+    search.unindex(sender, [instance.pk])
@@ -0,0 +1,177 @@
+"""
+Busca de horários livres na agenda dos profissionais.
+
+Cada consulta marcada (exceto as canceladas) ocupa
+CLINIC_SCHEDULE["APPOINTMENT_MIN"] minutos a partir de scheduled_at — a
+consulta não tem duração própria. As ocupações de um grupo de profissionais
+(um profissional ou uma especialidade) numa janela de dias vêm de uma query
+só e viram, por profissional, duas listas ordenadas de inícios e fins
+(segundos desde a época) já fundidas: descobrir se [t, t + D) está livre é
+uma busca binária, e o próximo candidato depois de um bloqueio é o fim dele.
+
+O índice fica no cache de resultados (clinic.cache) com o período que
+cobre, então os signals da agenda e as importações em lote o descartam
+quando uma consulta desses dias muda. Em outros processos a defasagem
+máxima é o TTL — quem marca a consulta ainda deve conferir o horário.
+
+Os horários saem do expediente de CLINIC_SCHEDULE, na grade de STEP_MIN
+minutos a partir do início do dia, em ordem de horário (e de profissional).
+"""
+import heapq
+from bisect import bisect_right
+from collections import namedtuple
+from datetime import datetime, time, timedelta
+from itertools import repeat
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import BigIntegerField, Func
+from django.utils import timezone
+
+from .cache import results
+from .models import Appointment, Provider
+
+DEFAULTS = {
+    "DAY_START": "08:00",
+    "DAY_END": "18:00",
+    "WEEKDAYS": (0, 1, 2, 3, 4, 5),  # segunda a sábado
+    "STEP_MIN": 15,
+    "APPOINTMENT_MIN": 30,
+}
+DEFAULT_DAYS = 14
+MAX_DAYS = 62
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 200
+
+Booked = namedtuple("Booked", "starts ends")
+Slot = namedtuple("Slot", "start end provider_id")
+_FREE = Booked([], [])
+
+
+class Epoch(Func):
+    """Segundos desde a época de um DateTimeField, calculados no banco."""
+    output_field = BigIntegerField()
+    vendors = ("sqlite", "postgresql")
+
+    def as_sqlite(self, compiler, connection, **extra):
+        # julianday da época Unix = 2440587.5; datas guardadas em UTC
+        template = "CAST(ROUND((julianday(%(expressions)s) - 2440587.5) * 86400) AS INTEGER)"
+        return self.as_sql(compiler, connection, template=template, **extra)
+
+    def as_postgresql(self, compiler, connection, **extra):
+        template = "CAST(EXTRACT(EPOCH FROM %(expressions)s) AS BIGINT)"
+        return self.as_sql(compiler, connection, template=template, **extra)
+
+
+def schedule():
+    return {**DEFAULTS, **getattr(settings, "CLINIC_SCHEDULE", {})}
+
+
+def _merge(moments, length):
+    """Intervalos [t, t + length) de `moments` (ordenados), fundidos."""
+    starts, ends = [], []
+    for t in moments:
+        if ends and t <= ends[-1]:
+            ends[-1] = max(ends[-1], t + length)
+        else:
+            starts.append(t)
+            ends.append(t + length)
+    return Booked(starts, ends)
+
+
+def bookings(first_day, last_day, provider_id=None, specialty=None):
+    """
+    ({id: (nome, especialidade)}, {id: Booked}) dos profissionais do grupo
+    entre os dias `first_day` e `last_day`. Duas queries, em cache pelo período.
+    """
+    length = schedule()["APPOINTMENT_MIN"] * 60
+
+    def compute():
+        providers = Provider.objects.all()
+        if provider_id is not None:
+            providers = providers.filter(pk=provider_id)
+        if specialty is not None:
+            providers = providers.filter(specialty=specialty)
+        # começa na véspera: uma consulta tarde da noite pode invadir o primeiro dia
+        since = timezone.make_aware(datetime.combine(first_day - timedelta(days=1), time.min))
+        until = timezone.make_aware(datetime.combine(last_day + timedelta(days=1), time.min))
+        booked = (Appointment.objects
+                  .filter(provider__in=providers, scheduled_at__gte=since, scheduled_at__lt=until)
+                  .exclude(status="cancelled")
+                  .order_by("provider_id", "scheduled_at"))
+        moments = {}
+        if connections[booked.db].vendor in Epoch.vendors:
+            # sem converter centenas de milhares de datas em datetime no Python
+            rows = booked.annotate(epoch=Epoch("scheduled_at")).values_list("provider_id", "epoch")
+        else:
+            rows = ((pk, int(at.timestamp())) for pk, at in booked.values_list("provider_id", "scheduled_at"))
+        for pk, epoch in rows:
+            moments.setdefault(pk, []).append(epoch)
+        return ({pk: (name, spec) for pk, name, spec in providers.values_list("id", "full_name", "specialty")},
+                {pk: _merge(ts, length) for pk, ts in moments.items()})
+
+    key = ("slots", first_day, last_day, provider_id, specialty)
+    return results().get_or_compute(key, compute, span=(first_day - timedelta(days=1), last_day))
+
+
+def _windows(since, until):
+    """Expediente (início, fim) em segundos de cada dia útil entre `since` e `until`."""
+    conf = schedule()
+    opens, closes = time.fromisoformat(conf["DAY_START"]), time.fromisoformat(conf["DAY_END"])
+    day, last = timezone.localdate(since), timezone.localdate(until)
+    windows = []
+    while day <= last:
+        if day.weekday() in conf["WEEKDAYS"]:
+            start = int(timezone.make_aware(datetime.combine(day, opens)).timestamp())
+            end = int(timezone.make_aware(datetime.combine(day, closes)).timestamp())
+            windows.append((start, end))
+        day += timedelta(days=1)
+    return windows
+
+
+def free(booked, windows, lo, hi, length, step):
+    """
+    Inícios livres (segundos), em ordem, para blocos de `length` segundos
+    dentro do expediente e de [lo, hi]. Blocos devolvidos não se sobrepõem.
+    """
+    starts, ends = booked
+    for w0, w1 in windows:
+        w1 = min(w1, hi)
+
+        def align(t):  # próximo horário da grade do dia a partir de t
+            return w0 + max(0, -(-(t - w0) // step)) * step
+
+        t = align(max(w0, lo))
+        while t + length <= w1:
+            i = bisect_right(starts, t) - 1
+            if i >= 0 and ends[i] > t:  # começa dentro de uma ocupação
+                t = align(ends[i])
+                continue
+            if i + 1 < len(starts) and starts[i + 1] < t + length:  # esbarra na seguinte
+                t = align(ends[i + 1])
+                continue
+            yield t
+            t = align(t + length)
+
+
+def find(minutes, since, until, provider_id=None, specialty=None, limit=DEFAULT_LIMIT):
+    """
+    Os `limit` primeiros horários livres de `minutes` minutos entre `since`
+    e `until`, para um profissional ou todos os de uma especialidade.
+    Retorna ({id: (nome, especialidade)}, [Slot]).
+    """
+    conf = schedule()
+    providers, booked = bookings(timezone.localdate(since), timezone.localdate(until),
+                                 provider_id=provider_id, specialty=specialty)
+    windows = _windows(since, until)
+    lo, hi = int(since.timestamp()), int(until.timestamp())
+    length, step = minutes * 60, conf["STEP_MIN"] * 60
+    streams = [zip(free(booked.get(pk, _FREE), windows, lo, hi, length, step), repeat(pk))
+               for pk in sorted(providers)]
+    tz = timezone.get_current_timezone()
+    found = []
+    for t, pk in heapq.merge(*streams):
+        found.append(Slot(datetime.fromtimestamp(t, tz), datetime.fromtimestamp(t + length, tz), pk))
+        if len(found) >= limit:
+            break
+    return providers, found
@@ -1,3 +1,1270 @@
-from django.test import TestCase
+import csv
+import gzip
+import math
+import random
+import tempfile
+from datetime import date, timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connections
+from django.db.models import Sum
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import analytics, archive, exports, filters, icd, imports, noshow, overlaps, pagination, rollups, search, timeline
+from .cache import ResultCache, results
+from .filters import DashboardFilters
+from .models import (
+    Appointment, ArchivedAppointment, CarePlan, CareStep, DailyAppointmentStat, Diagnosis,
+    Encounter, ExportJob, NoShowScore, PainAssessment, Patient, Procedure, ProcedureCategory, Provider, Vitals,
+)
+from .profiling import QueryProbe
+from .widgets import WIDGETS
+
+# duas bases de tamanhos diferentes (pacientes, planos e atendimentos ~4x);
+# a exportação cabe num bloco só nas duas (< exports.CHUNK_SIZE consultas em 30 dias)
+SCALES = {
+    "pequena": dict(patients=40, days=30, providers=3, care_plans=8),
+    "grande": dict(patients=160, days=30, providers=6, care_plans=32),
+}
+
+
+@override_settings(CLINIC_ASYNC_CONCURRENCY=1)
+class QueryBudgetTests(TestCase):
+    """
+    Orçamento de queries por view: o número de queries tem um teto fixo e é
+    o mesmo nas duas escalas — um N+1 (query por paciente/plano/atendimento)
+    faz o teste falhar e listar o SQL agrupado por ponto de chamada.
+    """
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_superuser("budget", "budget@example.com", "x")
+        self.client.force_login(self.user)
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        if response.streaming:
+            b"".join(response.streaming_content)
+        return response
+
+    def measure(self, calls):
+        """Roda cada chamada a frio em cada escala: {nome: {escala: QueryProbe}}."""
+        probes = {name: {} for name in calls}
+        for scale, params in SCALES.items():
+            call_command("seed_demo", stdout=StringIO(), **params)
+            for name, call in calls.items():
+                self.get(call())  # aquecimento: sessão, content types etc.
+                results().clear()
+                with QueryProbe(trace=True) as probe:
+                    self.get(call())
+                probes[name][scale] = probe
+        return probes
+
+    def assertBudget(self, calls, budget):
+        for name, by_scale in self.measure(calls).items():
+            counts = {scale: probe.queries for scale, probe in by_scale.items()}
+            worst = max(by_scale.values(), key=lambda probe: probe.queries)
+            msg = (f"{name}: {counts} queries (teto {budget}, deve ser igual nas escalas)\n"
+                   f"{worst.report()}")
+            with self.subTest(name):
+                self.assertLessEqual(worst.queries, budget, msg)
+                self.assertEqual(len(set(counts.values())), 1, msg)
+
+    def test_dashboard(self):
+        calls = {"dashboard": lambda: reverse("dashboard")}
+        calls.update({f"widget {w}": (lambda w=w: reverse("dashboard_widget", args=[w])) for w in WIDGETS})
+        self.assertBudget(calls, 12)
+
+    def test_dashboard_async_bundle(self):
+        self.assertBudget({"dashboard_widgets_async": lambda: reverse("dashboard_widgets_async")}, 26)
+
+    def test_protocols_dashboard(self):
+        self.assertBudget({"protocols_dashboard": lambda: reverse("protocols_dashboard")}, 6)
+
+    def test_patient_timeline(self):
+        def url(name):
+            plan = CarePlan.objects.order_by("id").first()
+            return reverse(name, args=[plan.patient_id])
+        self.assertBudget({"patient_timeline": lambda: url("patient_timeline"),
+                           "api_patient_timeline": lambda: url("api_patient_timeline")}, 8)
+
+    def test_export_csv(self):
+        self.assertBudget({"export_csv": lambda: reverse("export_csv")}, 6)
+
+    def test_admin_changelists(self):
+        calls = {
+            model.__name__: (lambda model=model: reverse(
+                f"admin:{model._meta.app_label}_{model._meta.model_name}_changelist"))
+            for model in admin.site._registry
+            if model._meta.app_label == "clinic"
+        }
+        self.assertBudget(calls, 8)
+
+    def test_admin_change_forms(self):
+        # formulários não listam pacientes/profissionais/atendimentos: o custo
+        # (e o HTML) não cresce com a base
+        def url(model):
+            obj = model.objects.order_by("id").first()
+            return reverse(f"admin:clinic_{model._meta.model_name}_change", args=[obj.pk])
+        calls = {model.__name__: (lambda model=model: url(model))
+                 for model in (Appointment, Encounter, CarePlan, CareStep, PainAssessment, Vitals)}
+        self.assertBudget(calls, 14)
+
+    def test_admin_autocomplete(self):
+        def url(model_name, field_name, term):
+            return (reverse("admin:autocomplete") + f"?app_label=clinic&model_name={model_name}"
+                    f"&field_name={field_name}&term={term}")
+
+        # buscas pelas duas primeiras letras de nomes/códigos que existem
+        def patient():
+            return Appointment.objects.order_by("id").first().patient.search_name[:2]
+
+        calls = {
+            "patient": lambda: url("appointment", "patient", patient()),
+            "provider": lambda: url("appointment", "provider", Provider.objects.first().search_name[:2]),
+            "appointment": lambda: url("encounter", "appointment", patient()),
+            "encounter": lambda: url("painassessment", "encounter", patient()),
+            "care_plan": lambda: url("carestep", "care_plan",
+                                     CarePlan.objects.order_by("id").first().patient.search_name[:2]),
+            "procedure": lambda: url("carestep", "procedure", Procedure.objects.first().code[:2]),
+        }
+        self.assertBudget(calls, 8)  # inclui até 2 queries do próprio teste para montar o termo
+
+
+@override_settings(CLINIC_ASYNC_CONCURRENCY=1)
+class ArchiveTests(TestCase):
+    """Arquivar o histórico não muda nenhum número da dashboard nem a exportação."""
+
+    def setUp(self):
+        user = get_user_model().objects.create_superuser("archive", "archive@example.com", "x")
+        self.client.force_login(user)
+        call_command("seed_demo", stdout=StringIO(), patients=40, days=30, providers=3, care_plans=8)
+
+    def snapshot(self):
+        results().clear()
+        data = {}
+        for params in ({"days": 30}, {"days": 30, "status": "completed"}):
+            for widget in WIDGETS:
+                response = self.client.get(reverse("dashboard_widget", args=[widget]), params)
+                data[widget, params.get("status")] = response.json()
+            response = self.client.get(reverse("export_csv"), params)
+            data["csv", params.get("status")] = b"".join(response.streaming_content)
+        return data
+
+    def test_archive_is_transparent(self):
+        before = self.snapshot()
+        fields = ("day", "provider_id", "status", "appointments", "encounters",
+                  "encounter_minutes", "revenue_brl")
+        stats = list(DailyAppointmentStat.objects.order_by(*fields).values_list(*fields))
+        call_command("archive_history", days=10, stdout=StringIO())
+        self.assertTrue(ArchivedAppointment.objects.exists())
+
+        with self.settings(CLINIC_DASHBOARD_ROLLUPS=True):
+            self.assertEqual(self.snapshot(), before)
+        with self.settings(CLINIC_DASHBOARD_ROLLUPS=False):
+            self.assertEqual(self.snapshot(), before)
+        rollups.rebuild()
+        self.assertEqual(list(DailyAppointmentStat.objects.order_by(*fields).values_list(*fields)), stats)
+
+    def test_keeps_encounters_with_pain_assessments(self):
+        kept = Encounter.objects.filter(appointment__isnull=False).order_by("check_in").first()
+        PainAssessment.objects.create(patient=kept.patient, encounter=kept,
+                                      recorded_at=kept.check_in.date(), score=5)
+        call_command("archive_history", days=0, stdout=StringIO())
+        old = Appointment.objects.filter(scheduled_at__lt=timezone.now())
+        self.assertEqual(list(old.values_list("id", flat=True)), [kept.appointment_id])
+        self.assertTrue(Encounter.objects.filter(pk=kept.pk).exists())
+
+
+class PainProtocolStatsTests(TestCase):
+    """pain_protocol_stats (janelas no banco) igual ao laço por plano que ele substituiu."""
+
+    def setUp(self):
+        rng = random.Random(7)
+        start = timezone.localdate() - timedelta(days=200)
+        # (protocolo, avaliações a partir do início): n == 1, n <= 8, n == 8, n == 9 e n > 12
+        plans = [("LASER", 1), ("LASER", 5), ("LASER", 8), ("INFIL", 9), ("INFIL", 15), ("RF", 0)]
+        shared = Patient.objects.create(full_name="Olga Reis", sex="F")
+        for i, (protocol, n) in enumerate(plans):
+            patient = Patient.objects.create(full_name=f"Paciente {i}", sex="M")
+            plan_start = start + timedelta(days=i)
+            CarePlan.objects.create(patient=patient, protocol=protocol, start_date=plan_start)
+            # uma avaliação antes do início não conta
+            PainAssessment.objects.create(patient=patient, recorded_at=plan_start - timedelta(days=1), score=10)
+            for week in range(n):
+                PainAssessment.objects.create(patient=patient, recorded_at=plan_start + timedelta(weeks=week),
+                                              score=rng.randint(0, 10))
+        # paciente com dois planos: as mesmas avaliações entram nos dois, cada um a partir do seu início
+        for protocol, offset in (("ESWT", 0), ("BLOCK", 21)):
+            CarePlan.objects.create(patient=shared, protocol=protocol, start_date=start + timedelta(days=offset))
+        for week in range(11):
+            PainAssessment.objects.create(patient=shared, recorded_at=start + timedelta(weeks=week),
+                                          score=rng.randint(0, 10))
+
+    def expected(self):
+        """O cálculo antigo: uma query por plano, tudo em Python."""
+        data = []
+        for code, label in CarePlan.PROTOCOLS:
+            plans = CarePlan.objects.filter(protocol=code).order_by("id")
+            if not plans.exists():
+                continue
+            reductions, weekly = [], {}
+            for plan in plans:
+                scores = list(PainAssessment.objects.filter(patient=plan.patient, recorded_at__gte=plan.start_date)
+                              .order_by("recorded_at", "id").values_list("score", flat=True))
+                if not scores:
+                    continue
+                for week, score in enumerate(scores[:analytics.CURVE_WEEKS]):
+                    weekly.setdefault(week, []).append(score)
+                if len(scores) > analytics.REDUCTION_WEEK:
+                    reductions.append(scores[0] - scores[analytics.REDUCTION_WEEK])
+                elif len(scores) > 1:
+                    reductions.append(scores[0] - scores[-1])
+            data.append({
+                "protocol": label,
+                "delta": round(sum(reductions) / len(reductions), 2) if reductions else 0.0,
+                "curve": [{"week": w, "score": round(sum(v) / len(v), 2)} for w, v in sorted(weekly.items())],
+            })
+        return data
+
+    def test_matches_per_plan_loop(self):
+        expected = self.expected()
+        self.assertEqual([p["protocol"] for p in expected], [label for _, label in CarePlan.PROTOCOLS])
+        rf = dict(CarePlan.PROTOCOLS)["RF"]
+        self.assertEqual(next(p for p in expected if p["protocol"] == rf), {"protocol": rf, "delta": 0.0, "curve": []})
+        with self.assertNumQueries(2):
+            self.assertEqual(analytics.pain_protocol_stats(), expected)
+
+
+class DurationStatsTests(TestCase):
+    """Estatísticas de duração do banco batem com a conta em Python, também somando o arquivo."""
+
+    # profissional -> durações em minutos: n=1, n=2 e n par maior (percentis nas bordas)
+    DURATIONS = {"Ana": [17], "Bruno": [40, 10], "Carla": [12, 5, 61, 12, 33, 7]}
+
+    def setUp(self):
+        patient = Patient.objects.create(full_name="Vera Luz", sex="F")
+        category = ProcedureCategory.objects.create(name="Terapias")
+        procs = [Procedure.objects.create(code=f"PROC-{i}", name=f"Terapia {i}", category=category)
+                 for i in range(2)]
+        specialties = {"Ana": "Fisiatria", "Bruno": "Fisiatria", "Carla": "Ortopedia"}
+        now = timezone.now()
+        i = 0
+        for name, durations in self.DURATIONS.items():
+            provider = Provider.objects.create(full_name=name, specialty=specialties[name])
+            for minutes in durations:
+                # alternando entre 40 e 2 dias atrás: metade vai para o arquivo
+                at = now - timedelta(days=40 if i % 2 else 2, hours=i)
+                appt = Appointment.objects.create(patient=patient, provider=provider, scheduled_at=at,
+                                                  status="completed")
+                enc = Encounter.objects.create(appointment=appt, patient=patient, provider=provider,
+                                               check_in=at, check_out=at + timedelta(minutes=minutes))
+                enc.procedures.set(procs[:i % 3])  # nenhum, o primeiro ou os dois
+                i += 1
+            # aberto, sem duração: não entra em nada
+            Encounter.objects.create(patient=patient, provider=provider, check_in=now - timedelta(days=1))
+
+    def expected(self, by):
+        """As mesmas estatísticas calculadas a partir das linhas, em Python."""
+        key, label = analytics.DURATION_GROUPS[by]
+        groups = {}
+        rows = Encounter.objects.filter(duration_min__isnull=False).values_list(key, label, "duration_min")
+        for group, name, minutes in rows:
+            if group is not None:
+                groups.setdefault((name, group), []).append(minutes)
+        data = []
+        for (name, group), durations in sorted(groups.items()):
+            durations.sort()
+            n = len(durations)
+            bins = {}
+            for minutes in durations:
+                start = minutes // analytics.DURATION_BIN * analytics.DURATION_BIN
+                bins[start] = bins.get(start, 0) + 1
+            data.append({
+                "key": group, "label": name, "count": n, "avg": round(sum(durations) / n, 1),
+                "min": durations[0], "max": durations[-1],
+                **{f"p{p}": durations[math.ceil(n * p / 100) - 1] for p in analytics.DURATION_PERCENTILES},
+                "histogram": [{"bin": b, "cnt": cnt} for b, cnt in sorted(bins.items())],
+            })
+        return data
+
+    def test_matches_python(self):
+        by_provider = {s["label"]: (s["count"], s["p50"], s["p90"]) for s in self.expected("provider")}
+        self.assertEqual(by_provider, {"Ana": (1, 17, 17), "Bruno": (2, 10, 40), "Carla": (6, 12, 61)})
+        for by in analytics.DURATION_GROUPS:
+            with self.subTest(by=by):
+                expected = self.expected(by)
+                self.assertTrue(expected)
+                self.assertEqual(analytics.duration_stats(Encounter.objects.all(), by), expected)
+                self.assertEqual(analytics.merged_duration_stats([Encounter.objects.all()], by), expected)
+
+    def test_merged_with_archive(self):
+        expected = {by: self.expected(by) for by in analytics.DURATION_GROUPS}
+        archive.archive_before(timezone.now() - timedelta(days=10))
+        self.assertEqual(archive.COLD.encounter.objects.filter(duration_min__isnull=False).count(), 4)
+        self.assertEqual(Encounter.objects.filter(duration_min__isnull=False).count(), 5)
+        for by in analytics.DURATION_GROUPS:
+            with self.subTest(by=by):
+                merged = analytics.merged_duration_stats(
+                    [archive.COLD.encounter.objects.all(), archive.HOT.encounter.objects.all()], by)
+                self.assertEqual(merged, expected[by])
+
+
+class SeedDemoTests(TestCase):
+    """Opções inválidas do seed_demo param antes de apagar ou gerar qualquer coisa."""
+
+    def test_rejects_empty_options(self):
+        patient = Patient.objects.create(full_name="Sara Nunes", sex="F")
+        for option, value in (("patients", 0), ("providers", 0), ("batch_size", 0),
+                              ("days", -1), ("care_plans", -1)):
+            with self.subTest(option=option), self.assertRaises(CommandError):
+                call_command("seed_demo", stdout=StringIO(), **{option: value})
+        self.assertEqual(list(Patient.objects.all()), [patient])
+
+
+class DashboardFiltersTests(TestCase):
+    """`days` fora de 1..MAX_DAYS é filtro inválido (400), não um OverflowError (500)."""
+
+    def test_days_bounds(self):
+        for days in ("1", str(filters.MAX_DAYS)):
+            self.assertEqual(DashboardFilters.from_params({"days": days}).days, int(days))
+        for days in ("0", "-3", str(filters.MAX_DAYS + 1), "99999999999"):
+            with self.subTest(days=days), self.assertRaises(ValueError):
+                DashboardFilters.from_params({"days": days})
+
+    def test_views_reject_huge_days(self):
+        user = get_user_model().objects.create_superuser("filters", "filters@example.com", "x")
+        self.client.force_login(user)
+        params = {"days": "99999999999"}
+        for url in (reverse("dashboard"), reverse("dashboard_widget", args=["kpis"]),
+                    reverse("dashboard_widgets_async"), reverse("export_csv"), reverse("api_appointments")):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url, params).status_code, 400)
+        self.assertEqual(self.client.post(reverse("export_job_create"), params).status_code, 400)
+        # o relatório do admin cai nos filtros padrão
+        self.assertEqual(self.client.get(reverse("admin:clinic_appointment_overlaps"), params).status_code, 200)
+
+
+class NameSearchTests(TestCase):
+    """Busca por nome sem acento/caixa, por prefixo de cada palavra."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_superuser("search", "search@example.com", "x")
+        self.client.force_login(self.user)
+        self.joao = Patient.objects.create(full_name="João da Silva", sex="M")
+        self.jose = Patient.objects.create(full_name="José Ângelo Souza", sex="M")
+        self.dra = Provider.objects.create(full_name="Dra. Conceição Araújo", specialty="Pediatria")
+
+    def names(self, model, query):
+        return [obj.full_name for obj in search.lookup(model, query)]
+
+    def test_fold(self):
+        self.assertEqual(search.fold("  JOÃO-da   Silva! "), "joao da silva")
+        self.assertEqual(self.dra.search_name, "dra conceicao araujo")
+
+    def test_lookup_by_word_prefixes(self):
+        self.assertEqual(self.names(Patient, "Joao"), ["João da Silva"])
+        self.assertEqual(self.names(Patient, "silv jo"), ["João da Silva"])
+        self.assertEqual(self.names(Patient, "jo"), ["João da Silva", "José Ângelo Souza"])
+        self.assertEqual(self.names(Patient, "angelo"), ["José Ângelo Souza"])
+        self.assertEqual(self.names(Patient, "joao souza"), [])
+        self.assertEqual(self.names(Patient, ""), [])
+        self.assertEqual(self.names(Provider, "araujo"), ["Dra. Conceição Araújo"])
+
+    def test_index_follows_changes(self):
+        self.joao.full_name = "João Ávila"
+        self.joao.save(update_fields=["full_name"])
+        self.assertEqual(self.names(Patient, "avila"), ["João Ávila"])
+        self.assertEqual(self.names(Patient, "silva"), [])
+        self.jose.delete()
+        self.assertEqual(self.names(Patient, "jo"), ["João Ávila"])
+
+    def test_lookup_endpoint(self):
+        response = self.client.get(reverse("api_lookup"), {"q": "conceicao", "kind": "provider"})
+        self.assertEqual([r["id"] for r in response.json()["results"]], [self.dra.pk])
+        self.assertEqual(self.client.get(reverse("api_lookup"), {"kind": "x"}).status_code, 400)
+
+    def test_admin_search(self):
+        Appointment.objects.create(patient=self.jose, provider=self.dra, scheduled_at=timezone.now())
+        url = reverse("admin:clinic_patient_changelist")
+        self.assertEqual(list(self.client.get(url, {"q": "JOSE ang"}).context["cl"].result_list), [self.jose])
+        url = reverse("admin:clinic_appointment_changelist")
+        self.assertEqual(self.client.get(url, {"q": "conceição"}).context["cl"].result_count, 1)
+        self.assertEqual(self.client.get(url, {"q": "silva"}).context["cl"].result_count, 0)
+
+
+class DiagnosisAutocompleteTests(TestCase):
+    """Índice em memória de códigos/descrições do CID."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_superuser("icd", "icd@example.com", "x")
+        self.client.force_login(self.user)
+        for code, description in [("M54.5", "Dor lombar baixa"), ("M54.2", "Cervicalgia"),
+                                  ("M17.0", "Gonartrose primária bilateral"), ("J06.9", "IVAS não especificada")]:
+            Diagnosis.objects.create(code=code, description=description)
+
+    def codes(self, query):
+        return [r["code"] for r in icd.index().results(query)]
+
+    def test_prefixes(self):
+        self.assertEqual(self.codes("M54"), ["M54.2", "M54.5"])
+        self.assertEqual(self.codes("m545"), ["M54.5"])
+        self.assertEqual(self.codes("lomb"), ["M54.5"])
+        self.assertEqual(self.codes("primaria gon"), ["M17.0"])
+        self.assertEqual(self.codes("nao"), ["J06.9"])
+        self.assertEqual(self.codes(""), [])
+
+    def test_rebuilt_on_change(self):
+        self.assertEqual(self.codes("G43"), [])
+        Diagnosis.objects.create(code=" g43.9 ", description="Enxaqueca")
+        self.assertEqual(self.codes("G43"), ["G43.9"])
+        Diagnosis.objects.filter(code="G43.9").delete()
+        self.assertEqual(self.codes("enxa"), [])
+
+    def test_endpoint_without_queries(self):
+        icd.index()
+        with self.assertNumQueries(2):  # sessão + usuário; nada de Diagnosis
+            response = self.client.get(reverse("api_diagnosis_autocomplete"), {"q": "M54"})
+        self.assertEqual([r["code"] for r in response.json()["results"]], ["M54.2", "M54.5"])
+
+    def test_admin_autocomplete(self):
+        response = self.client.get(reverse("admin:autocomplete"), {
+            "term": "cerv", "app_label": "clinic", "model_name": "encounter", "field_name": "diagnoses"})
+        self.assertEqual([r["text"] for r in response.json()["results"]], ["M54.2 - Cervicalgia"])
+
+
+class KeysetPageTests(TestCase):
+    """Cursor da API: empates de data na borda da página não perdem nem repetem linhas."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_superuser("keyset", "keyset@example.com", "x")
+        self.client.force_login(self.user)
+        patient = Patient.objects.create(full_name="Caio Mendes", sex="M")
+        provider = Provider.objects.create(full_name="Dra. Lia Campos", specialty="Fisiatria")
+        base = timezone.now().replace(microsecond=0) - timedelta(days=2)
+        # três blocos de horários repetidos: com limit=2 cada página corta no meio de um empate
+        moments = [base] * 3 + [base + timedelta(hours=1)] + [base + timedelta(hours=2)] * 4
+        for at in moments:
+            appt = Appointment.objects.create(patient=patient, provider=provider, scheduled_at=at)
+            Encounter.objects.create(appointment=appt, patient=patient, provider=provider, check_in=at)
+        self.expected = list(Appointment.objects.order_by("scheduled_at", "id").values_list("id", flat=True))
+
+    def pages(self, name, limit):
+        ids, cursors, params = [], [], {"limit": limit}
+        while True:
+            data = self.client.get(reverse(name), params).json()
+            ids.append([r["appointment_id" if name == "api_encounters" else "id"] for r in data["results"]])
+            cursors.append(data["next_cursor"])
+            if data["next_cursor"] is None:
+                return ids, cursors
+            params["cursor"] = data["next_cursor"]
+
+    def test_ties_across_pages(self):
+        for name in ("api_appointments", "api_encounters"):
+            for limit in (1, 2, 3, 4, 8, 100):
+                with self.subTest(name=name, limit=limit):
+                    pages, cursors = self.pages(name, limit)
+                    self.assertEqual([pk for page in pages for pk in page], self.expected)
+                    self.assertTrue(all(len(page) == limit for page in pages[:-1]))
+                    # a última página pode sair cheia (8 linhas, limit 4/8), mas sem cursor
+                    self.assertEqual(len(pages), -(-len(self.expected) // limit))
+                    self.assertTrue(all(cursors[:-1]))
+
+    def test_bad_params(self):
+        url = reverse("api_appointments")
+        for params in ({"cursor": "nada"}, {"cursor": "W10"}, {"cursor": "WyJvbnRlbSIsIDFd"},
+                       {"limit": "dez"}):
+            with self.subTest(params=params):
+                response = self.client.get(url, params)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("error", response.json())
+
+
+class ApproximateCountTests(TestCase):
+    """Changelists acima do limite não rodam COUNT(*) a cada página."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_superuser("pages", "pages@example.com", "x")
+        self.client.force_login(self.user)
+        call_command("seed_demo", stdout=StringIO(), patients=40, days=30, providers=3, care_plans=8)
+        results().clear()
+        self.url = reverse("admin:clinic_appointment_changelist")
+
+    def counts(self, params):
+        with QueryProbe() as probe:
+            response = self.client.get(self.url, params)
+        counts = [sql for sql, _, _ in probe.statements
+                  if sql.startswith("SELECT COUNT(*)") and "clinic_appointment" in sql]
+        return response.context["cl"].result_count, len(counts)
+
+    def test_exact_below_threshold(self):
+        self.assertEqual(self.counts({}), (Appointment.objects.count(), 1))
+
+    @override_settings(CLINIC_ADMIN_COUNT_THRESHOLD=10)
+    def test_estimate_and_cached_counts_above_threshold(self):
+        estimate = pagination.estimated_rows(Appointment)
+        self.assertIsNotNone(estimate)
+        self.assertEqual(self.counts({}), (estimate, 0))
+
+        completed = Appointment.objects.filter(status="completed").count()
+        self.assertEqual(self.counts({"status__exact": "completed"}), (completed, 1))
+        self.assertEqual(self.counts({"status__exact": "completed", "p": 1}), (completed, 0))
+
+    def test_analyze_only_where_supported(self):
+        self.assertTrue(pagination.analyze())
+        connection = connections["default"]
+        with mock.patch.object(connection, "vendor", "oracle"), mock.patch.object(connection, "cursor") as cursor:
+            self.assertFalse(pagination.analyze())
+        cursor.assert_not_called()
+
+
+class ImportTests(TestCase):
+    """Importação em lote e mudança de status em massa mantêm rollup e vínculos em dia."""
+
+    ROLLUP = ("day", "provider_id", "status", "appointments", "encounters",
+              "encounter_minutes", "revenue_brl")
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_superuser("imports", "imports@example.com", "x")
+        self.client.force_login(self.user)
+        self.patient = Patient.objects.create(full_name="Ana Lima", sex="F")
+        self.provider = Provider.objects.create(full_name="Dr. Paulo Reis", specialty="Ortopedia")
+        self.dx = Diagnosis.objects.create(code="M54.5", description="Dor lombar")
+        category = ProcedureCategory.objects.create(name="Laserterapia")
+        self.proc = Procedure.objects.create(code="PROC-LASER", name="Laser", category=category,
+                                             price_brl=350)
+        self.day = timezone.localtime().replace(hour=9, minute=0, second=0, microsecond=0) - timedelta(days=3)
+
+    def csv(self, *rows):
+        lines = [",".join(imports.COLUMNS)] + [",".join(str(v) for v in row) for row in rows]
+        return "\n".join(lines) + "\n"
+
+    def row(self, patient=None, minutes=0, status="completed", check_in=True, dx="m54.5", proc="PROC-LASER"):
+        at = self.day + timedelta(minutes=minutes)
+        visit = (at.isoformat(), (at + timedelta(minutes=25)).isoformat(), "Dor", dx, proc) if check_in else ("",) * 5
+        return (patient or self.patient.pk, self.provider.pk, at.isoformat(), status, *visit)
+
+    def rollup(self):
+        return list(DailyAppointmentStat.objects.order_by(*self.ROLLUP).values_list(*self.ROLLUP))
+
+    def assertRollupCurrent(self):
+        current = self.rollup()
+        rollups.rebuild()
+        self.assertEqual(current, self.rollup())
+        self.assertTrue(current)
+
+    def test_import_command(self):
+        path = self.enterContext(tempfile.TemporaryDirectory()) + "/agenda.csv"
+        with open(path, "w", encoding="utf-8") as fh:
+            fh.write(self.csv(
+                self.row(),
+                self.row(minutes=30, status="scheduled", check_in=False),
+                self.row(patient=999999, minutes=60),        # paciente inexistente
+                self.row(minutes=90, proc="PROC-X"),         # procedimento desconhecido
+                ("x", self.provider.pk, "ontem", "completed", "", "", "", "", ""),
+            ))
+        err = StringIO()
+        call_command("import_appointments", path, chunk_size=2, stdout=StringIO(), stderr=err)
+        self.assertEqual(Appointment.objects.count(), 2)
+        enc = Encounter.objects.get()
+        self.assertEqual(enc.duration_min, 25)
+        self.assertEqual(list(enc.diagnoses.all()), [self.dx])
+        self.assertEqual(list(enc.procedures.all()), [self.proc])
+        self.assertEqual([line.split(":")[0] for line in err.getvalue().splitlines()],
+                         ["linha 4", "linha 5", "linha 6"])
+        self.assertRollupCurrent()
+
+    def test_admin_upload(self):
+        url = reverse("admin:clinic_appointment_import")
+        self.assertContains(self.client.get(reverse("admin:clinic_appointment_changelist")), url)
+        upload = SimpleUploadedFile("agenda.csv", self.csv(self.row(), self.row(minutes=30)).encode())
+        response = self.client.post(url, {"file": upload, "dry_run": "on"})
+        self.assertEqual((response.context["result"].appointments, Appointment.objects.count()), (2, 0))
+        upload = SimpleUploadedFile("agenda.csv", self.csv(self.row(), self.row(minutes=30)).encode())
+        response = self.client.post(url, {"file": upload})
+        self.assertEqual(response.context["result"].encounters, 2)
+        self.assertEqual(Encounter.objects.filter(procedures=self.proc).count(), 2)
+        self.assertRollupCurrent()
+
+    def test_admin_upload_not_utf8(self):
+        url = reverse("admin:clinic_appointment_import")
+        upload = SimpleUploadedFile("agenda.csv", self.csv(self.row()).replace("Dor", "João").encode("latin-1"))
+        response = self.client.post(url, {"file": upload})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["form"].errors["file"], ["O arquivo não está em UTF-8."])
+        self.assertFalse(Appointment.objects.exists())
+
+    def test_bulk_status_actions(self):
+        appts = [Appointment.objects.create(patient=self.patient, provider=self.provider,
+                                            scheduled_at=self.day + timedelta(minutes=20 * i))
+                 for i in range(6)]
+        done = Encounter.objects.create(appointment=appts[0], patient=self.patient, provider=self.provider,
+                                        check_in=appts[0].scheduled_at,
+                                        check_out=appts[0].scheduled_at + timedelta(minutes=15))
+        url = reverse("admin:clinic_appointment_changelist")
+        response = self.client.post(url, {"action": "mark_completed", "_selected_action": [a.pk for a in appts[:4]]},
+                                    follow=True)
+        self.assertIn("3 atendimentos abertos criados", str(list(response.context["messages"])[0]))
+        self.client.post(url, {"action": "mark_no_show", "_selected_action": [a.pk for a in appts[4:]]})
+
+        statuses = list(Appointment.objects.order_by("id").values_list("status", flat=True))
+        self.assertEqual(statuses, ["completed"] * 4 + ["no_show"] * 2)
+        self.assertEqual(Encounter.objects.count(), 4)
+        self.assertEqual(Encounter.objects.get(appointment=appts[0]), done)
+        self.assertRollupCurrent()
+        self.assertEqual(imports.transition(Appointment.objects.all(), "no_show", chunk_size=3), (4, 0))
+
+    def test_completed_encounters_stay_open(self):
+        """Atendimentos criados pela ação ficam sem duração e fora das estatísticas de duração."""
+        appts = [Appointment.objects.create(patient=self.patient, provider=self.provider,
+                                            scheduled_at=self.day + timedelta(minutes=20 * i))
+                 for i in range(3)]
+        Encounter.objects.create(appointment=appts[0], patient=self.patient, provider=self.provider,
+                                 check_in=appts[0].scheduled_at,
+                                 check_out=appts[0].scheduled_at + timedelta(minutes=15))
+        self.assertEqual(imports.transition(Appointment.objects.all(), "completed"), (3, 2))
+        opened = Encounter.objects.exclude(appointment=appts[0])
+        self.assertEqual([(e.check_in, e.check_out, e.duration_min) for e in opened.order_by("appointment_id")],
+                         [(a.scheduled_at, None, None) for a in appts[1:]])
+        stats = analytics.duration_stats(Encounter.objects.all())
+        self.assertEqual([(s["count"], s["avg"], s["max"]) for s in stats], [(1, 15, 15)])
+        self.assertEqual(analytics.merged_duration_stats([Encounter.objects.all()]), stats)
+
+    def test_chunk_refreshes_rollup_once(self):
+        """Cada bloco grava com os signals desligados e recalcula o rollup uma vez só."""
+        rows = [self.row(minutes=30 * i) for i in range(4)] + [self.row(minutes=200, check_in=False)]
+        reader = csv.DictReader(StringIO(self.csv(*rows)))
+        with mock.patch.object(rollups, "refresh", wraps=rollups.refresh) as refresh, \
+                mock.patch.object(rollups, "mark_dirty") as mark_dirty:
+            result = imports.import_rows(reader, chunk_size=3)
+        self.assertEqual((result.appointments, result.encounters), (5, 4))
+        self.assertEqual(refresh.call_count, 2)
+        mark_dirty.assert_not_called()
+        self.assertEqual(Encounter.objects.filter(procedures=self.proc, diagnoses=self.dx).count(), 4)
+        self.assertRollupCurrent()
+
+
+class PatientTimelineTests(TestCase):
+    """Linha do tempo em JSON: redução de pontos e GET condicional."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_superuser("timeline", "timeline@example.com", "x")
+        self.client.force_login(self.user)
+        self.patient = Patient.objects.create(full_name="Rita Prado", sex="F")
+        start = timezone.localdate() - timedelta(days=3000)
+        PainAssessment.objects.bulk_create([
+            PainAssessment(patient=self.patient, recorded_at=start + timedelta(days=3 * i),
+                           score=10 if i == 777 else (i * 7) % 9)
+            for i in range(1000)
+        ])
+        category = ProcedureCategory.objects.create(name="Bloqueios")
+        proc = Procedure.objects.create(code="PROC-BLOQ", name="Bloqueio", category=category)
+        plan = CarePlan.objects.create(patient=self.patient, protocol="BLOCK", start_date=start)
+        self.step_days = [start + timedelta(days=d) for d in (1, 400, 1501, 2900)]
+        for day in self.step_days:
+            CareStep.objects.create(care_plan=plan, procedure=proc, scheduled_at=day)
+        self.url = reverse("api_patient_timeline", args=[self.patient.pk])
+
+    def test_downsampled_keeps_extrema_and_markers(self):
+        data = self.client.get(self.url, {"points": 100}).json()
+        self.assertEqual(data["pain_total"], 1000)
+        self.assertTrue(data["downsampled"])
+        self.assertLessEqual(len(data["pain"]), 100)
+        self.assertGreater(len(data["pain"]), 90)
+        self.assertIn(10, [p["score"] for p in data["pain"]])
+        self.assertIn(0, [p["score"] for p in data["pain"]])
+        dates = [p["date"] for p in data["pain"]]
+        self.assertEqual(dates, sorted(dates))
+        for day in self.step_days:  # a avaliação da data do marcador (ou a seguinte) fica
+            first = PainAssessment.objects.filter(recorded_at__gte=day).order_by("recorded_at").first()
+            self.assertIn(first.recorded_at.isoformat(), dates)
+        self.assertEqual(len(data["steps"]), 4)
+        self.assertEqual(len(self.client.get(self.url, {"points": 5000}).json()["pain"]), 1000)
+        self.assertEqual(self.client.get(self.url, {"points": "x"}).status_code, 400)
+
+    def test_conditional_get(self):
+        response = self.client.get(self.url)
+        etag, modified = response["ETag"], response["Last-Modified"]
+        with self.assertNumQueries(5):  # sessão + usuário + paciente + duas agregações
+            cached = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=modified).status_code, 304)
+        self.assertEqual(self.client.get(self.url, {"points": 50}, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        PainAssessment.objects.filter(patient=self.patient).order_by("id").first().delete()
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        assessment = PainAssessment.objects.filter(patient=self.patient).order_by("id").first()
+        etag = self.client.get(self.url)["ETag"]
+        assessment.score = 9
+        assessment.save()
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_lttb_keeps_shape(self):
+        xs = list(range(200))
+        ys = [0] * 200
+        ys[120] = 8  # pico isolado
+        kept = timeline.lttb(xs, ys, 10)
+        self.assertEqual((len(kept), kept[0], kept[-1]), (10, 0, 199))
+        self.assertIn(120, kept)
+
+
+@override_settings(CLINIC_SCHEDULE={"DAY_START": "08:00", "DAY_END": "12:00", "WEEKDAYS": (0, 1, 2, 3, 4),
+                                    "STEP_MIN": 15, "APPOINTMENT_MIN": 30})
+class FreeSlotTests(TestCase):
+    """Horários livres a partir das consultas marcadas (clinic.slots)."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_superuser("slots", "slots@example.com", "x")
+        self.client.force_login(self.user)
+        results().clear()
+        self.patient = Patient.objects.create(full_name="Caio Nunes", sex="M")
+        self.ana = Provider.objects.create(full_name="Dra. Ana Reis", specialty="Ortopedia")
+        self.bia = Provider.objects.create(full_name="Dra. Bia Melo", specialty="Ortopedia")
+        today = timezone.localdate()
+        self.monday = today + timedelta(days=7 - today.weekday())
+        self.url = reverse("api_free_slots")
+
+    def at(self, hhmm, day=None):
+        hour, minute = map(int, hhmm.split(":"))
+        return timezone.make_aware(timezone.datetime.combine(day or self.monday, timezone.datetime.min.time())
+                                   .replace(hour=hour, minute=minute))
+
+    def book(self, provider, hhmm, status="scheduled"):
+        return Appointment.objects.create(patient=self.patient, provider=provider,
+                                          scheduled_at=self.at(hhmm), status=status)
+
+    def slots(self, **params):
+        params = {"start": self.monday.isoformat(), "end": self.monday.isoformat(), **params}
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return [(timezone.localtime(timezone.datetime.fromisoformat(s["start"])).strftime("%H:%M"),
+                 s["provider"]["id"]) for s in response.json()["slots"]]
+
+    def test_gaps_between_bookings(self):
+        self.book(self.ana, "08:00")
+        self.book(self.ana, "09:00")
+        self.book(self.ana, "08:30", status="cancelled")  # não ocupa
+        self.assertEqual(self.slots(provider=self.ana.pk, minutes=45, limit=3),
+                         [("09:30", self.ana.pk), ("10:15", self.ana.pk), ("11:00", self.ana.pk)])
+        self.assertEqual(self.slots(provider=self.ana.pk, minutes=30, limit=2),
+                         [("08:30", self.ana.pk), ("09:30", self.ana.pk)])
+
+    def test_specialty_in_time_order_and_procedure_duration(self):
+        self.book(self.ana, "08:00")
+        self.book(self.bia, "08:15")
+        category = ProcedureCategory.objects.create(name="Radiofrequência")
+        Procedure.objects.create(code="PROC-RF", name="RF", category=category, duration_estimate_min=60)
+        self.assertEqual(self.slots(specialty="Ortopedia", procedure="PROC-RF", limit=3),
+                         [("08:30", self.ana.pk), ("08:45", self.bia.pk), ("09:30", self.ana.pk)])
+
+    def test_index_cached_and_invalidated(self):
+        self.slots(provider=self.ana.pk, limit=1)
+        with self.assertNumQueries(2):  # sessão + usuário: índice em cache
+            self.assertEqual(self.slots(provider=self.ana.pk, limit=1), [("08:00", self.ana.pk)])
+        self.book(self.ana, "08:00")  # signal da agenda descarta o índice do dia
+        self.assertEqual(self.slots(provider=self.ana.pk, limit=1), [("08:30", self.ana.pk)])
+
+    def test_bad_requests(self):
+        for params in ({}, {"provider": "x"}, {"provider": self.ana.pk, "minutes": "0"},
+                       {"provider": self.ana.pk, "procedure": "NOPE"},
+                       {"provider": self.ana.pk, "start": "2026-13-01"},
+                       {"provider": self.ana.pk, "start": "2026-01-01", "end": "2026-12-31"}):
+            self.assertEqual(self.client.get(self.url, params).status_code, 400, params)
+
+
+class OverlapTests(TestCase):
+    """Auditoria de sobreposições (clinic.overlaps): consultas de 30 min e atendimentos."""
+
+    def setUp(self):
+        results().clear()
+        self.patient = Patient.objects.create(full_name="Davi Prado", sex="M")
+        self.ana = Provider.objects.create(full_name="Dra. Ana Reis", specialty="Ortopedia")
+        self.bia = Provider.objects.create(full_name="Dra. Bia Melo", specialty="Ortopedia")
+        self.day = timezone.localdate() - timedelta(days=3)
+
+    def at(self, hhmm, day=None):
+        hour, minute = map(int, hhmm.split(":"))
+        return timezone.make_aware(timezone.datetime.combine(day or self.day, timezone.datetime.min.time())
+                                   .replace(hour=hour, minute=minute))
+
+    def book(self, provider, hhmm, status="scheduled", day=None):
+        return Appointment.objects.create(patient=self.patient, provider=provider,
+                                          scheduled_at=self.at(hhmm, day), status=status).pk
+
+    def audit(self, days=30, **kwargs):
+        until = timezone.now()
+        return {(c.kind, c.provider_id, tuple(c.ids))
+                for c in overlaps.audit(until - timedelta(days=days), until, **kwargs)}
+
+    def test_sweep_labels_chains_per_provider(self):
+        provider = np.array([1, 1, 1, 1, 2, 2])
+        start = np.array([0, 10, 40, 50, 55, 100])
+        end = np.array([30, 20, 50, 60, 200, 110])
+        labels = overlaps.sweep(provider, start, end)
+        # [0,30) engloba [10,20); [40,50) e [50,60) só encostam; o 55 do
+        # profissional 1 não vaza para o profissional 2
+        self.assertEqual(labels.tolist(), [0, 0, -1, -1, 3, 3])
+
+    def test_appointments(self):
+        a = self.book(self.ana, "09:00")
+        b = self.book(self.ana, "09:15")
+        c = self.book(self.ana, "09:40")  # encadeada: começa antes do fim de b
+        self.book(self.ana, "10:10")  # encosta em c
+        self.book(self.ana, "09:20", status="cancelled")  # não conta
+        self.book(self.bia, "09:00")  # outro profissional
+        self.assertEqual(self.audit(), {("appointments", self.ana.pk, (a, b, c))})
+        self.assertEqual(self.audit(provider_id=self.bia.pk), set())
+        with self.settings(CLINIC_SCHEDULE={"APPOINTMENT_MIN": 20}):
+            self.assertEqual(self.audit(), {("appointments", self.ana.pk, (a, b))})
+
+    def test_encounters(self):
+        def visit(provider, hhmm, minutes):
+            start = self.at(hhmm)
+            return Encounter.objects.create(patient=self.patient, provider=provider, check_in=start,
+                                            check_out=start + timedelta(minutes=minutes)).pk
+
+        a = visit(self.ana, "14:00", 60)
+        b = visit(self.ana, "14:30", 10)
+        visit(self.ana, "15:00", 20)
+        Encounter.objects.create(patient=self.patient, provider=self.ana, check_in=self.at("14:10"))  # em aberto
+        self.assertEqual(self.audit(kinds=("encounters",)), {("encounters", self.ana.pk, (a, b))})
+
+    def test_window_edges_and_archive(self):
+        old = self.day - timedelta(days=10)
+        late = self.book(self.ana, "23:50", day=old - timedelta(days=1))
+        early = self.book(self.ana, "00:00", day=old)  # invade o dia seguinte
+        self.book(self.ana, "09:00", day=old - timedelta(days=5))
+        self.book(self.ana, "09:10", day=old - timedelta(days=5))
+        call_command("archive_history", days=5, stdout=StringIO())
+        self.assertFalse(Appointment.objects.filter(pk=late).exists())
+        since = timezone.make_aware(timezone.datetime.combine(old, timezone.datetime.min.time()))
+        found = overlaps.audit(since, since + timedelta(days=1), kinds=("appointments",))
+        self.assertEqual([c.ids for c in found], [[late, early]])
+
+    def test_command_and_admin_report(self):
+        a = self.book(self.ana, "09:00")
+        b = self.book(self.ana, "09:15")
+        out = StringIO()
+        call_command("audit_overlaps", days=7, csv=True, stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].startswith(f"appointments,{self.ana.pk},"))
+        self.assertTrue(lines[1].endswith(f"{a} {b}"))
+
+        user = get_user_model().objects.create_superuser("overlaps", "overlaps@example.com", "x")
+        self.client.force_login(user)
+        url = reverse("admin:clinic_appointment_overlaps")
+        response = self.client.get(url, {"days": 7})
+        self.assertContains(response, "Dra. Ana Reis")
+        self.assertContains(response, f"?id__in={a},{b}")
+        self.book(self.ana, "09:20")  # signal da agenda descarta o relatório em cache
+        self.assertContains(self.client.get(url, {"days": 7}), f"?id__in={a},{b},")
+
+
+class NoShowTests(TestCase):
+    """Risco de no-show (clinic.noshow): características sem vazamento, notas e widget."""
+
+    def setUp(self):
+        results().clear()
+        self.provider = Provider.objects.create(full_name="Dr. Caio Lima", specialty="Cardiologia")
+        self.faltoso = Patient.objects.create(full_name="Edu Faltoso", sex="M")
+        self.assiduo = Patient.objects.create(full_name="Gil Assíduo", sex="M")
+        self.now = timezone.now()
+
+    def book(self, patient, days, status):
+        return Appointment.objects.create(patient=patient, provider=self.provider, status=status,
+                                          scheduled_at=self.now + timedelta(days=days)).pk
+
+    def test_features_use_only_earlier_history(self):
+        first = self.book(self.faltoso, -20, "no_show")
+        second = self.book(self.faltoso, -10, "completed")
+        Encounter.objects.create(patient=self.faltoso, provider=self.provider,
+                                 check_in=self.now - timedelta(days=10), check_out=self.now - timedelta(days=10))
+        upcoming = self.book(self.faltoso, 2, "scheduled")
+        appts, encs = noshow.load()
+        X, base = noshow.features(appts, encs)
+        self.assertEqual(base, 0.5)
+        row = {pk: X[i] for i, pk in enumerate(appts["id"].tolist())}
+        rate, history, since, first_visit = (noshow.FEATURES.index(f) for f in
+                                             ("patient_rate", "patient_history", "since_encounter", "first_visit"))
+        w = noshow.PRIOR_WEIGHT
+        self.assertAlmostEqual(row[first][rate], 0.5)
+        self.assertAlmostEqual(row[second][rate], (1 + w * base) / (1 + w), places=6)
+        self.assertAlmostEqual(row[upcoming][rate], (1 + w * base) / (2 + w), places=6)
+        self.assertAlmostEqual(row[upcoming][history], np.log1p(2), places=6)
+        # o atendimento da própria consulta não conta; o da anterior, sim
+        self.assertEqual(row[second][first_visit], 1)
+        self.assertEqual(row[upcoming][first_visit], 0)
+        self.assertAlmostEqual(row[upcoming][since], np.log1p(12), places=4)
+
+    def test_scores_and_expected_no_shows_widget(self):
+        for days in range(-40, 0, 5):
+            self.book(self.faltoso, days, "no_show")
+            self.book(self.assiduo, days, "completed")
+        risky = self.book(self.faltoso, 1, "scheduled")
+        safe = self.book(self.assiduo, 1, "scheduled")
+        self.book(self.assiduo, 2, "cancelled")
+
+        user = get_user_model().objects.create_superuser("noshow", "noshow@example.com", "x")
+        self.client.force_login(user)
+        url = reverse("dashboard_widget", args=["expected-no-shows"])
+        self.assertEqual(self.client.get(url).json()[0]["expected"], 0)
+
+        out = StringIO()
+        call_command("score_no_shows", stdout=out)
+        self.assertIn("2 notas gravadas", out.getvalue())
+        scores = dict(NoShowScore.objects.values_list("appointment_id", "probability"))
+        self.assertEqual(set(scores), {risky, safe})
+        self.assertGreater(scores[risky], 0.5)
+        self.assertLess(scores[safe], 0.5)
+
+        day = self.client.get(url).json()[0]  # a execução descarta o widget em cache
+        self.assertEqual((day["cnt"], day["scored"]), (2, 2))
+        self.assertAlmostEqual(day["expected"], round(scores[risky] + scores[safe], 2))
+
+        Appointment.objects.filter(pk=risky).update(status="cancelled")
+        noshow.run(dry_run=True)
+        self.assertEqual(NoShowScore.objects.count(), 2)
+        noshow.run()
+        self.assertEqual(list(NoShowScore.objects.values_list("appointment_id", flat=True)), [safe])
+
+    def test_archive_drops_scores(self):
+        past = self.book(self.faltoso, -3, "scheduled")
+        NoShowScore.objects.create(appointment_id=past, probability=0.3, scored_at=self.now)
+        call_command("archive_history", days=0, stdout=StringIO())
+        self.assertTrue(ArchivedAppointment.objects.filter(pk=past).exists())
+        self.assertFalse(NoShowScore.objects.exists())
+
+
+class CsvExportTests(TestCase):
+    """Conteúdo do CSV em streaming: ordem entre blocos, procedimentos e intercalação com o arquivo."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_superuser("csv", "csv@example.com", "x")
+        self.client.force_login(self.user)
+        ana = Patient.objects.create(full_name="Ana Souza", sex="F", birth_date=date(1980, 5, 17))
+        beto = Patient.objects.create(full_name="Beto Lima", sex="M")
+        provider = Provider.objects.create(full_name="Dra. Nina Alves", specialty="Fisiatria")
+        category = ProcedureCategory.objects.create(name="Terapias")
+        ultra = Procedure.objects.create(code="PROC-US", name="Ultrassom", category=category)
+        laser = Procedure.objects.create(code="PROC-LASER", name="Laser", category=category)
+        now = timezone.now().replace(second=0, microsecond=0)
+        self.filters = DashboardFilters.from_params({"days": 60})
+        # (dias atrás, paciente, status, procedimentos na ordem de vínculo, fica
+        # quente ao arquivar); os três primeiros empatam no horário e atravessam
+        # a borda dos blocos de 2, e o do meio não vai para o arquivo
+        plan = [(40, ana, "completed", [ultra, laser], False), (40, beto, "completed", [], True),
+                (40, ana, "completed", [laser], False), (35, beto, "no_show", [], False),
+                (2, ana, "scheduled", [], False), (1, beto, "completed", [laser, ultra], False)]
+        self.expected = []
+        for days, patient, status, procs, kept in plan:
+            at = now - timedelta(days=days)
+            appt = Appointment.objects.create(patient=patient, provider=provider, scheduled_at=at, status=status)
+            if status == "completed":
+                enc = Encounter.objects.create(appointment=appt, patient=patient, provider=provider,
+                                               check_in=at, check_out=at + timedelta(minutes=20))
+                for proc in procs:
+                    enc.procedures.add(proc)
+                if kept:  # com avaliação de dor: fica nas tabelas quentes
+                    PainAssessment.objects.create(patient=patient, encounter=enc, recorded_at=at.date(), score=4)
+            self.expected.append([
+                timezone.localtime(at).strftime("%d/%m/%Y %H:%M"), patient.full_name,
+                {"F": "Feminino", "M": "Masculino"}[patient.sex],
+                "17/05/1980" if patient.birth_date else "", "Dra. Nina Alves", "Fisiatria",
+                dict(Appointment.STATUS)[status], "; ".join(p.name for p in procs),
+            ])
+
+    def lines(self, chunk_size):
+        return list(csv.reader(exports.csv_lines(self.filters, chunk_size=chunk_size)))
+
+    def test_content_across_chunks(self):
+        for chunk_size in (1, 2, 4, exports.CHUNK_SIZE):
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(self.lines(chunk_size), [exports.HEADER, *self.expected])
+        response = self.client.get(reverse("export_csv"), {"days": 60})
+        body = b"".join(response.streaming_content).decode()
+        self.assertEqual(list(csv.reader(body.splitlines())), [exports.HEADER, *self.expected])
+
+    def test_merges_archive_in_order(self):
+        before = self.lines(2)
+        archive.archive_before(timezone.now() - timedelta(days=10))
+        results().clear()
+        self.assertEqual(ArchivedAppointment.objects.count(), 3)
+        self.assertEqual(len(archive.sources(self.filters)), 2)
+        chunks = list(exports.filter_chunks(self.filters, chunk_size=2))
+        self.assertEqual([len(rows) for rows in chunks], [2, 2, 2])
+        order = [(r["scheduled_at"], r["id"]) for rows in chunks for r in rows]
+        self.assertEqual(order, sorted(order))
+        for chunk_size in (1, 2, 5):
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(self.lines(chunk_size), before)
+
+
+class ExportJobTests(TestCase):
+    """Exportação em segundo plano: fila, progresso, janela fixa e download com Range."""
+
+    def setUp(self):
+        self.enterContext(override_settings(CLINIC_EXPORTS_DIR=self.enterContext(tempfile.TemporaryDirectory())))
+        self.user = get_user_model().objects.create_superuser("export", "export@example.com", "x")
+        self.client.force_login(self.user)
+        patient = Patient.objects.create(full_name="Iara Costa", sex="F")
+        provider = Provider.objects.create(full_name="Dr. Jonas Reis", specialty="Pediatria")
+        now = timezone.now()
+        for hours in range(1, 6):
+            Appointment.objects.create(patient=patient, provider=provider, status="completed",
+                                       scheduled_at=now - timedelta(hours=hours))
+
+    def create(self, **params):
+        response = self.client.post(reverse("export_job_create") + "?days=1", params)
+        self.assertEqual(response.status_code, 201, response.content)
+        return ExportJob.objects.get(pk=response.json()["id"])
+
+    def run_next(self, chunk_size=2):
+        job = exports.claim_next_job()
+        self.assertIsNotNone(job)
+        return exports.run_job(job, chunk_size=chunk_size)
+
+    def download(self, job, **headers):
+        response = self.client.get(reverse("export_job_download", args=[job.pk]), headers=headers)
+        return response, b"".join(response.streaming_content) if response.streaming else response.content
+
+    def test_create_run_status_download(self):
+        job = self.create()
+        self.assertEqual(self.client.get(reverse("export_job", args=[job.pk])).json()["status"], "pending")
+        seen = []
+        chunks = exports.filter_chunks
+
+        def spy(*args, **kwargs):  # progresso gravado antes de cada bloco
+            for rows in chunks(*args, **kwargs):
+                seen.append(ExportJob.objects.get(pk=job.pk).rows_written)
+                yield rows
+        with mock.patch.object(exports, "filter_chunks", spy):
+            self.run_next()
+        self.assertEqual(seen, [0, 2, 4])
+
+        status = self.client.get(reverse("export_job", args=[job.pk])).json()
+        self.assertEqual((status["status"], status["rows_written"], status["rows_total"], status["percent"]),
+                         ("done", 5, 5, 100.0))
+        response, body = self.download(job)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(int(response["Content-Length"]), len(body))
+        lines = gzip.decompress(body).decode().splitlines()
+        self.assertEqual(lines[0].split(","), exports.HEADER)
+        self.assertEqual(len(lines), 6)
+
+    def test_range_and_if_range(self):
+        job = self.create()
+        self.run_next()
+        full, body = self.download(job)
+        size, etag = len(body), full["ETag"]
+
+        response, part = self.download(job, Range="bytes=0-9")
+        self.assertEqual((response.status_code, part, response["Content-Range"]),
+                         (206, body[:10], f"bytes 0-9/{size}"))
+        self.assertEqual(self.download(job, Range="bytes=10-")[1], body[10:])
+        self.assertEqual(self.download(job, Range="bytes=-5")[1], body[-5:])
+        self.assertEqual(self.download(job, Range="bytes=0-99999")[1], body)
+        # inválidos são ignorados: corpo inteiro com 200
+        for header in ("bytes=500-100", "bytes=abc", "bytes=0-1,4-5", "items=0-1", "bytes=-"):
+            response, data = self.download(job, Range=header)
+            self.assertEqual((response.status_code, data), (200, body), header)
+        # válidos mas fora do arquivo: 416
+        for header in (f"bytes={size}-", "bytes=-0"):
+            response, _ = self.download(job, Range=header)
+            self.assertEqual((response.status_code, response["Content-Range"]), (416, f"bytes */{size}"), header)
+
+        self.assertEqual(self.download(job, Range="bytes=0-9", **{"If-Range": etag})[0].status_code, 206)
+        response, data = self.download(job, Range="bytes=0-9", **{"If-Range": '"outro"'})
+        self.assertEqual((response.status_code, data), (200, body))
+
+    def test_window_fixed_when_queued(self):
+        job = self.create()
+        self.assertTrue(job.params["since"] and job.params["until"])
+        # marcada depois do pedido: um "últimos N dias" resolvido só na hora
+        # de rodar a incluiria
+        Appointment.objects.create(patient=Patient.objects.get(), provider=Provider.objects.get(),
+                                   scheduled_at=timezone.now(), status="scheduled")
+        self.assertEqual(self.run_next().rows_written, 5)
+
+    def test_stale_running_job_reclaimed(self):
+        now = timezone.now()
+        alive = self.create()
+        ExportJob.objects.filter(pk=alive.pk).update(status="running", heartbeat_at=now)
+        self.assertIsNone(exports.claim_next_job())
+        dead = self.create()
+        ExportJob.objects.filter(pk=dead.pk).update(status="running", rows_written=3,
+                                                    heartbeat_at=now - exports.STALE_AFTER * 2)
+        job = exports.claim_next_job()
+        self.assertEqual((job.pk, job.rows_written), (dead.pk, 0))
+        self.assertIsNone(exports.claim_next_job())  # já tem heartbeat novo
+        self.assertEqual(exports.run_job(job).status, "done")
+
+
+class RollupConsistencyTests(TestCase):
+    """Os signals mantêm DailyAppointmentStat igual ao cálculo direto sobre as tabelas brutas."""
+
+    def setUp(self):
+        call_command("seed_demo", stdout=StringIO(), patients=20, days=12, providers=2, care_plans=2)
+        self.now = timezone.now()
+
+    def assertConsistent(self):
+        stored = sorted(DailyAppointmentStat.objects.values_list(*rollups.Bucket._fields))
+        rollups.rebuild()
+        self.assertEqual(sorted(DailyAppointmentStat.objects.values_list(*rollups.Bucket._fields)), stored)
+        # janelas com bordas parciais (meio do dia) e de dias inteiros
+        today = rollups.day_start(timezone.localdate())
+        for since, until in ((self.now - timedelta(days=7, hours=5), self.now),
+                             (today - timedelta(days=10), today - timedelta(microseconds=1)),
+                             (self.now - timedelta(hours=3), self.now + timedelta(days=3))):
+            buckets = rollups.buckets(since, until)
+            appts = Appointment.objects.filter(scheduled_at__range=(since, until))
+            with self.subTest(since=since, until=until):
+                self.assertEqual(analytics.bucket_kpis(buckets), analytics.appointment_kpis(appts))
+                self.assertEqual(analytics.bucket_daily(buckets), analytics.daily_counts(appts))
+                self.assertEqual(analytics.bucket_specialties(buckets), analytics.specialty_counts(appts))
+                self.assertEqual(analytics.bucket_revenue(buckets), analytics.procedure_revenue(appts))
+
+    def completed(self):
+        return (Encounter.objects.filter(check_out__isnull=False, appointment__isnull=False,
+                                         procedures__isnull=False)
+                .order_by("id").distinct())
+
+    def test_appointment_changes(self):
+        self.assertConsistent()
+        appt = Appointment.objects.order_by("id").first()
+        Appointment.objects.create(patient=appt.patient, provider=appt.provider,
+                                   scheduled_at=self.now - timedelta(days=2), status="no_show")
+        self.assertConsistent()
+        appt.status = "cancelled" if appt.status != "cancelled" else "completed"
+        appt.save()
+        self.assertConsistent()
+        moved = Appointment.objects.order_by("-id").first()
+        moved.scheduled_at -= timedelta(days=3)  # suja o dia antigo e o novo
+        moved.provider = Provider.objects.exclude(pk=moved.provider_id).first()
+        moved.save()
+        self.assertConsistent()
+        Appointment.objects.filter(pk__in=Appointment.objects.order_by("id").values("id")[:3]).first().delete()
+        self.completed().first().appointment.delete()
+        self.assertConsistent()
+
+    def test_encounter_changes(self):
+        enc = self.completed().first()
+        enc.check_out += timedelta(minutes=25)
+        enc.save()
+        self.assertConsistent()
+        extra = Procedure.objects.exclude(encounter=enc).first()
+        enc.procedures.add(extra)
+        self.assertConsistent()
+        enc.procedures.remove(extra)
+        self.assertConsistent()
+        other = self.completed()[1]
+        extra.encounter_set.add(other)  # lado reverso do m2m
+        self.assertConsistent()
+        enc.procedures.clear()
+        self.assertConsistent()
+        other.delete()
+        self.assertConsistent()
+
+    def test_procedure_price_and_delete(self):
+        proc = (Procedure.objects.filter(encounter__in=self.completed(), care_steps__isnull=True)
+                .order_by("id").first())
+        proc.price_brl += 100
+        proc.save()
+        self.assertConsistent()
+        proc.delete()
+        self.assertConsistent()
+
+    def test_refresh_ignores_stale_archive_bounds(self):
+        """Um worker com os limites do arquivo ainda em cache não apaga os dias arquivados do rollup."""
+        results().clear()
+        self.assertEqual(archive.bounds(), (None, None))  # em cache, como num worker web
+        with mock.patch("clinic.archive.results", ResultCache):  # o arquivamento roda em outro processo
+            archive.archive_before(self.now - timedelta(days=5))
+        self.assertEqual(archive.bounds(), (None, None))
+        proc = (Procedure.objects.filter(archived_encounter__check_out__isnull=False, care_steps__isnull=True)
+                .order_by("id").first())
+        before = DailyAppointmentStat.objects.aggregate(total=Sum("revenue_brl"))["total"]
+        proc.price_brl += 100
+        proc.save()
+        stored = sorted(DailyAppointmentStat.objects.values_list(*rollups.Bucket._fields))
+        self.assertGreater(DailyAppointmentStat.objects.aggregate(total=Sum("revenue_brl"))["total"], before)
+        results().clear()
+        rollups.rebuild()
+        self.assertEqual(sorted(DailyAppointmentStat.objects.values_list(*rollups.Bucket._fields)), stored)
+
+
+class ResultCacheTests(TestCase):
+    """LRU, TTL, invalidação por período/tag e cálculos concorrentes com invalidação."""
+
+    def setUp(self):
+        self.clock = 1000.0
+        self.enterContext(mock.patch("clinic.cache.time.monotonic", lambda: self.clock))
+        self.cache = ResultCache(max_entries=2, ttl=60)
+        self.day = timezone.localdate()
+        self.calls = 0
+
+    def get(self, key, value=None, **kwargs):
+        def compute():
+            self.calls += 1
+            return value if value is not None else key
+        return self.cache.get_or_compute(key, compute, **kwargs)
+
+    def test_lru_and_ttl(self):
+        self.get("a"), self.get("b"), self.get("a")  # "b" fica como o menos usado
+        self.get("c")
+        self.assertEqual(self.calls, 3)
+        self.get("a")
+        self.get("b")  # foi despejado
+        self.assertEqual(self.calls, 4)
+        self.clock += 61
+        self.get("b")
+        self.assertEqual(self.calls, 5)
+        self.assertEqual({k: v for k, v in self.cache.stats().items() if k in ("hits", "misses", "evictions")},
+                         {"hits": 2, "misses": 5, "evictions": 2})
+
+    def test_invalidation_by_span_and_tag(self):
+        day = self.day
+        self.cache.max_entries = 10
+        self.get("week", span=(day - timedelta(days=6), day))
+        self.get("before", span=(day - timedelta(days=20), day - timedelta(days=7)))
+        self.get("tagged", tags=["protocols"])
+        self.assertEqual(self.cache.invalidate_days(day - timedelta(days=6)), 1)  # borda inclusiva
+        self.assertEqual(self.cache.invalidate_tag("protocols"), 1)
+        self.assertEqual(self.cache.invalidate_days(day + timedelta(days=1)), 0)
+        self.get("before", span=(day - timedelta(days=20), day - timedelta(days=7)))
+        self.assertEqual(self.calls, 3)
+        stats = self.cache.stats()
+        self.assertEqual((stats["entries"], stats["invalidations"], stats["hit_rate"]), (1, 2, 0.25))
+
+    def test_invalidated_while_computing_is_not_stored(self):
+        day = self.day
+        races = [
+            (dict(span=(day, day)), lambda: self.cache.invalidate_days(day)),
+            (dict(tags=["protocols"]), lambda: self.cache.invalidate_tag("protocols")),
+            (dict(span=(day, day)), self.cache.clear),
+        ]
+        for kwargs, invalidate in races:
+            def compute():
+                invalidate()  # outro request muda os dados no meio do cálculo
+                return "velho"
+            self.assertEqual(self.cache.get_or_compute("k", compute, **kwargs), "velho")
+            self.assertEqual(self.get("k", value="novo", **kwargs), "novo")
+            self.assertEqual(self.get("k", value="outro", **kwargs), "novo")
+            self.cache.clear()
+        self.assertEqual(self.cache.stats()["discarded"], 3)
+
+        # invalidação de outro período/tag não impede guardar
+        def compute():
+            self.cache.invalidate_days(day - timedelta(days=3))
+            self.cache.invalidate_tag("outra")
+            return "ok"
+        self.cache.get_or_compute("k", compute, span=(day, day), tags=["protocols"])
+        self.assertEqual(self.get("k", value="x", span=(day, day)), "ok")
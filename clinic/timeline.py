@@ -0,0 +1,109 @@
+"""
+Linha do tempo do paciente (dor + etapas dos planos) em JSON.
+
+`version()` resume o estado da linha do tempo em duas agregações pequenas
+(contagem e último updated_at de avaliações e de etapas): vira o ETag e o
+Last-Modified do endpoint, que responde 304 sem ler as séries quando o
+cliente já tem a versão atual.
+
+Séries maiores que o orçamento de pontos pedido são reduzidas por LTTB
+(Largest-Triangle-Three-Buckets): um ponto por balde, o que forma o maior
+triângulo com o ponto escolhido no balde anterior e a média do seguinte —
+preserva a forma da curva. Os extremos da série (menor e maior nota) e as
+avaliações nas datas das etapas são mantidos sempre, para que picos e os
+marcadores de procedimento continuem sobre a linha.
+"""
+import hashlib
+from bisect import bisect_left
+from collections import namedtuple
+
+from django.db.models import Count, Max
+
+from .models import CareStep, PainAssessment
+
+DEFAULT_POINTS = 500
+MIN_POINTS = 3
+MAX_POINTS = 5000
+
+Version = namedtuple("Version", "etag last_modified")
+
+
+def version(patient_id, points):
+    """ETag (depende também do orçamento de pontos) e Last-Modified da linha do tempo."""
+    pain = (PainAssessment.objects.filter(patient_id=patient_id)
+            .aggregate(n=Count("id"), last=Max("updated_at")))
+    steps = (CareStep.objects.filter(care_plan__patient_id=patient_id)
+             .aggregate(n=Count("id"), last=Max("updated_at")))
+    stamps = [s for s in (pain["last"], steps["last"]) if s is not None]
+    raw = f"{patient_id}:{points}:{pain['n']}:{pain['last']}:{steps['n']}:{steps['last']}"
+    return Version(f'"{hashlib.md5(raw.encode()).hexdigest()}"', max(stamps) if stamps else None)
+
+
+def lttb(xs, ys, threshold):
+    """Índices dos `threshold` pontos escolhidos por LTTB (primeiro e último sempre entram)."""
+    n = len(xs)
+    if threshold >= n or threshold < MIN_POINTS:
+        return list(range(n))
+    chosen = [0]
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        start, end = int(i * every) + 1, int((i + 1) * every) + 1
+        # média do balde seguinte (o último ponto, no fim da série)
+        nxt_start, nxt_end = end, min(int((i + 2) * every) + 1, n)
+        if nxt_start >= nxt_end:
+            nxt_start, nxt_end = n - 1, n
+        span = nxt_end - nxt_start
+        avg_x = sum(xs[nxt_start:nxt_end]) / span
+        avg_y = sum(ys[nxt_start:nxt_end]) / span
+
+        ax, ay = xs[a], ys[a]
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        chosen.append(best)
+        a = best
+    chosen.append(n - 1)
+    return chosen
+
+
+def downsample(xs, ys, budget, marks=()):
+    """
+    Índices a manter de uma série ordenada por x: tudo se couber em
+    `budget`; senão LTTB mais os obrigatórios — pontas, extremos de y e o
+    primeiro ponto com x >= cada valor de `marks`. Só passa do orçamento
+    se os obrigatórios sozinhos já passarem.
+    """
+    n = len(xs)
+    if n <= budget:
+        return list(range(n))
+    keep = {0, n - 1, min(range(n), key=ys.__getitem__), max(range(n), key=ys.__getitem__)}
+    keep |= {i for i in (bisect_left(xs, m) for m in marks) if i < n}
+    if len(keep) >= budget:
+        return sorted(keep)
+    chosen = set(lttb(xs, ys, max(MIN_POINTS, budget - len(keep) + 2)))
+    # os obrigatórios que o LTTB já escolheu não contam duas vezes
+    while len(chosen | keep) > budget and len(chosen) > MIN_POINTS:
+        chosen = set(lttb(xs, ys, max(MIN_POINTS, len(chosen) - (len(chosen | keep) - budget))))
+    return sorted(chosen | keep)
+
+
+def payload(patient_id, points=DEFAULT_POINTS):
+    """Séries de dor (reduzida a `points`) e de etapas do paciente."""
+    pain = list(PainAssessment.objects.filter(patient_id=patient_id)
+                .order_by("recorded_at", "id").values_list("recorded_at", "score"))
+    steps = [(done_at or scheduled_at, name) for scheduled_at, done_at, name in
+             CareStep.objects.filter(care_plan__patient_id=patient_id)
+             .order_by("scheduled_at", "id").values_list("scheduled_at", "done_at", "procedure__name")]
+
+    xs = [day.toordinal() for day, _ in pain]
+    kept = downsample(xs, [score for _, score in pain], points,
+                      marks=[day.toordinal() for day, _ in steps])
+    return {
+        "pain": [{"date": pain[i][0].isoformat(), "score": pain[i][1]} for i in kept],
+        "pain_total": len(pain),
+        "downsampled": len(kept) < len(pain),
+        "steps": [{"date": day.isoformat(), "proc": name} for day, name in steps],
+    }
@@ -1,235 +1,238 @@
-from datetime import timedelta, datetime, time
-import csv, json
+from functools import partial
+import json
 
 from django.contrib import messages
 from django.contrib.admin.views.decorators import staff_member_required
-from django.db.models import Count, Sum
-from django.db.models.functions import TruncDate
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
+from django.urls import reverse
 from django.utils import timezone
-from django.utils.dateparse import parse_date
+from django.views.decorators.http import require_POST
+from . import exports, parallel, payloads
+from .cache import results
+from .filters import DashboardFilters
 from .forms import StaffSignupForm
+from .widgets import BLOCKS, WIDGETS, Blocks
 from .models import (
-    Appointment, Encounter, Provider, Diagnosis, Procedure,
-    CarePlan, CareStep, PainAssessment, Patient
+    Provider, ExportJob,
+    CarePlan, Patient
 )
 
 @staff_member_required
 def dashboard(request):
-    # --- filtros ---
-    days = int(request.GET.get("days", 30))        # fallback quando não há start/end
-    status = request.GET.get("status") or ""       # completed, no_show, cancelled, scheduled
-    provider_id = request.GET.get("provider") or ""
-
-    start_str = request.GET.get("start") or ""
-    end_str = request.GET.get("end") or ""
-
-    start_date = parse_date(start_str) if start_str else None
-    end_date = parse_date(end_str) if end_str else None
-
-    # período: se vier start/end válidos usa; senão usa "days"
-    if start_date and end_date:
-        since = timezone.make_aware(datetime.combine(start_date, time.min))
-        until = timezone.make_aware(datetime.combine(end_date, time.max))
-    else:
-        since = timezone.now() - timedelta(days=days)
-        until = timezone.now()
-
-    appts = Appointment.objects.filter(scheduled_at__range=(since, until))
-    if status:
-        appts = appts.filter(status=status)
-    if provider_id:
-        appts = appts.filter(provider_id=provider_id)
-
-    # --- métricas principais ---
-    total = appts.count()
-    completed = appts.filter(status="completed").count()
-    no_show = appts.filter(status="no_show").count()
-    cancelled = appts.filter(status="cancelled").count()
-
-    completion_rate = round((completed / total * 100), 1) if total else 0
-    no_show_rate = round((no_show / total * 100), 1) if total else 0
-
-    encs = Encounter.objects.filter(appointment__in=appts, check_out__isnull=False)
-    durations = [e.duration_minutes for e in encs if e.duration_minutes is not None]
-    avg_minutes = round(sum(durations)/len(durations), 1) if durations else 0
-
-    # séries e agregações
-    daily_qs = (appts.annotate(day=TruncDate("scheduled_at"))
-                .values("day").annotate(cnt=Count("id")).order_by("day"))
-    daily = [{"day": d["day"].strftime("%Y-%m-%d"), "cnt": d["cnt"]} for d in daily_qs]
-
-    by_spec_qs = (appts.values("provider__specialty")
-                  .annotate(cnt=Count("id")).order_by("-cnt"))
-    by_spec = [{"spec": r["provider__specialty"], "cnt": r["cnt"]} for r in by_spec_qs]
-
-    top_dx_qs = (Diagnosis.objects
-                 .filter(encounter__appointment__in=appts, encounter__check_out__isnull=False)
-                 .values("code", "description").annotate(cnt=Count("id")).order_by("-cnt")[:10])
-    top_dx = [{"label": f'{r["code"]}', "cnt": r["cnt"]} for r in top_dx_qs]
-
-    # procedimentos + receita estimada (MVP)
-    proc_qs = (Procedure.objects
-        .filter(encounter__appointment__in=appts, encounter__check_out__isnull=False)
-        .values("name", "category__name")
-        .annotate(qtd=Count("id"))
-        .order_by("-qtd"))
-    procedures_data = [{"label": r["name"], "cnt": r["qtd"], "cat": r["category__name"]} for r in proc_qs]
-
-    proc_revenue_qs = (Encounter.objects
-        .filter(appointment__in=appts, check_out__isnull=False, procedures__isnull=False)
-        .values("procedures__id")
-        .annotate(subtotal=Sum("procedures__price_brl")))
-    revenue_total = float(sum(row["subtotal"] or 0 for row in proc_revenue_qs))
+    """
+    Esqueleto da dashboard: filtros e cartões vazios. Os números e gráficos
+    são buscados em paralelo pelo navegador em `dashboard_widget`.
+    """
+    try:
+        filters = DashboardFilters.from_params(request.GET)
+    except ValueError:
+        return HttpResponseBadRequest("Filtros inválidos.")
 
     # auxiliares
     specialties = list(Provider.objects.values_list("specialty", flat=True).distinct())
     providers = Provider.objects.order_by("full_name").values("id", "full_name")
 
-    # —— NOVO BLOCO: métricas de dor por protocolo ——
-    data_reduc = []
-    for code, label in CarePlan.PROTOCOLS:
-        plans = CarePlan.objects.filter(protocol=code)
-        if not plans.exists():
-            continue
-
-        reductions = []
-        weekly_points = {}  # média por semana (0..11)
-
-        for cp in plans:
-            pa = list(
-                PainAssessment.objects
-                .filter(patient=cp.patient, recorded_at__gte=cp.start_date)
-                .order_by("recorded_at")
-            )
-            if not pa:
-                continue
-
-            base = pa[0].score  # baseline
-            for i, p in enumerate(pa[:12]):        # até 12 semanas
-                weekly_points.setdefault(i, []).append(p.score)
-
-            if len(pa) > 8:
-                reductions.append(base - pa[8].score)
-            elif len(pa) > 1:
-                reductions.append(base - pa[-1].score)
-
-        mean_curve = [
-            {"week": i, "score": round(sum(v)/len(v), 2)}
-            for i, v in sorted(weekly_points.items())
-        ]
-        mean_reduction = round(sum(reductions)/len(reductions), 2) if reductions else 0.0
-
-        data_reduc.append({"protocol": label, "delta": mean_reduction, "curve": mean_curve})
-
-    # top procedimentos (apoio)
-    procs = (CareStep.objects.values("procedure__name")
-            .annotate(cnt=Count("id")).order_by("-cnt")[:8])
-    top_procs = [{"label": r["procedure__name"], "cnt": r["cnt"]} for r in procs]
-    
-    # Separa os payloads para o template
-    reductions_payload = [
-        {"protocol": x["protocol"], "delta": x["delta"]}
-        for x in data_reduc
-    ]
-    curves_payload = [
-        {"protocol": x["protocol"], "points": x["curve"]}
-        for x in data_reduc
-    ]
-
-    # contexto
     ctx = dict(
-        total=total, completed=completed, cancelled=cancelled, no_show=no_show,
-        completion_rate=completion_rate, no_show_rate=no_show_rate, avg_minutes=avg_minutes,
-        days=days, start=start_str, end=end_str, status=status, provider_id=str(provider_id),
+        days=filters.days, start=request.GET.get("start") or "", end=request.GET.get("end") or "",
+        status=filters.status, provider_id=filters.provider_id,
         specialties=specialties, providers=list(providers),
-        daily_json=json.dumps(daily), by_spec_json=json.dumps(by_spec), top_dx_json=json.dumps(top_dx),
-        procedures_json=json.dumps(procedures_data), revenue_total=round(revenue_total, 2),
-        # >>> ENTREGAS PARA OS NOVOS GRÁFICOS <<<
-        reductions_json=json.dumps(reductions_payload),
-        curves_json=json.dumps(curves_payload),
-        top_procs_json=json.dumps(top_procs),        
     )
     ctx["now"] = timezone.now() #type: ignore
     return render(request, "clinic/dashboard.html", ctx)
 
+
+@staff_member_required
+def dashboard_widget(request, widget):
+    """Dados de um widget da dashboard, com os mesmos filtros da página."""
+    compute = WIDGETS.get(widget)
+    if compute is None:
+        raise Http404("Widget desconhecido.")
+    try:
+        filters = DashboardFilters.from_params(request.GET)
+    except ValueError:
+        return JsonResponse({"error": "Filtros inválidos."}, status=400)
+    return JsonResponse(compute(Blocks(filters)), safe=False)
+
+
+@staff_member_required
+async def dashboard_widgets_async(request):
+    """
+    Todos os widgets numa resposta só. Os blocos independentes (agenda,
+    diagnósticos, procedimentos, protocolos...) são calculados em paralelo,
+    até settings.CLINIC_ASYNC_CONCURRENCY por vez.
+    """
+    try:
+        filters = DashboardFilters.from_params(request.GET)
+    except ValueError:
+        return JsonResponse({"error": "Filtros inválidos."}, status=400)
+
+    names = list(BLOCKS)
+    values = await parallel.gather([partial(BLOCKS[name], filters) for name in names])
+    blocks = Blocks(filters, precomputed=dict(zip(names, values)))
+    return JsonResponse({name: compute(blocks) for name, compute in WIDGETS.items()})
+
+
+@staff_member_required
+def dashboard_cache_stats(request):
+    """Contadores do cache de resultados (hits/misses), para acompanhar se compensa."""
+    return JsonResponse(results().stats())
+
 @staff_member_required
 def export_appointments_csv(request):
     # reaproveita os mesmos filtros da dashboard
-    days = int(request.GET.get("days", 30))
-    start = request.GET.get("start")
-    end = request.GET.get("end")
-    status = request.GET.get("status")
-    provider_id = request.GET.get("provider")
-
-    if start and end:
-        since = timezone.make_aware(datetime.combine(parse_date(start), datetime.min.time())) # type: ignore
-        until = timezone.make_aware(datetime.combine(parse_date(end), datetime.max.time())) # type: ignore
-    else:
-        since = timezone.now() - timedelta(days=days)
-        until = timezone.now()
+    try:
+        filters = DashboardFilters.from_params(request.GET)
+    except ValueError:
+        return HttpResponseBadRequest("Filtros inválidos.")
+
+    # resposta CSV em streaming: o cabeçalho sai antes da primeira query
+    response = StreamingHttpResponse(exports.csv_lines(filters),
+                                     content_type="text/csv")
+    response["Content-Disposition"] = 'attachment; filename="appointments.csv"'
+    return response
+
+def _job_payload(job):
+    total = job.rows_total or 0
+    return {
+        "id": job.pk,
+        "status": job.status,
+        "format": job.format,
+        "rows_written": job.rows_written,
+        "rows_total": job.rows_total,
+        "percent": round(job.rows_written / total * 100, 1) if total else (100.0 if job.status == "done" else 0.0),
+        "size_bytes": job.size_bytes,
+        "error": job.error,
+        "progress_url": reverse("export_job", args=[job.pk]),
+        "download_url": reverse("export_job_download", args=[job.pk]) if job.status == "done" else None,
+    }
 
-    qs = Appointment.objects.select_related("patient", "provider").filter(
-        scheduled_at__range=(since, until)
-    )
-    if status:
-        qs = qs.filter(status=status)
-    if provider_id:
-        qs = qs.filter(provider_id=provider_id)
 
-    # resposta CSV
-    response = HttpResponse(content_type="text/csv")
-    response["Content-Disposition"] = 'attachment; filename="appointments.csv"'
-    writer = csv.writer(response)
-    writer.writerow(["Data/Hora", "Paciente", "Sexo", "Nasc", "Médico", "Especialidade", "Status", "Procedimentos"])
+def _get_job(request, job_id):
+    jobs = ExportJob.objects.all()
+    if not request.user.is_superuser:
+        jobs = jobs.filter(requested_by=request.user)
+    return get_object_or_404(jobs, pk=job_id)
+
+
+@staff_member_required
+@require_POST
+def export_job_create(request):
+    """Enfileira uma exportação com os filtros da querystring (mesmos da dashboard)."""
+    params = request.POST.copy()
+    params.update(request.GET)
+    try:
+        filters = DashboardFilters.from_params(params)
+    except ValueError:
+        return JsonResponse({"error": "Filtros inválidos."}, status=400)
+    fmt = params.get("format") or "csv"
+    if fmt not in dict(ExportJob.FORMATS):
+        return JsonResponse({"error": "Formato inválido."}, status=400)
+
+    job = ExportJob.objects.create(requested_by=request.user, format=fmt, params=exports.job_params(filters))
+    return JsonResponse(_job_payload(job), status=201)
+
+
+@staff_member_required
+def export_job_status(request, job_id):
+    return JsonResponse(_job_payload(_get_job(request, job_id)))
+
+
+def _parse_range(header, size):
+    """
+    Interpreta um cabeçalho Range de intervalo único ("bytes=a-b", "bytes=a-",
+    "bytes=-n"). Retorna (início, fim) inclusivos — com início >= `size` se o
+    intervalo é válido mas não dá para atender — ou None para um cabeçalho
+    inválido ou com vários intervalos, que deve ser ignorado (RFC 9110 14.2).
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    first, sep, last = spec.strip().partition("-")
+    if not sep or (first and not first.isdigit()) or (last and not last.isdigit()) or not (first or last):
+        return None
+    if not first:                           # sufixo: últimos n bytes
+        n = int(last)
+        return (max(size - n, 0), size - 1) if n > 0 else (size, size - 1)
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    return start, min(int(last), size - 1) if last else size - 1
+
+
+def _file_chunks(path, start, length, block=64 * 1024):
+    with open(path, "rb") as fh:
+        fh.seek(start)
+        while length > 0:
+            data = fh.read(min(block, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+@staff_member_required
+def export_job_download(request, job_id):
+    """
+    Serve o arquivo pronto com suporte a Range/If-Range, para que downloads
+    interrompidos possam ser retomados de onde pararam.
+    """
+    job = _get_job(request, job_id)
+    path = exports.job_path(job)
+    if job.status != "done" or path is None or not path.exists():
+        raise Http404("Exportação ainda não disponível.")
+
+    stat = path.stat()
+    size = stat.st_size
+    etag = f'"{job.pk}-{size}-{int(stat.st_mtime)}"'
+    start, end = 0, size - 1
+
+    range_header = request.headers.get("Range")
+    if_range = request.headers.get("If-Range")
+    byte_range = None
+    if range_header and (not if_range or if_range == etag):
+        byte_range = _parse_range(range_header, size)
+    partial = byte_range is not None
+    if partial:
+        start, end = byte_range
+        if start >= size:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+            return response
+
+    length = end - start + 1 if size else 0
+    response = StreamingHttpResponse(_file_chunks(path, start, length),
+                                     status=206 if partial else 200,
+                                     content_type="application/gzip")
+    if partial:
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+    response["Content-Length"] = str(length)
+    response["Accept-Ranges"] = "bytes"
+    response["ETag"] = etag
+    response["Content-Disposition"] = f'attachment; filename="{job.download_name}"'
+    return response
+
 
 @staff_member_required
 def protocols_dashboard(request):
     """
     KPIs de dor: redução média por protocolo e curva média ao longo das semanas.
     """
-    # redução média (baseline - semana 8) por protocolo
-    data_reduc = []
-    for code, label in CarePlan.PROTOCOLS:
-        plans = CarePlan.objects.filter(protocol=code)
-        if not plans.exists():
-            continue
-
-        reductions = []
-        weekly_points = {}  # média por semana (0..11)
-
-        for cp in plans:
-            pa = list(PainAssessment.objects.filter(patient=cp.patient,
-                                                    recorded_at__gte=cp.start_date)
-                      .order_by("recorded_at"))
-            if not pa:
-                continue
-            # baseline = primeira medida
-            base = pa[0].score
-            # pega até 12 pontos
-            for i, p in enumerate(pa[:12]):
-                weekly_points.setdefault(i, []).append(p.score)
-            # redução até semana 8 (se houver)
-            if len(pa) > 8:
-                reductions.append(base - pa[8].score)
-            elif len(pa) > 1:
-                reductions.append(base - pa[-1].score)
-
-        # médias
-        mean_curve = [{"week": i, "score": round(sum(v)/len(v), 2)}
-                      for i, v in sorted(weekly_points.items())]
-        mean_reduction = round(sum(reductions)/len(reductions), 2) if reductions else 0.0
-
-        data_reduc.append({"protocol": label, "delta": mean_reduction, "curve": mean_curve})
-
-    # top procedimentos por contagem no período inteiro (apoio)
-    procs = (CareStep.objects.values("procedure__name")
-             .annotate(cnt=Count("id")).order_by("-cnt")[:8])
-    top_procs = [{"label": r["procedure__name"], "cnt": r["cnt"]} for r in procs]
+    ctx = {
+        # redução média (baseline - semana 8) e curva média por protocolo
+        "reductions_json": json.dumps(payloads.pain_protocols()),
+        # top procedimentos por contagem no período inteiro (apoio)
+        "top_procs_json": json.dumps(payloads.top_procedures()),
+    }
+    return render(request, "clinic/protocols_dashboard.html", ctx)
+
 
+@staff_member_required
+async def protocols_dashboard_async(request):
+    """Mesma página de `protocols_dashboard`, com as duas agregações em paralelo."""
+    reductions, top_procs = await parallel.gather([payloads.pain_protocols, payloads.top_procedures])
     ctx = {
-        "reductions_json": json.dumps(data_reduc),
+        "reductions_json": json.dumps(reductions),
         "top_procs_json": json.dumps(top_procs),
     }
     return render(request, "clinic/protocols_dashboard.html", ctx)
@@ -242,37 +245,10 @@ def patient_timeline(request, patient_id: int):
     CarePlan.objects.filter(patient=patient).order_by("-start_date")
 )
 
-    pain_qs = (
-        PainAssessment.objects
-        .filter(patient=patient)
-        .values("recorded_at", "score")
-        .order_by("recorded_at")
-    )
-
-    pain_json = json.dumps([
-        {"date": p["recorded_at"].strftime("%Y-%m-%d"), "score": p["score"]}
-        for p in pain_qs
-    ])
-
-    steps_qs = (
-        CareStep.objects
-        .filter(care_plan__patient=patient)
-        .order_by("scheduled_at")
-        .values("scheduled_at", "done_at", "procedure__name")
-    )
-    steps_json = json.dumps([
-        {
-            "date": (s["done_at"] or s["scheduled_at"]).strftime("%Y-%m-%d"),
-            "proc": s["procedure__name"],
-        }
-        for s in steps_qs
-    ])
-
+    # as séries vêm de /api/patients/<id>/timeline/ (ETag + redução de pontos)
     ctx = {
         "patient": patient,
         "plans": plans,
-        "pain_json": pain_json,
-        "steps_json": steps_json,
     }
     return render(request, "clinic/patient_timeline.html", ctx)
 
@@ -0,0 +1,95 @@
+"""
+Widgets da dashboard servidos como JSON (um endpoint por gráfico/cartão).
+
+A página da dashboard só renderiza o esqueleto e os filtros; cada widget é
+buscado em paralelo pelo navegador, então o mais lento (curvas de dor) não
+segura o primeiro paint. Os dados vêm dos blocos em cache de clinic.payloads.
+"""
+from . import payloads
+
+# blocos independentes entre si (cada um é uma ou poucas queries)
+BLOCKS = {
+    "appointments": payloads.appointments,
+    "top_dx": payloads.top_diagnoses,
+    "procedures": payloads.procedures,
+    "durations": payloads.durations,
+    "pain_protocols": lambda filters: payloads.pain_protocols(),
+    "top_procedures": lambda filters: payloads.top_procedures(),
+    "no_shows": payloads.expected_no_shows,
+}
+
+
+class Blocks:
+    """
+    Acesso preguiçoso aos blocos de um conjunto de filtros. `precomputed`
+    permite montar os widgets a partir de blocos já calculados (ex.: em
+    paralelo pela view assíncrona).
+    """
+
+    def __init__(self, filters, precomputed=None):
+        self.filters = filters
+        self._values = dict(precomputed or {})
+
+    def __getitem__(self, name):
+        if name not in self._values:
+            self._values[name] = BLOCKS[name](self.filters)
+        return self._values[name]
+
+
+def kpis(blocks):
+    return blocks["appointments"]["kpis"]
+
+
+def daily(blocks):
+    return blocks["appointments"]["daily"]
+
+
+def by_specialty(blocks):
+    return blocks["appointments"]["by_spec"]
+
+
+def top_diagnoses(blocks):
+    return blocks["top_dx"]
+
+
+def procedures(blocks):
+    return {
+        "items": blocks["procedures"],
+        "revenue_total": blocks["appointments"]["revenue_total"],
+    }
+
+
+def durations(blocks):
+    return blocks["durations"]
+
+
+def reductions(blocks):
+    return [{"protocol": x["protocol"], "delta": x["delta"]}
+            for x in blocks["pain_protocols"]]
+
+
+def curves(blocks):
+    return [{"protocol": x["protocol"], "points": x["curve"]}
+            for x in blocks["pain_protocols"]]
+
+
+def top_procedures(blocks):
+    return blocks["top_procedures"]
+
+
+def expected_no_shows(blocks):
+    return blocks["no_shows"]
+
+
+WIDGETS = {
+    "kpis": kpis,
+    "daily": daily,
+    "by-specialty": by_specialty,
+    "top-diagnoses": top_diagnoses,
+    "procedures": procedures,
+    "durations": durations,
+    "reductions": reductions,
+    "curves": curves,
+    "top-procedures": top_procedures,
+    "expected-no-shows": expected_no_shows,
+}
@@ -132,3 +132,36 @@ LOGOUT_REDIRECT_URL = "login"
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Dashboard: lê contagens/séries do rollup diário (clinic.rollups).
+# Desligue para agregar direto sobre Appointment.
+CLINIC_DASHBOARD_ROLLUPS = True
+
+# Cache de resultados da dashboard (clinic.cache): TTL em segundos e
+# número máximo de blocos guardados por processo (LRU).
+CLINIC_RESULT_CACHE = {"TTL": 120, "MAX_ENTRIES": 256}
+
+# Views assíncronas (dashboard/api/, protocolos/async/): quantas agregações
+# rodam em paralelo por requisição (cada uma usa uma conexão própria).
+CLINIC_ASYNC_CONCURRENCY = 4
+
+# Arquivos gerados pelas exportações em segundo plano (run_export_jobs).
+CLINIC_EXPORTS_DIR = BASE_DIR / "exports"
+
+# Arquivo histórico (clinic.archive): consultas mais antigas que isso vão
+# para as tabelas frias com `manage.py archive_history`.
+CLINIC_ARCHIVE_AFTER_DAYS = 365
+
+# Admin (clinic.pagination): acima de tantas linhas os changelists usam
+# contagem estimada/em cache em vez de COUNT(*) a cada página.
+CLINIC_ADMIN_COUNT_THRESHOLD = 50000
+
+# Busca de horários livres (clinic.slots): expediente, dias da semana
+# atendidos (0 = segunda), grade dos horários e quanto ocupa cada consulta.
+CLINIC_SCHEDULE = {
+    "DAY_START": "08:00",
+    "DAY_END": "18:00",
+    "WEEKDAYS": (0, 1, 2, 3, 4, 5),
+    "STEP_MIN": 15,
+    "APPOINTMENT_MIN": 30,
+}
@@ -19,11 +19,19 @@ from django.contrib import admin
 from django.urls import path
 from django.contrib.auth import views as auth_views
 
+from clinic import api
 from clinic.views import (
     dashboard,
+    dashboard_cache_stats,
+    dashboard_widget,
+    dashboard_widgets_async,
     export_appointments_csv,
+    export_job_create,
+    export_job_download,
+    export_job_status,
     staff_signup,                   # existe no seu views.py
     protocols_dashboard,         # se você já criou
+    protocols_dashboard_async,
     patient_timeline,            # se você já criou
     staff_signup,              # comente/retire se NÃO criou essa view
 )
@@ -32,6 +40,12 @@ urlpatterns = [
     path("admin/", admin.site.urls),
     path("dashboard/", dashboard, name="dashboard"),
     path("dashboard/export/", export_appointments_csv, name="export_csv"), # type: ignore
+    path("dashboard/export/jobs/", export_job_create, name="export_job_create"),
+    path("dashboard/export/jobs/<int:job_id>/", export_job_status, name="export_job"),
+    path("dashboard/export/jobs/<int:job_id>/download/", export_job_download, name="export_job_download"),
+    path("dashboard/cache/", dashboard_cache_stats, name="dashboard_cache_stats"),
+    path("dashboard/api/", dashboard_widgets_async, name="dashboard_widgets_async"),
+    path("dashboard/api/<slug:widget>/", dashboard_widget, name="dashboard_widget"),
 
     path("login/",  auth_views.LoginView.as_view(
         template_name="registration/login.html"), name="login"),
@@ -39,7 +53,15 @@ urlpatterns = [
 
     path("staff/novo/", staff_signup, name="staff_signup"), 
     
+    path("api/appointments/", api.appointments, name="api_appointments"),
+    path("api/encounters/", api.encounters, name="api_encounters"),
+    path("api/lookup/", api.lookup, name="api_lookup"),
+    path("api/diagnoses/autocomplete/", api.diagnosis_autocomplete, name="api_diagnosis_autocomplete"),
+    path("api/slots/", api.free_slots, name="api_free_slots"),
+    path("api/patients/<int:patient_id>/timeline/", api.patient_timeline, name="api_patient_timeline"),
+
     path("protocolos/", protocols_dashboard, name="protocols_dashboard"),
+    path("protocolos/async/", protocols_dashboard_async, name="protocols_dashboard_async"),
     path("pacientes/<int:patient_id>/linha-do-tempo/", patient_timeline, name="patient_timeline"),
 ]
 